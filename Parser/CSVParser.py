@@ -1,10 +1,12 @@
 import io
-from Parser import ENCODINGS, IParser, chunk_text
-from typing import List, Dict, Any
-import pandas as pd
+from Parser import IParser, chunk_text, detect_encodings
+from typing import List, Dict, Any, TYPE_CHECKING
 import logging
 import traceback
 
+if TYPE_CHECKING:
+    import pandas as pd
+
 class CSVChunkParser(IParser):
     """
     CSVファイルをチャンクに変換するクラスです。
@@ -12,17 +14,97 @@ class CSVChunkParser(IParser):
 
     Attributes:
         __encoding (str): ファイルのエンコーディングです。
+        __use_pyarrow (bool): PyArrowのCSVリーダーで読み込むかどうかです。
     """
 
-    def __init__(self, encoding="UTF-8", separator="<br>"):
+    def __init__(self, encoding="UTF-8", separator="<br>", use_pyarrow: bool = False):
         """
         CSVChunkParserのインスタンスを初期化します。
 
         Args:
             encoding (str, optional): ファイルのエンコーディングです。デフォルトは "UTF-8" です。
+            use_pyarrow (bool, optional): PyArrowのCSVリーダーで読み込む場合はTrueを指定します。デフォルトは False です。
         """
         self.__encoding = encoding
         self.__separator_charactor = separator
+        self.__use_pyarrow = use_pyarrow
+
+    def __read_csv(self, file_content: bytes) -> "pd.DataFrame":
+        """
+        pandasのCSVリーダーでCSVファイルを読み込みます。
+
+        Args:
+            file_content (bytes): ファイルの内容をバイト列で受け取ります。
+
+        Returns:
+            pd.DataFrame: 読み込んだデータフレームを返します。
+        """
+        import pandas as pd
+
+        # 推定したencodingから順に読み込みを実施
+        for encoding in detect_encodings(file_content):
+            try:
+                df = pd.read_csv(io.BytesIO(file_content), encoding=encoding)
+                self.__encoding = encoding
+                return df
+            except UnicodeDecodeError as e:
+                continue
+        raise ValueError("Failed to decode CSV file.")
+
+    def __read_csv_with_pyarrow(self, file_content: bytes) -> "pd.DataFrame":
+        """
+        PyArrowのCSVリーダーでCSVファイルを読み込みます。
+        バイト列をゼロコピーでバッファとして渡し、マルチスレッドで読み込みます。
+
+        Args:
+            file_content (bytes): ファイルの内容をバイト列で受け取ります。
+
+        Returns:
+            pd.DataFrame: 読み込んだデータフレームを返します。
+        """
+        import pyarrow as pa
+        import pyarrow.csv as pacsv
+
+        buffer = pa.py_buffer(file_content)
+        # 推定したencodingから順に読み込みを実施
+        for encoding in detect_encodings(file_content):
+            try:
+                table = pacsv.read_csv(
+                    pa.BufferReader(buffer),
+                    read_options=pacsv.ReadOptions(encoding=encoding, use_threads=True),
+                )
+                self.__encoding = encoding
+                return table.to_pandas()
+            except (pa.ArrowInvalid, UnicodeDecodeError) as e:
+                continue
+        raise ValueError("Failed to decode CSV file.")
+
+    def __to_markdown(self, df: "pd.DataFrame") -> str:
+        """
+        データフレームをMarkdownのテーブルに変換します。
+        チャンク化するだけなので、列幅の調整は行わずに文字列を結合します。
+        浮動小数点数の列は、to_markdown（tabulate）と同じ書式（"g"）で表記します（1.0は1、1234567.0は1.23457e+06）。
+
+        Args:
+            df (pd.DataFrame): 変換するデータフレームです。
+
+        Returns:
+            str: Markdown形式のテーブルを返します。
+        """
+        cells = df.astype(object)
+        for i, dtype in enumerate(df.dtypes):
+            if dtype.kind == "f":
+                cells.iloc[:, i] = [format(value, "g") for value in df.iloc[:, i].tolist()]
+        cells = cells.where(df.notna(), "").astype(str)
+        lines = [
+            "|" + "|".join(["", *map(str, df.columns)]) + "|",
+            "|" + "|".join(["---"] * (len(df.columns) + 1)) + "|",
+        ]
+        lines.extend(
+            "|" + "|".join([index, *row]) + "|"
+            for index, row in zip(df.index.astype(str), cells.to_numpy().tolist())
+        )
+        return "\n".join(lines)
 
     def parse(self, file_content: bytes) -> List[Dict[str, Any]]:
         """
@@ -35,21 +117,19 @@ class CSVChunkParser(IParser):
             List[Dict[str, Any]]: 行番号と各列の値を含む辞書のリストを返します。
         """
         try:
-            # 複数のencodingで読み込みを実施
-            for encoding in ENCODINGS:
-                try:
-                    df = pd.read_csv(io.BytesIO(file_content), encoding=encoding)
-                    self.__encoding = encoding
-                    break
-                except UnicodeDecodeError as e:
-                    continue
+            if self.__use_pyarrow:
+                df = self.__read_csv_with_pyarrow(file_content)
+            else:
+                df = self.__read_csv(file_content)
 
             # データフレームの中からNaNを削除
             df = df.dropna(how='all')
             df = df.dropna(axis=1, how='all')        
-            df = df.map(lambda x: x.replace('\n', '<br>') if isinstance(x, str) else x)
+            # 文字列の列のみを対象に改行をまとめて置換
+            obj_cols = df.select_dtypes(include='object').columns
+            df[obj_cols] = df[obj_cols].replace('\n', '<br>', regex=True)
             
-            csv_content = df.to_markdown()
+            csv_content = self.__to_markdown(df)
 
             chunks = chunk_text(text=csv_content)
             chunks_without_empty = list(filter(None, chunks))
@@ -1,11 +1,75 @@
 import io
 from Parser import IParser, chunk_text
+from itertools import zip_longest
 from typing import List, Dict, Any
-import pandas as pd
 import logging
 import re
 import traceback
 
+# Markdown記号（| - :）を削除するための変換テーブル
+_MARKDOWN_SYMBOLS = str.maketrans("", "", "|-:")
+# 0Unnamed 1Unnamedなどの列名
+_UNNAMED_PATTERN = re.compile(r"\d*Unnamed")
+
+def _cell_to_str(value: Any) -> str:
+    """
+    セルの値を文字列に変換します。
+    整数値の浮動小数点数は、pandasと同様に整数として表記します。
+
+    Args:
+        value (Any): セルの値
+
+    Returns:
+        str: 文字列に変換したセルの値
+    """
+    if value is None:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+def _is_number(value: Any) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def _format_column(values: List[Any]) -> List[str]:
+    """
+    列のセルの値を文字列に変換します。
+    以前のpandasとtabulate（to_markdown）による変換と同じ表記にするため、空のセルを除いて数値だけの列は、
+    空のセルがなくすべて整数値の場合は整数として、それ以外の場合はtabulateと同じ書式（"g"）で表記します（1234567.0は1.23457e+06）。
+    文字列を含む列は_cell_to_strで変換します。
+
+    Args:
+        values (List[Any]): 列のセルの値のリスト（ヘッダーを除く）
+
+    Returns:
+        List[str]: 文字列に変換したセルの値のリスト
+    """
+    numbers = [value for value in values if value is not None and value != ""]
+    if not numbers or not all(map(_is_number, numbers)):
+        return [_cell_to_str(value) for value in values]
+    if len(numbers) == len(values) and all(float(value).is_integer() for value in numbers):
+        return [str(int(value)) for value in values]
+    return ["" if value is None or value == "" else format(float(value), "g") for value in values]
+
+def _rows_to_markdown(rows: List[List[Any]]) -> str:
+    """
+    シートの行をMarkdownのテーブルに変換します。
+    先頭行をヘッダーとして扱い、それ以降の行は列ごとに_format_columnで変換します。
+
+    Args:
+        rows (List[List[Any]]): シートの行のリスト
+
+    Returns:
+        str: Markdown形式のテーブル
+    """
+    if not rows:
+        return ""
+    columns = [_format_column(list(column)) for column in zip_longest(*rows[1:], fillvalue="")]
+    lines = ["| " + " | ".join(map(_cell_to_str, rows[0])) + " |",
+             "|" + "|".join(["---"] * len(rows[0])) + "|"]
+    lines.extend("| " + " | ".join(row) + " |" for row in zip(*columns))
+    return "\n".join(lines)
+
 class ExcelChunkParser(IParser):
     """
     Excelブックをチャンクに変換するクラスです。
@@ -38,21 +102,23 @@ class ExcelChunkParser(IParser):
         """
         logging.info(f"Extracting texts from Excel.")
         try:
-            df_dict = pd.read_excel(io.BytesIO(file_content), sheet_name=None)
+            from python_calamine import CalamineWorkbook
+
+            workbook = CalamineWorkbook.from_filelike(io.BytesIO(file_content))
 
-            excel_content = ""
-            for sheet_name, df in df_dict.items():
-                df = df.fillna("")  # NaNを空文字に置換
-                df = df.astype(str)  # 全ての値を文字列に変換
-                excel_content += df.to_markdown(index=False, numalign="left", stralign="left") + self.__separator_charactor
+            sheet_contents = []
+            for sheet_name in workbook.sheet_names:
+                rows = workbook.get_sheet_by_name(sheet_name).to_python()
+                sheet_contents.append(_rows_to_markdown(rows))
+                sheet_contents.append(self.__separator_charactor)
+            excel_content = "".join(sheet_contents)
 
             # 不要なMarkdown記号などを削除
-            excel_content = excel_content.replace("|", "").replace("-", "").replace(":", "").strip()
+            excel_content = excel_content.translate(_MARKDOWN_SYMBOLS).strip()
             excel_content = excel_content.replace("  ", "") # 2つ以上の連続するスペースを削除
             excel_content = excel_content.replace("NaT", "") # NaTを削除
             # 0Unnamed 1Unnamedなどの列名を削除
-            excel_content = re.sub(r"\d+Unnamed", "", excel_content)
-            excel_content = excel_content.replace("Unnamed", "")
+            excel_content = _UNNAMED_PATTERN.sub("", excel_content)
 
             chunks = chunk_text(text=excel_content)
             chunks_without_empty = list(filter(None, chunks))
@@ -1,7 +1,5 @@
 from Parser import IParser
 from typing import List, Dict, Any
-
-from azure.ai.formrecognizer import DocumentAnalysisClient
 from azure.core.credentials import AzureKeyCredential
 import logging
 import os
@@ -25,6 +23,8 @@ class IMGChunkParser(IParser):
         """
         self.__separator_charactor = separator
         self.__encoding = encoding
+        from azure.ai.formrecognizer import DocumentAnalysisClient
+
         self.__document_analysis_client = DocumentAnalysisClient(
             endpoint=api_endpoint, credential=AzureKeyCredential(api_key)
         )
@@ -49,12 +49,8 @@ class IMGChunkParser(IParser):
             result = poller.result()
             page_with_text = []
             for idx, page in enumerate(result.pages):
-                texts = []
-                for line in page.lines:
-                    line_content = line.content
-                    if line_content.__len__() <= 10: # 10文字以下の行は無視
-                        continue
-                    texts.append(line.content)
+                # 10文字以下の行は無視
+                texts = [line.content for line in page.lines if len(line.content) > 10]
                 page_with_text.append(dict(page_number=idx, texts=texts))
             
             if not page_with_text:
@@ -1,10 +1,10 @@
 from Parser import IParser, TextParser, CSVParser, PDFParser, IMGParser, ExcelParser, WordParser, PowerpointParser
-from typing import List, Dict, Any
-import extract_msg  # extract_msgライブラリをインポート
+from typing import List, Dict, Any, Tuple, Callable
 import os
 import io
 import logging
-from functools import partial
+from functools import partial, cache
+from concurrent.futures import ThreadPoolExecutor
 import re
 import traceback
 
@@ -20,7 +20,7 @@ class MSGChunkParser(IParser):
         __separator_charactor (str): チャンクを分割するためのセパレータ文字列です。
     """
 
-    def __init__(self, separator="[。！？.?!\n]", max_chunk_size=1000, overlap=200):
+    def __init__(self, separator="[。！？.?!\n]", max_chunk_size=1000, overlap=200, max_workers=8):
         """
         MSGChunkParserのインスタンスを初期化します。
 
@@ -28,27 +28,43 @@ class MSGChunkParser(IParser):
             separator (str, optional): チャンクを分割するためのセパレータ文字列です。デフォルトは "[。！？.?!\n]" です。
             max_chunk_size (int, optional): チャンクの最大サイズです。デフォルトは1000です。
             overlap (int, optional): チャンク間のオーバーラップ文字数です。デフォルトは100です。
+            max_workers (int, optional): 添付ファイルを並列に解析する際の最大同時実行数です。デフォルトは8です。
         """
         self.__separator_charactor = separator
+        self.__separator_pattern = re.compile(rf"(?<={separator})")
         self.max_chunk_size = max_chunk_size
         self.overlap = overlap
+        self.__max_workers = max_workers
         
+        self.__parser = self._build_parser_map()
+
+    @classmethod
+    @cache
+    def _build_parser_map(cls) -> Dict[str, Callable[[], IParser]]:
+        """
+        拡張子ごとの添付ファイル用パーサーの対応表を作成します。
+        インスタンスごとに作り直さないよう、結果はキャッシュされます。
+
+        Returns:
+            Dict[str, Callable[[], IParser]]: 拡張子とパーサーの生成関数の辞書
+        """
         image_extensions = ["png", "jpg", "jpeg"]
         excel_extensions = ["xls", "xlsx"]
         word_extensions = ["doc", "docx"]
         powerpoint_extensions = ["ppt", "pptx"]
 
-        self.__parser = {
+        parser = {
             "txt": TextParser.TextChunkParser,
             "csv": CSVParser.CSVChunkParser,
             "pdf": partial(PDFParser.PDFChunkParser, api_endpoint=DI_API_ENDPOINT, api_key=DI_API_KEY),
-            "msg": MSGChunkParser,
+            "msg": cls,
         }
 
-        self.__parser.update({ext: partial(IMGParser.IMGChunkParser, api_endpoint=DI_API_ENDPOINT, api_key=DI_API_KEY) for ext in image_extensions})
-        self.__parser.update({ext: ExcelParser.ExcelChunkParser for ext in excel_extensions})
-        self.__parser.update({ext: WordParser.DocxChunkParser for ext in word_extensions})
-        self.__parser.update({ext: PowerpointParser.PPTXChunkParser for ext in powerpoint_extensions})
+        parser.update({ext: partial(IMGParser.IMGChunkParser, api_endpoint=DI_API_ENDPOINT, api_key=DI_API_KEY) for ext in image_extensions})
+        parser.update({ext: ExcelParser.ExcelChunkParser for ext in excel_extensions})
+        parser.update({ext: WordParser.DocxChunkParser for ext in word_extensions})
+        parser.update({ext: PowerpointParser.PPTXChunkParser for ext in powerpoint_extensions})
+        return parser
 
     def parse(self, file_content: bytes) -> List[Dict[str, Any]]:
         """
@@ -62,6 +78,8 @@ class MSGChunkParser(IParser):
         """
         
         try:
+            import extract_msg  # extract_msgライブラリをインポート
+
             msg = extract_msg.Message(io.BytesIO(file_content))
 
             subject = msg.subject if msg.subject else "No Subject"
@@ -93,27 +111,20 @@ class MSGChunkParser(IParser):
                 dict(page_number=0, texts=chunks)
             ]
             
+            # 添付ファイルを並列で解析し、添付順に結果を追加
+            tasks = []
             for idx, attachment in enumerate(msg.attachments):
                 file_name = attachment.name
                 if not file_name:
                     continue
                 
-                file_ext = file_name.split(".")[-1].lower()
-                file_content = attachment.data
-                
+                file_ext = file_name.rsplit(".", 1)[-1].lower()
                 if file_ext in self.__parser:
-                    parser = self.__parser[file_ext]()
-                    content_text = parser.parse(file_content)
-                    attachment_chunks = []
-                    for pt in content_text:
-                        attachment_chunks.extend(pt["texts"])
-                    
-                    attachment_text = f"#### [{file_name}]\n" + "\n".join(attachment_chunks)
-                    attachment_chunks = self.__create_chunks(attachment_text)
-                    
-                    page_with_chunk.append(
-                        dict(page_number=idx+1, texts=attachment_chunks)
-                    )
+                    tasks.append((idx, file_name, file_ext, attachment.data))
+
+            if tasks:
+                with ThreadPoolExecutor(max_workers=self.__max_workers) as executor:
+                    page_with_chunk.extend(executor.map(self.__parse_attachment, tasks))
                     
             if not page_with_chunk:
                 logging.critical("parsing failed")
@@ -126,6 +137,28 @@ class MSGChunkParser(IParser):
 
         return page_with_chunk
 
+    def __parse_attachment(self, task: Tuple[int, str, str, bytes]) -> Dict[str, Any]:
+        """
+        添付ファイルを解析してチャンクに変換します。
+
+        Args:
+            task (Tuple[int, str, str, bytes]): 添付ファイルのインデックス、ファイル名、拡張子、内容のタプル
+
+        Returns:
+            Dict[str, Any]: ページ番号とテキストのリストを含む辞書
+        """
+        idx, file_name, file_ext, file_content = task
+        parser = self.__parser[file_ext]()
+        content_text = parser.parse(file_content)
+        attachment_chunks = []
+        for pt in content_text:
+            attachment_chunks.extend(pt["texts"])
+        
+        attachment_text = f"#### [{file_name}]\n" + "\n".join(attachment_chunks)
+        attachment_chunks = self.__create_chunks(attachment_text)
+        
+        return dict(page_number=idx+1, texts=attachment_chunks)
+
     def __create_chunks(self, text: str) -> List[str]:
         """
         テキストを適切なサイズのチャンクに分割します。
@@ -137,24 +170,25 @@ class MSGChunkParser(IParser):
             List[str]: チャンクのリスト
         """
         chunks = []
-        current_chunk = ""
         sentences = self.__text_separator(text)
+        # 結合済みのテキストに対する開始・終了位置で現在のチャンクを表す
+        joined = "".join(sentences)
+        start = end = 0
 
         for sentence in sentences:
-            if len(current_chunk) + len(sentence) <= self.max_chunk_size:
-                current_chunk += sentence
-            else:
-                if current_chunk:
-                    chunks.append(current_chunk)
-                current_chunk = sentence
+            if end - start + len(sentence) > self.max_chunk_size:
+                if end > start:
+                    chunks.append(joined[start:end])
+                start = end
+            end += len(sentence)
 
             # オーバーラップを考慮
-            while len(current_chunk) >= self.max_chunk_size - self.overlap:
-                chunks.append(current_chunk[:self.max_chunk_size])
-                current_chunk = current_chunk[self.max_chunk_size - self.overlap:]
+            while end - start >= self.max_chunk_size - self.overlap:
+                chunks.append(joined[start:min(start + self.max_chunk_size, end)])
+                start += self.max_chunk_size - self.overlap
 
-        if current_chunk:
-            chunks.append(current_chunk)
+        if end > start:
+            chunks.append(joined[start:end])
 
         return chunks
     
@@ -168,7 +202,7 @@ class MSGChunkParser(IParser):
         Returns:
             List[str]: 分割されたテキストのリスト
         """
-        texts = re.split(rf"(?<={self.__separator_charactor})", text)  # 分割
-        texts = [t.strip() for t in texts if t.strip()]   # 0文字のものを除外
+        texts = self.__separator_pattern.split(text)  # 分割
+        texts = [t for t in (t.strip() for t in texts) if t]   # 0文字のものを除外
 
         return texts
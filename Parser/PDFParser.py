@@ -1,12 +1,11 @@
 from Parser import IParser
 from typing import List, Dict, Any
-from azure.ai.formrecognizer import DocumentAnalysisClient
 from azure.core.credentials import AzureKeyCredential
 import logging
 import os
 import re
-import pandas as pd
 import traceback
+from itertools import groupby
 
 class PDFChunkParser(IParser):
     """
@@ -29,16 +28,17 @@ class PDFChunkParser(IParser):
             overlap (int, optional): チャンク間のオーバーラップ文字数です。デフォルトは100です。
         """
         self.__separator_charactor = separator
+        self.__separator_pattern = re.compile(rf"(?<={separator})")
         self.__encoding = encoding
+        from azure.ai.formrecognizer import DocumentAnalysisClient
+
         self.__document_analysis_client = DocumentAnalysisClient(
             endpoint=api_endpoint, credential=AzureKeyCredential(api_key)
         )
-        self.__custom_dict = {
-            ":selected:": "",
-            ":unselected:": "",
-            "\t": " " * 4,
-            " ": "",
-        }
+        # 選択マーク（:selected: / :unselected:）を削除するパターン
+        self.__selection_mark_pattern = re.compile(r":(?:un)?selected:")
+        # タブは4文字のスペースに置換した後にスペースごと削除されるため、まとめて削除する
+        self.__whitespace_table = str.maketrans("", "", "\t ")
         self.max_chunk_size = max_chunk_size
         self.overlap = overlap
 
@@ -125,24 +125,25 @@ class PDFChunkParser(IParser):
             List[str]: チャンクのリスト
         """
         chunks = []
-        current_chunk = ""
         sentences = self.__text_separator(text)
+        # 結合済みのテキストに対する開始・終了位置で現在のチャンクを表す
+        joined = "".join(sentences)
+        start = end = 0
 
         for sentence in sentences:
-            if len(current_chunk) + len(sentence) <= self.max_chunk_size:
-                current_chunk += sentence
-            else:
-                if current_chunk:
-                    chunks.append(current_chunk)
-                current_chunk = sentence
+            if end - start + len(sentence) > self.max_chunk_size:
+                if end > start:
+                    chunks.append(joined[start:end])
+                start = end
+            end += len(sentence)
 
             # オーバーラップを考慮
-            while len(current_chunk) >= self.max_chunk_size - self.overlap:
-                chunks.append(current_chunk[:self.max_chunk_size])
-                current_chunk = current_chunk[self.max_chunk_size - self.overlap:]
+            while end - start >= self.max_chunk_size - self.overlap:
+                chunks.append(joined[start:min(start + self.max_chunk_size, end)])
+                start += self.max_chunk_size - self.overlap
 
-        if current_chunk:
-            chunks.append(current_chunk)
+        if end > start:
+            chunks.append(joined[start:end])
 
         return chunks
     
@@ -151,19 +152,23 @@ class PDFChunkParser(IParser):
         # 最大の行数と列数を定義
         max_rows, max_cols = data["row_count"], data["column_count"]
 
-        # リスト（テーブル）を初期化
-        table = [["" for _ in range(max_cols)] for __ in range(max_rows)]
+        import numpy as np
+        import pandas as pd
+
+        # 配列（テーブル）を初期化
+        table = np.full((max_rows, max_cols), "", dtype=object)
 
-        # セルの内容を適切な位置に配置
-        for cell in data['cells']:
-            # セルの開始行と列を取得
-            row, col = cell['row_index'], cell['column_index']
-            # セルの内容をテーブルに配置
-            table[row][col] = cell['content']
+        # セルの内容を適切な位置にまとめて配置
+        cells = data['cells']
+        rows = np.fromiter((cell['row_index'] for cell in cells), dtype=np.intp, count=len(cells))
+        cols = np.fromiter((cell['column_index'] for cell in cells), dtype=np.intp, count=len(cells))
+        contents = np.empty(len(cells), dtype=object)
+        contents[:] = [cell['content'] for cell in cells]
+        table[rows, cols] = contents
 
         # table
         df = pd.DataFrame(table[1:], columns=table[0])
-        df = df.map(lambda x: x.replace('\n', '<br>') if isinstance(x, str) else x)
+        df = df.replace('\n', '<br>', regex=True)
         return df.to_markdown()
     
     def __result2text(self, result) -> str:
@@ -179,19 +184,24 @@ class PDFChunkParser(IParser):
             for table_id, table in enumerate(tables_on_page):
                 for span in table.spans:
                     # replace all table spans with "table_id" in table_chars array
-                    for i in range(span.length):
-                        idx = span.offset - page_offset + i
-                        if idx >= 0 and idx < page_length:
-                            table_chars[idx] = table_id
+                    start = max(span.offset - page_offset, 0)
+                    end = min(span.offset - page_offset + span.length, page_length)
+                    if start < end:
+                        table_chars[start:end] = [table_id] * (end - start)
             # build page text by replacing charcters in table spans with table html
-            page_text = ""
+            # consecutive characters outside tables are copied as a single slice
+            page_texts = []
             added_tables = set()
-            for idx, table_id in enumerate(table_chars):
+            idx = 0
+            for table_id, run in groupby(table_chars):
+                run_length = sum(1 for _ in run)
                 if table_id == -1:
-                    page_text += result.content[page_offset + idx]
+                    page_texts.append(result.content[page_offset + idx:page_offset + idx + run_length])
                 elif not table_id in added_tables:
-                    page_text += "\n" + self.__table2md(tables_on_page[table_id]) + "\n"
+                    page_texts.append("\n" + self.__table2md(tables_on_page[table_id]) + "\n")
                     added_tables.add(table_id)
+                idx += run_length
+            page_text = "".join(page_texts)
 
             # page_text += " "
             # page_map.append((page_num, page_text))
@@ -242,8 +252,8 @@ class PDFChunkParser(IParser):
         Returns:
             List[str]: 分割されたテキストのリスト
         """
-        texts = re.split(rf"(?<={self.__separator_charactor})", text)  # 分割
-        texts = [t.strip() for t in texts if t.strip()]   # 0文字のものを除外
+        texts = self.__separator_pattern.split(text)  # 分割
+        texts = [t for t in (t.strip() for t in texts) if t]   # 0文字のものを除外
 
         return texts
 
@@ -258,7 +268,5 @@ class PDFChunkParser(IParser):
         Returns:
             str: 変換後のテキスト
         """
-        for old, new in self.__custom_dict.items():
-            text = text.replace(old, new).strip()
-        
-        return text
+        text = self.__selection_mark_pattern.sub("", text)
+        return text.translate(self.__whitespace_table).strip()
@@ -1,12 +1,57 @@
 from Parser import IParser, chunk_text
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Tuple, Union
 import logging
-from pptx import Presentation
 from io import BytesIO
 from utils.aoai import aoai_chatgpt
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import base64
+import hashlib
 import traceback
 
+def _extract_slide_contents(slides) -> List[List[Union[str, Tuple[bytes, str]]]]:
+    """
+    スライドからテキストと画像を抽出します。
+
+    Args:
+        slides: 抽出対象のスライド
+
+    Returns:
+        List[List[Union[str, Tuple[bytes, str]]]]: スライドごとのテキストと画像（バイトデータと拡張子のタプル）のリスト
+    """
+    slide_contents = []
+    for slide in slides:
+        contents = []
+        for shape in slide.shapes:
+            if hasattr(shape, "text"):
+                contents.append(shape.text)
+            if shape.shape_type == 13:  # 画像の場合
+                try:
+                    image = shape.image
+                    contents.append((image.blob, image.ext))
+                except Exception as e:
+                    # 画像の処理中にエラーが発生した場合はログに出力して処理を継続する
+                    logging.error(f"Error occurred while processing image: {e}")
+        slide_contents.append(contents)
+    return slide_contents
+
+def _extract_slide_range(file_content: bytes, start: int, stop: int) -> List[List[Union[str, Tuple[bytes, str]]]]:
+    """
+    PPTXファイルの指定範囲のスライドからテキストと画像を抽出します。
+    ProcessPoolExecutorのワーカーから呼び出すため、モジュールの関数として定義しています。
+
+    Args:
+        file_content (bytes): ファイルの内容
+        start (int): 抽出を開始するスライドのインデックス
+        stop (int): 抽出を終了するスライドのインデックス（このインデックスは含まない）
+
+    Returns:
+        List[List[Union[str, Tuple[bytes, str]]]]: スライドごとのテキストと画像のリスト
+    """
+    from pptx import Presentation
+
+    prs = Presentation(BytesIO(file_content))
+    return _extract_slide_contents(prs.slides[idx] for idx in range(start, stop))
+
 class PPTXChunkParser(IParser):
     """
     PPTXファイルをチャンクに変換するクラスです。
@@ -17,16 +62,20 @@ class PPTXChunkParser(IParser):
         __encoding (str): ファイルのエンコーディングです。
     """
 
-    def __init__(self, separator="。", encoding="UTF-8"):
+    def __init__(self, separator="。", encoding="UTF-8", max_workers=10, slide_workers=1):
         """
         PPTXChunkParserのインスタンスを初期化します。
 
         Args:
             separator (str, optional): チャンクを分割するためのセパレータ文字列です。デフォルトは "。" です。
             encoding (str, optional): ファイルのエンコーディングです。デフォルトは "UTF-8" です。
+            max_workers (int, optional): 画像の説明文を並列に生成する際の最大同時実行数です。デフォルトは10です。
+            slide_workers (int, optional): スライドからの抽出に使用するプロセス数です。1の場合は同一プロセスで抽出します。デフォルトは1です。
         """
         self.__separator_charactor = separator
         self.__encoding = encoding
+        self.__max_workers = max_workers
+        self.__slide_workers = slide_workers
         self.SUPPORTED_MIME_TYPES = {
             "jpg": "image/jpeg",
             "jpeg": "image/jpeg",
@@ -49,55 +98,70 @@ class PPTXChunkParser(IParser):
 
         # PPTXファイルの読み込み
         try: 
+            from pptx import Presentation
+
             prs = Presentation(BytesIO(file_content))
 
             # テキストと画像を抽出
-            all_texts = []
-            for slide_num, slide in enumerate(prs.slides, start=1):
-                slide_texts = []
-                for shape in slide.shapes:
-                    if hasattr(shape, "text"):
-                        slide_texts.append(shape.text)
-                    if shape.shape_type == 13:  # 画像の場合
+            slide_count = len(prs.slides)
+            if self.__slide_workers > 1 and slide_count > 1:
+                # スライドを連続した範囲に分割し、各プロセスで抽出する
+                workers = min(self.__slide_workers, slide_count)
+                step = -(-slide_count // workers)
+                with ProcessPoolExecutor(max_workers=workers) as executor:
+                    futures = [
+                        executor.submit(_extract_slide_range, file_content, start, min(start + step, slide_count))
+                        for start in range(0, slide_count, step)
+                    ]
+                    slide_contents = [contents for future in futures for contents in future.result()]
+            else:
+                slide_contents = _extract_slide_contents(prs.slides)
+
+            # 画像はスライド内の位置をimagesのインデックスで保持し、説明文は後でまとめて生成する
+            # テンプレート画像など同一内容の画像は1度だけエンコード・送信する
+            slide_pieces = []
+            images = []
+            image_indices = {}
+            for contents in slide_contents:
+                pieces = []
+                for content in contents:
+                    if isinstance(content, str):
+                        pieces.append(content)
+                        continue
+                    image_bytes, image_ext = content
+                    image_key = (hashlib.blake2b(image_bytes, digest_size=16).digest(), image_ext)
+                    if image_key not in image_indices:
                         try:
-                            # 画像をAzure OpenAIに送信
-                            image = shape.image
-                            image_bytes = image.blob
-                            image_base64 = self.__image_bytes_to_data_url(image_bytes, image.ext)
-                            print(image.ext)
-                            messages=[ # 4oに送るインプットメッセージ
-                                            { "role": "system", "content": "You are a helpful assistant." }, #システムコンテント
-                                            { "role": "user", "content": [ 
-                                                {
-                                                    "type": "text",
-                                                    "text": "この画像の内容だけを出力してください" # GPT-4oに送るプロンプト（画像の内容を4oに出力してもらう）
-                                                },
-                                                {
-                                                    "type": "image_url",
-                                                    "image_url": {
-                                                        "url": image_base64 # 画像のデータ
-                                                    }
-                                                }
-                                            ] }
-                                        ]
-                            image_description = aoai_chatgpt(messages)
-                            slide_texts.append(image_description)
-
+                            image_base64 = self.__image_bytes_to_data_url(image_bytes, image_ext)
                         except Exception as e:
                             # 画像の処理中にエラーが発生した場合はログに出力して処理を継続する
                             logging.error(f"Error occurred while processing image: {e}")
                             continue
+                        image_indices[image_key] = len(images)
+                        images.append(image_base64)
+                    pieces.append(image_indices[image_key])
+                slide_pieces.append(pieces)
 
-                all_texts.append("".join(slide_texts))
-
-            chunks = [chunk_text(text) for text in all_texts]
+            # 画像をAzure OpenAIに並列で送信
+            descriptions = []
+            if images:
+                with ThreadPoolExecutor(max_workers=self.__max_workers) as executor:
+                    descriptions = list(executor.map(self.__describe_image, images))
 
-            # 空のチャンクを削除
-            chunks_without_empty = [list(filter(None, chunk)) for chunk in chunks]
+            all_texts = []
+            for pieces in slide_pieces:
+                slide_texts = []
+                for piece in pieces:
+                    if isinstance(piece, str):
+                        slide_texts.append(piece)
+                    elif descriptions[piece] is not None:
+                        slide_texts.append(descriptions[piece])
+                all_texts.append("".join(slide_texts))
 
+            # チャンクに分割し、空のチャンクを削除
             page_with_chunk = [
-                dict(page_number=i, texts=chunk)
-                for i, chunk in enumerate(chunks_without_empty, start=1)
+                dict(page_number=i, texts=[chunk for chunk in chunk_text(text) if chunk])
+                for i, text in enumerate(all_texts, start=1)
             ]
             
             if not page_with_chunk:
@@ -111,6 +175,38 @@ class PPTXChunkParser(IParser):
         
         return page_with_chunk
 
+    def __describe_image(self, image_base64: str) -> Optional[str]:
+        """
+        画像の内容をAzure OpenAIで説明文に変換します。
+
+        Args:
+            image_base64: 画像のデータURL
+
+        Returns:
+            画像の説明文。エラーが発生した場合はNoneを返します。
+        """
+        messages=[ # 4oに送るインプットメッセージ
+                        { "role": "system", "content": "You are a helpful assistant." }, #システムコンテント
+                        { "role": "user", "content": [ 
+                            {
+                                "type": "text",
+                                "text": "この画像の内容だけを出力してください" # GPT-4oに送るプロンプト（画像の内容を4oに出力してもらう）
+                            },
+                            {
+                                "type": "image_url",
+                                "image_url": {
+                                    "url": image_base64 # 画像のデータ
+                                }
+                            }
+                        ] }
+                    ]
+        try:
+            return aoai_chatgpt(messages)
+        except Exception as e:
+            # 画像の処理中にエラーが発生した場合はログに出力して処理を継続する
+            logging.error(f"Error occurred while processing image: {e}")
+            return None
+
     def __image_bytes_to_data_url(self, image_bytes: bytes, ext: str) -> str:
         """
         画像のバイトデータと拡張子を受け取り、データURLを返します。
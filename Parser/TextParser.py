@@ -1,4 +1,4 @@
-from Parser import ENCODINGS, IParser, chunk_text
+from Parser import IParser, chunk_text, detect_encodings
 from typing import List, Dict, Any
 import logging
 import traceback
@@ -36,8 +36,8 @@ class TextChunkParser(IParser):
         """
         logging.info("Parsing text file.")
         try: 
-            # 複数のencodingで読み込みを実施
-            for encoding in ENCODINGS:
+            # 推定したencodingから順に読み込みを実施
+            for encoding in detect_encodings(file_content):
                 try:
                     text = file_content.decode(encoding=encoding)
                     self.__encoding = encoding
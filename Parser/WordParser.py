@@ -1,6 +1,5 @@
 from Parser import IParser, chunk_text
 from typing import List, Dict, Any
-from docx import Document
 import io
 import logging
 import traceback
@@ -35,18 +34,18 @@ class DocxChunkParser(IParser):
         """
         logging.info(f"Start parsing docx file.")
         try: 
+            from docx import Document
+
             doc = Document(io.BytesIO(file_content))
 
-            text = ""
-            for para in doc.paragraphs:
-                text += para.text
+            text = "".join(para.text for para in doc.paragraphs)
 
-            chunks = chunk_text(text=text)
-            chunks_without_empty = list(filter(None, chunks))
+            # 空のチャンクはテキストが空の場合のみ発生する
+            chunks = chunk_text(text=text, delimiters=self.__separator_charactor) if text else []
 
             page_with_chunk = [
                 dict(page_number=i, texts=[chunk])
-                for i, chunk in enumerate(chunks_without_empty)
+                for i, chunk in enumerate(chunks)
             ]
             
             if not page_with_chunk:
@@ -1,10 +1,63 @@
+import codecs
 from abc import ABC, abstractmethod
 from typing import List, Dict, Any
-from itertools import islice
+import charset_normalizer
 
 # 文字エンコード
 ENCODINGS = ['utf-8', 'shift_jis', 'euc_jp', 'iso2022_jp', 'cp932', 'utf-16', 'latin1']
 
+# charset_normalizerの推定を採用する条件（chaosは文字化けの度合い、coherenceは言語としての自然さ）
+MAX_CHAOS = 0.1
+MIN_COHERENCE = 0.2
+# エンコードでデコードできるかどうかを確認する、ファイルの先頭のバイト数
+DETECT_BYTES = 64 * 1024
+
+def _normalize_encoding(encoding: str) -> str:
+    """エンコード名をcodecsの正式名（'utf_8' -> 'utf-8' など）にそろえます。"""
+    return codecs.lookup(encoding).name
+
+def _can_decode(file_content: bytes, encoding: str) -> bool:
+    """
+    ファイルの先頭のDETECT_BYTESバイトを、指定されたエンコードでエラーなくデコードできるかどうかを返します。
+    インクリメンタルデコーダーを使用するため、先頭部分の末尾で文字が途切れていてもエラーになりません。
+    """
+    decoder = codecs.getincrementaldecoder(encoding)(errors='strict')
+    try:
+        decoder.decode(file_content[:DETECT_BYTES], final=len(file_content) <= DETECT_BYTES)
+        return True
+    except UnicodeError:
+        return False
+
+def detect_encodings(file_content: bytes) -> List[str]:
+    """
+    ファイルの文字エンコードを推定し、試行するエンコードの候補を返します。
+    ENCODINGSを順に試し、最初にファイルの先頭をエラーなくデコードできたエンコードを先頭にします（以降のエンコードは試しません）。
+    それがUTF-8でない場合に限り、charset_normalizerの推定がENCODINGSに含まれ、MAX_CHAOSとMIN_COHERENCEを満たし、
+    デコードできる場合だけ、そのエンコードを先頭にします。
+    短い日本語のテキストはUTF-16やBig5と誤って推定されることがあるため、条件を満たさない推定は使用しません。
+    先頭だけを確認するため、呼び出し元は候補を順に試し、デコードに失敗した場合は次の候補を使用してください。
+
+    Args:
+        file_content (bytes): ファイルの内容（バイト列）
+
+    Returns:
+        List[str]: 試行するエンコードのリスト（codecsの正式名）
+    """
+    candidates = list(dict.fromkeys(_normalize_encoding(encoding) for encoding in ENCODINGS))
+    first = next((encoding for encoding in candidates if _can_decode(file_content, encoding)), None)
+    if first is None or first == 'utf-8':
+        return candidates
+    ordered = [first] + [encoding for encoding in candidates if encoding != first]
+
+    match = charset_normalizer.from_bytes(file_content).best()
+    if match is None:
+        return ordered
+    guess = _normalize_encoding(match.encoding)
+    if (guess in candidates and guess != first and match.chaos <= MAX_CHAOS and match.coherence >= MIN_COHERENCE
+            and _can_decode(file_content, guess)):
+        return [guess] + [encoding for encoding in ordered if encoding != guess]
+    return ordered
+
 # パーサーのインターフェース
 class IParser(ABC):
     @abstractmethod
@@ -19,15 +72,17 @@ class IParser(ABC):
 
 
 # パーサ用のユーティリティ関数
-def chunk_text(text: str, chunk_size: int = 1024, overlap: int = 0, min_chunk_size: int = 1) -> list[str]:
+def chunk_text(text: str, chunk_size: int = 1024, overlap: int = 0, min_chunk_size: int = 1, delimiters: str = "") -> list[str]:
     """
     テキストを指定されたサイズでチャンクに分割します。
+    区切り文字を指定した場合は、チャンクの末尾をチャンク内で最後に現れる区切り文字の直後に揃えます。
 
     Args:
         text (str): 分割するテキスト
         chunk_size (int, optional): チャンクの最大文字数。デフォルトは1024です。
         overlap (int, optional): オーバーラップする文字数。デフォルトは0です。
         min_chunk_size (int, optional): チャンクの最小文字数。デフォルトは1です。
+        delimiters (str, optional): チャンクの区切りとする文字の集合。デフォルトは区切りなしです。
 
     Returns:
         list[str]: チャンクのリスト
@@ -39,14 +94,25 @@ def chunk_text(text: str, chunk_size: int = 1024, overlap: int = 0, min_chunk_si
     if text_length <= chunk_size:
         return [text]
 
-    chunks = []
-    it = iter(text)
-    while True:
-        chunk = "".join(islice(it, chunk_size))
-        if len(chunk) < min_chunk_size:
-            break
-        chunks.append(chunk)
-        for _ in range(chunk_size - overlap):
-            next(it, None)  # オーバーラップ分だけイテレータを進める
-
-    return chunks
+    if not delimiters:
+        # オーバーラップ分だけ戻した位置から次のチャンクを切り出す
+        # 直前のチャンクで末尾まで含まれた後の、重複だけのチャンクは作らない
+        step = chunk_size - overlap
+        chunks = [text[start:start + chunk_size] for start in range(0, text_length - overlap, step)]
+    else:
+        chunks = []
+        start = 0
+        while True:
+            end = start + chunk_size
+            if end >= text_length:
+                chunks.append(text[start:])
+                break
+            # チャンク内で最後に現れる区切り文字の直後で区切る
+            # 区切り文字がない、または次のチャンクが進まない位置の場合は最大文字数で区切る
+            boundary = max(text.rfind(delimiter, start, end) for delimiter in delimiters) + 1
+            if boundary > start + overlap:
+                end = boundary
+            chunks.append(text[start:end])
+            start = end - overlap
+
+    return [chunk for chunk in chunks if len(chunk) >= min_chunk_size]
@@ -1,11 +1,11 @@
 import os
 import logging
 import base64
-import json
-import traceback
-import io
 import csv
-from typing import List
+import io
+import orjson
+import traceback
+from typing import Iterable, Iterator, List, Optional
 
 import azure.functions as func
 from azure.storage.queue import QueueClient
@@ -19,6 +19,7 @@ from utils.searchers.keyword_search import KeywordSearch
 from utils.searchers.vector_search import VectorSearch
 from utils.blob_document_processor import BlobDocumentProcessor
 from utils.azure_embedder import AzureEmbedder
+from utils.embedding_cache import EmbeddingCache
 from utils.document_parser import DocumentParser
 
 from config import (
@@ -39,11 +40,19 @@ from config import (
 
 from genie_bp import genie_bp
 
+# 前回起動時のBLOBファイル一覧を改行区切りで保存するファイル名
+SNAPSHOT_BLOB_NAME = "indexed_blob_snapshot.txt"
+# 以前のバージョンがBLOBファイル一覧を1行のCSVで保存していたファイル名（新しいファイルがない場合に読み込む）
+LEGACY_SNAPSHOT_BLOB_NAME = "indexed_blob_snapshot.csv"
+
 app = func.FunctionApp(http_auth_level=func.AuthLevel.FUNCTION)
 
 app.register_blueprint(genie_bp)
 
-blob_manager = BlobManager(account_url=BLOB_STORAGE_URI, credential=DefaultAzureCredential())
+# 認証情報はトークンキャッシュを再利用するため、ワーカー内で1つだけ作成して共有する
+credential = DefaultAzureCredential()
+
+blob_manager = BlobManager(account_url=BLOB_STORAGE_URI, credential=credential)
 # blob_manager = BlobManager(connection_string=CONNECTION_STRING)
 
 parser = DocumentParser(DI_API_ENDPOINT, DI_API_KEY)
@@ -52,7 +61,8 @@ embedder = AzureEmbedder(
             api_key=AOAI_API_KEY,
             api_version=EMBEDDING_VERSION,
             azure_endpoint=AOAI_API_ENDPOINT,
-            deployment_name=EMBEDDING_DEPLOYMENT_NAME
+            deployment_name=EMBEDDING_DEPLOYMENT_NAME,
+            cache=EmbeddingCache(blob_manager, DB_CONTAINER_NAME)
         )
 
 mapping_manager = ChunkMappingManager(blob_manager, searchers = {
@@ -60,6 +70,8 @@ mapping_manager = ChunkMappingManager(blob_manager, searchers = {
                 'vector': VectorSearch(blob_manager, embedder, DB_CONTAINER_NAME, 'indexes/vector_index')
             })
 
+blob_processor = BlobDocumentProcessor(blob_manager, parser, embedder, mapping_manager)
+
 @app.blob_trigger(arg_name="myblob", path=f"{DOC_CONTAINER_NAME}/{{name}}",connection="BlobStorageConnection") 
 # @app.blob_trigger(arg_name="myblob", path=f"{DOC_CONTAINER_NAME}/{{name}}",connection="CONNECTION_STRING") 
 def blob_trigger(myblob: func.InputStream):
@@ -79,7 +91,7 @@ def blob_trigger(myblob: func.InputStream):
         
         logging.info(f"Processing blob: Name: {blob_name}")
 
-        queue_client = QueueClient(account_url=QUEUE_STORAGE_URI, queue_name=QUEUE_NAME, credential=DefaultAzureCredential())
+        queue_client = QueueClient(account_url=QUEUE_STORAGE_URI, queue_name=QUEUE_NAME, credential=credential)
         queue_client = QueueClient.from_connection_string(conn_str=CONNECTION_STRING, queue_name=QUEUE_NAME)
 
         queue_client.send_message(content=base64.b64encode(blob_name.encode()).decode())
@@ -105,10 +117,7 @@ def check_deleted_blobs(timer: func.TimerRequest) -> None:
     """
     logging.info('check_deleted_blobs function started.')
     try:
-
-        blob_processor = BlobDocumentProcessor(blob_manager, parser, embedder, mapping_manager)
-        
-        blob_service_client = BlobServiceClient(account_url=BLOB_STORAGE_URI, credential=DefaultAzureCredential())
+        blob_service_client = BlobServiceClient(account_url=BLOB_STORAGE_URI, credential=credential)
         # blob_service_client = BlobServiceClient.from_connection_string(CONNECTION_STRING)
         doc_container_client = blob_service_client.get_container_client(container=DOC_CONTAINER_NAME)
         db_container_client = blob_service_client.get_container_client(container=DB_CONTAINER_NAME)
@@ -116,27 +125,29 @@ def check_deleted_blobs(timer: func.TimerRequest) -> None:
         # 前回起動時に退避しておいたBLOBファイル一覧を取得
         indexed_blob_names = load_indexed_blob_snapshot(db_container_client)
         
-        # スナップショットの作成
-        snapshot_blob_files(doc_container_client, db_container_client)
-
-        # 前回起動時には存在していたが、現状存在しないBLOBファイル名の一覧を作成する
-        current_blob_files = doc_container_client.list_blobs()
-        current_blob_names = [blob.name for blob in current_blob_files]
-        deleted_blob_names = list(set(indexed_blob_names) - set(current_blob_names))
-        logging.info(f"Number of deleted files: {str(len(deleted_blob_names))}")
+        # スナップショットの作成（作成時に取得したファイル一覧を削除判定にも使用する）
+        current_blob_names = snapshot_blob_files(doc_container_client, db_container_client)
+        if current_blob_names is None:
+            # 現在のファイル一覧が取得できない場合、誤って削除しないよう処理を中断する
+            return
 
-        for deleted_blob in deleted_blob_names:
+        # 前回起動時には存在していたが、現状存在しないBLOBファイルを順に削除する
+        deleted_count = 0
+        for deleted_blob in iter_deleted_blob_names(indexed_blob_names, current_blob_names):
             logging.info(f"Deleted blob: {deleted_blob}")
             blob_processor.delete_document(DOC_CONTAINER_NAME, deleted_blob)
+            deleted_count += 1
             
             logging.info(f"Deleted {deleted_blob} from the index.")
 
+        logging.info(f"Number of deleted files: {str(deleted_count)}")
+
     except FileNotFoundError:
-        # indexed_blob_snapshot.csv が見つからない場合
+        # スナップショットが見つからない場合
         # 削除処理は実行せず、スナップショットの作成だけを行う
-        logging.error("indexed_blob_snapshot.csv not found in the DB container.")
+        logging.error(f"{SNAPSHOT_BLOB_NAME} not found in the DB container.")
         snapshot_blob_files(doc_container_client, db_container_client)
-        logging.info("Created indexed_blob_snapshot.csv.")
+        logging.info(f"Created {SNAPSHOT_BLOB_NAME}.")
 
     except Exception as e:
         logging.error(f"Error occurred in check_deleted_blobs: {e}")
@@ -169,8 +180,6 @@ def index_queued_blobs(azqueue: func.QueueMessage) -> None:
             logging.info(f"Blob {doc_blobname} already processed. Skipping.")
             return
 
-        blob_processor = BlobDocumentProcessor(blob_manager, parser, embedder, mapping_manager)
-        
         blob_processor.process_and_save_document(DOC_CONTAINER_NAME, doc_blobname)
         
         # 処理済みマーカーをメタデータとして設定
@@ -202,7 +211,7 @@ def search_vector(req: func.HttpRequest) -> func.HttpResponse:
         logging.info(f"Search results: {search_results}")
 
         # Return the search results as a JSON response
-        return func.HttpResponse(json.dumps(search_results), mimetype="application/json")
+        return func.HttpResponse(orjson.dumps(search_results), mimetype="application/json")
 
     except Exception as e:
         logging.error(f"Error occurred during search: {e}")
@@ -228,47 +237,66 @@ def search_keyword(req: func.HttpRequest) -> func.HttpResponse:
         logging.info(f"Search results: {search_results}")
 
         # Return the search results as a JSON response
-        return func.HttpResponse(json.dumps(search_results), mimetype="application/json")
+        return func.HttpResponse(orjson.dumps(search_results), mimetype="application/json")
 
     except Exception as e:
         logging.error(f"Error occurred during search: {e}")
         return func.HttpResponse("An error occurred during search", status_code=500)
 
-def snapshot_blob_files(doc_container_client: ContainerClient, db_container_client: ContainerClient) -> None:
+def snapshot_blob_files(doc_container_client: ContainerClient, db_container_client: ContainerClient) -> Optional[List[str]]:
     """
-    BLOBに格納されているファイル一覧をCSVファイルとしてDBコンテナに保存します。
+    BLOBに格納されているファイル一覧を改行区切りのテキストファイルとしてDBコンテナに保存します。
 
     Args:
         doc_container_client (ContainerClient): ドキュメントコンテナにアクセスするために使用するコンテナクライアント。
         db_container_client (ContainerClient): DBコンテナにアクセスするために使用するコンテナクライアント。
 
     Returns:
-        None
+        Optional[List[str]]: 保存したBLOBファイル一覧。エラーが発生した場合はNone。
     """
 
     try:
-        # 現在のBLOBに格納されているファイル一覧を取得
-        indexed_blobs = doc_container_client.list_blobs()
-        indexed_blob_names = [blob.name for blob in indexed_blobs]
-        logging.info(f"Indexed blobs: {indexed_blob_names}")
-
-        # BLOBに格納されているファイル一覧をCSVファイルとしてDBコンテナに保存する
-        # ファイル名は「indexed_blob_snapshot.csv」
-        indexed_blob_snapshot_buffer = io.StringIO()
-        indexed_blob_snapshot_writer = csv.writer(indexed_blob_snapshot_buffer)
-        indexed_blob_snapshot_writer.writerow(indexed_blob_names)
-        logging.info("Created indexed_blob_snapshot.csv.")
-
-        # 作成したCSVファイルをBLOBにアップロード（上書き）
+        # 現在のBLOBに格納されているファイル一覧をページ単位で取得
+        # list_blobsは名前順で返すが、削除判定のマージが前提とするため念のため整列しておく
+        indexed_blob_names = []
+        for page in doc_container_client.list_blob_names(results_per_page=5000).by_page():
+            indexed_blob_names.extend(page)
+        indexed_blob_names.sort()
+        logging.info(f"Number of indexed blobs: {len(indexed_blob_names)}")
+
+        # BLOBに格納されているファイル一覧を改行区切りでDBコンテナにアップロード（上書き）
         # ファイルが存在しない場合は作成する
-        blob_client = db_container_client.get_blob_client("indexed_blob_snapshot.csv")
-        blob_client.upload_blob(indexed_blob_snapshot_buffer.getvalue(), overwrite=True)
-        logging.info("Uploaded indexed_blob_snapshot.csv to the DB container.")
+        blob_client = db_container_client.get_blob_client(SNAPSHOT_BLOB_NAME)
+        blob_client.upload_blob("\n".join(indexed_blob_names), overwrite=True)
+        logging.info(f"Uploaded {SNAPSHOT_BLOB_NAME} to the DB container.")
 
     except Exception as e:
         logging.error(f"Error occurred during snapshot_blob_files: {e}")
+        return None
 
-    return
+    return indexed_blob_names
+
+def iter_deleted_blob_names(indexed_blob_names: Iterable[str], current_blob_names: Iterable[str]) -> Iterator[str]:
+    """
+    前回のスナップショットには存在するが、現在は存在しないBLOBファイル名を順に返します。
+    どちらの一覧も名前順に整列されていることを前提に、両者を先頭から同時に走査します。
+
+    Args:
+        indexed_blob_names (Iterable[str]): 前回のスナップショットのBLOBファイル一覧（名前順）。
+        current_blob_names (Iterable[str]): 現在のBLOBファイル一覧（名前順）。
+
+    Yields:
+        str: 削除されたBLOBファイル名。
+    """
+    current_iter = iter(current_blob_names)
+    current_name = next(current_iter, None)
+    for indexed_name in indexed_blob_names:
+        # 現在の一覧を、前回の名前に追いつくまで読み進める
+        while current_name is not None and current_name < indexed_name:
+            current_name = next(current_iter, None)
+
+        if current_name != indexed_name:
+            yield indexed_name
 
 def load_indexed_blob_snapshot(db_container_client: ContainerClient) -> List[str]:
     """
@@ -281,29 +309,52 @@ def load_indexed_blob_snapshot(db_container_client: ContainerClient) -> List[str
         List[str]: DBコンテナに保存されているBLOBファイル一覧。
 
     Raises:
-        FileNotFoundError: "indexed_blob_snapshot.csv" が見つからない場合
+        FileNotFoundError: スナップショットが見つからない場合
         Exception: その他のエラーが発生した場合
     """
 
     try:
         # DBコンテナに保存されているBLOBファイル一覧を取得
-        if not db_container_client.get_blob_client("indexed_blob_snapshot.csv").exists():
-            raise FileNotFoundError
-        
-        blob_client = db_container_client.get_blob_client("indexed_blob_snapshot.csv")
+        blob_client = db_container_client.get_blob_client(SNAPSHOT_BLOB_NAME)
+        if not blob_client.exists():
+            return load_legacy_blob_snapshot(db_container_client)
+
         blob_data = blob_client.download_blob().readall().decode()
 
-        # CSVリーダーを使用してBLOBファイル一覧を読み込み
-        csv_reader = csv.reader(io.StringIO(blob_data))
-        indexed_blob_names = next(csv_reader)  # 最初の行を読み込む
-        logging.info(f"Loaded indexed_blob_snapshot.csv: {indexed_blob_names} ...")
+        # 改行区切りのBLOBファイル一覧を読み込み
+        # BLOB名には\r などsplitlinesが区切りとみなす文字も使えるため、書き込み時と同じ "\n" だけで分割する
+        indexed_blob_names = blob_data.split("\n") if blob_data else []
+        logging.info(f"Loaded {SNAPSHOT_BLOB_NAME}: {len(indexed_blob_names)} files")
 
     except FileNotFoundError:
-        logging.error("indexed_blob_snapshot.csv not found in the DB container.")
+        logging.error(f"{SNAPSHOT_BLOB_NAME} not found in the DB container.")
         raise  # FileNotFoundError を再スローする
 
     except Exception as e:
         logging.error(f"Error occurred during load_indexed_blob_snapshot: {e}")
         raise  # その他の例外を再スローさせる
 
+    return indexed_blob_names
+
+def load_legacy_blob_snapshot(db_container_client: ContainerClient) -> List[str]:
+    """
+    以前のバージョンが1行のCSVとして保存したBLOBファイル一覧を取得します。
+    デプロイ後の初回の実行で削除判定を行うために使用し、以降は新しいスナップショットが読み込まれます。
+
+    Args:
+        db_container_client (ContainerClient): DBコンテナにアクセスするために使用するコンテナクライアント。
+
+    Returns:
+        List[str]: DBコンテナに保存されているBLOBファイル一覧（名前順）。
+
+    Raises:
+        FileNotFoundError: スナップショットが見つからない場合
+    """
+    blob_client = db_container_client.get_blob_client(LEGACY_SNAPSHOT_BLOB_NAME)
+    if not blob_client.exists():
+        raise FileNotFoundError
+
+    blob_data = blob_client.download_blob().readall().decode()
+    indexed_blob_names = sorted(next(csv.reader(io.StringIO(blob_data)), []))
+    logging.info(f"Loaded {LEGACY_SNAPSHOT_BLOB_NAME}: {len(indexed_blob_names)} files")
     return indexed_blob_names
\ No newline at end of file
@@ -1,15 +1,28 @@
 import azure.functions as func
 import os
-import json
+import orjson
 import logging
 import traceback
 import requests
 
 from utils.aoai import aoai_chatgpt
-from utils.check_token import check_token
+from utils.check_token import check_token, get_encoding
 
 genie_bp = func.Blueprint()
 
+# システムプロンプト（トークン数はcheck_tokenのキャッシュにより初回のみ計算される）
+SYSTEM_PROMPT = "ユーザーの質問に以下の情報を踏まえてMarkdown形式で回答してください。\n\n"
+
+# モデルのコンテキスト長と、そのうち検索結果を含むシステムプロンプトに使う割合
+MAX_TOKENS = 128000
+CONTEXT_TOKEN_RATIO = 0.95
+
+# 検索APIへの接続をリクエスト間で再利用するためのセッション
+_session = requests.Session()
+
+# 検索APIのタイムアウト（接続, 読み込み）秒
+SEARCH_API_TIMEOUT = (3, 30)
+
 
 @genie_bp.route(route="genie", methods=("POST",))
 def genie(req: func.HttpRequest) -> func.HttpResponse:
@@ -41,7 +54,7 @@ def genie(req: func.HttpRequest) -> func.HttpResponse:
         # ファイルアップロード用のblobsの追加 文字起こし後のblob名を格納
         res_json["blobs"] = []
 
-        return func.HttpResponse(json.dumps(res_json))
+        return func.HttpResponse(orjson.dumps(res_json), mimetype="application/json")
 
     # 必要ならばここに検索クエリの生成ロジックを追加
     query:str = user_input
@@ -55,10 +68,11 @@ def genie(req: func.HttpRequest) -> func.HttpResponse:
         "query": query,
         "max_results": 5
     }
-    response = requests.get(
+    response = _session.get(
         url = os.environ.get("SEARCH_API_URL"),
         headers = headers,
-        params = params
+        params = params,
+        timeout = SEARCH_API_TIMEOUT
         )
 
     if response.status_code != 200:
@@ -66,30 +80,37 @@ def genie(req: func.HttpRequest) -> func.HttpResponse:
         res_json = {"choices":[{"message": {"content": f"DBが動作しておりません。{response.status_code}, {response.text}"}}]}
         # ファイルアップロード用のblobsの追加 文字起こし後のblob名を格納
         res_json["blobs"] = []
-        return func.HttpResponse(json.dumps(res_json))
+        return func.HttpResponse(orjson.dumps(res_json), mimetype="application/json")
     # json形式での読み込み
-    search_results = json.loads(response.text)
+    search_results = orjson.loads(response.content)
 
     # 検索結果の整形 要調整
-    max_tokens = 128000
-    system_prompt = "ユーザーの質問に以下の情報を踏まえてMarkdown形式で回答してください。\n\n"
+    # ユーザーのメッセージや回答の分を残すため、上限の95%に達した時点で打ち切る
+    token_budget = int(MAX_TOKENS * CONTEXT_TOKEN_RATIO)
+    system_prompt = SYSTEM_PROMPT
     system_prompt_tokens = check_token(system_prompt)
     
-    db = ""
+    entries = [f"## [{res['source']}]\n{res['text']}\n\n" for res in search_results]
+    db_parts = []
     total_tokens = system_prompt_tokens
-    for res in search_results:
-        new_entry = f"## [{res['source']}]\n{res['text']}\n\n"
-        entry_tokens = check_token(new_entry)
-        
-        if total_tokens + entry_tokens > max_tokens:
-            remaining_tokens = max_tokens - total_tokens
-            partial_entry = new_entry[:remaining_tokens]
-            db += partial_entry
+    encoding = get_encoding()
+    # 全エントリを1回の呼び出しでまとめてトークン化する
+    for new_entry, entry_token_integers in zip(entries, encoding.encode_batch(entries)):
+        if total_tokens >= token_budget:
+            break
+
+        entry_tokens = len(entry_token_integers)
+        if total_tokens + entry_tokens > token_budget:
+            # 残りのトークン数で切り詰める（文字数ではなくトークン境界で切る）
+            remaining_tokens = token_budget - total_tokens
+            db_parts.append(encoding.decode(entry_token_integers[:remaining_tokens]))
             break
     
-        db += new_entry
+        db_parts.append(new_entry)
         total_tokens += entry_tokens
 
+    db = "".join(db_parts)
+
     system_content = f"{system_prompt}{db}"
 
     messages.append({
@@ -109,5 +130,5 @@ def genie(req: func.HttpRequest) -> func.HttpResponse:
     res_json = {"choices":[{"message": {"content": response}}]}
     # ファイルアップロード用のblobsの追加 文字起こし後のblob名を格納
     res_json["blobs"] = []
-    return func.HttpResponse(json.dumps(res_json))
+    return func.HttpResponse(orjson.dumps(res_json), mimetype="application/json")
 
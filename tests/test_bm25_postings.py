@@ -0,0 +1,61 @@
+import unittest
+
+import numpy as np
+
+from utils.indexes.bm25_index_manager import _BM25Postings
+
+
+def _exhaustive_top_k(postings: _BM25Postings, query, k, excluded=None) -> np.ndarray:
+    """get_scoresで全文書のスコアを計算し、除外されていない文書の上位k件のスコアを降順に返す"""
+    scores = postings.get_scores(query)
+    if excluded is not None:
+        scores = scores[~excluded]
+    return np.sort(scores)[::-1][:k]
+
+
+class TestBM25PostingsTopK(unittest.TestCase):
+    """MaxScoreで枝刈りしたtop_kが、全文書のスコアを計算した結果と一致することを確認する"""
+
+    def assert_matches_exhaustive(self, postings, query, k, excluded=None):
+        ids, scores = postings.top_k(query, k, excluded)
+        expected = _exhaustive_top_k(postings, query, k, excluded)
+        self.assertEqual(len(scores), len(expected))
+        np.testing.assert_allclose(scores, expected, rtol=1e-9, atol=1e-9)
+        # 返された文書のスコアが、全文書のスコアと一致すること
+        np.testing.assert_allclose(postings.get_scores(query)[ids], scores, rtol=1e-9, atol=1e-9)
+        if excluded is not None:
+            self.assertFalse(excluded[ids].any())
+
+    def test_negative_idf_terms_do_not_drop_hits(self):
+        # 「の」「会議」など半数以上の文書に出現する語はIDFが負になる
+        corpus = [
+            ['大阪', 'の', '報告', 'の', '会議', 'の'],
+            ['会議', 'の', '報告', 'の', '資料', 'の', '会議', 'の'],
+            ['予算', 'の', '資料', 'の', '東京', 'の', '資料', 'の', '報告', 'の'],
+            ['天気', 'の', '会議', 'の', '予算', 'の', '予算', 'の', '予算', 'の'],
+        ]
+        postings = _BM25Postings(corpus, k1=1.5, b=0.75)
+        ids, _ = postings.top_k(['大阪', 'の', '天気'], 3)
+        self.assertEqual(ids.tolist(), [0, 3, 1])
+
+    def test_random_corpora_match_exhaustive_scoring(self):
+        rng = np.random.default_rng(0)
+        for trial in range(300):
+            # 小さなコーパスと、語彙が少なく同じ語が多くの文書に出現する密なコーパスを交互に試す
+            if trial % 2 == 0:
+                num_docs, vocab_size = int(rng.integers(1, 12)), int(rng.integers(2, 30))
+            else:
+                num_docs, vocab_size = int(rng.integers(50, 300)), int(rng.integers(2, 12))
+            corpus = [[f"t{term}" for term in rng.integers(0, vocab_size, int(rng.integers(1, 15)))]
+                      for _ in range(num_docs)]
+            postings = _BM25Postings(corpus, k1=1.5, b=0.75)
+            excluded = rng.random(num_docs) < 0.2 if trial % 3 == 0 else None
+            for _ in range(5):
+                query = [f"t{term}" for term in rng.integers(0, vocab_size + 3, int(rng.integers(1, 6)))]
+                k = int(rng.integers(1, 12))
+                with self.subTest(trial=trial, query=query, k=k):
+                    self.assert_matches_exhaustive(postings, query, k, excluded)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,9 +1,26 @@
 import os
 import logging
+from functools import lru_cache
 from openai import AzureOpenAI
 
 from config import GPT4O_API_KEY, GPT4O_API_ENDPOINT, GPT4O_DEPLOYMENT_NAME, GPT4O_VERSION
 
+@lru_cache(maxsize=None)
+def _get_client() -> AzureOpenAI:
+    """
+    Azure OpenAIのクライアントを取得します。
+    接続プールを呼び出し間で再利用するため、クライアントは初回呼び出し時に1度だけ作成します。
+
+    Returns:
+        AzureOpenAI: Azure OpenAIのクライアント
+    """
+    return AzureOpenAI(
+        api_key=GPT4O_API_KEY,  
+        api_version=GPT4O_VERSION,
+        azure_endpoint=GPT4O_API_ENDPOINT,
+        max_retries=5
+    )
+
 # AOAIを経由してChatGPTを利用する
 def aoai_chatgpt(prompt, model=GPT4O_DEPLOYMENT_NAME) -> str:
     """
@@ -17,13 +34,7 @@ def aoai_chatgpt(prompt, model=GPT4O_DEPLOYMENT_NAME) -> str:
         str: GPT-4による処理結果
     """
     
-    gpt4o_client = AzureOpenAI(
-        api_key=GPT4O_API_KEY,  
-        api_version=GPT4O_VERSION,
-        azure_endpoint=GPT4O_API_ENDPOINT,
-        max_retries=5
-    )
-    response = gpt4o_client.chat.completions.create(
+    response = _get_client().chat.completions.create(
         model=model,
         messages=prompt,
         temperature=0
@@ -1,9 +1,15 @@
 import logging
-from typing import List
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
 
+import httpx
 import numpy as np
 from openai import AzureOpenAI, APIError, RateLimitError, APIConnectionError
 
+from .check_token import check_tokens
+from .embedding_cache import EmbeddingCache
+
 class AzureEmbedder:
     """
     Azure OpenAIのテキスト埋め込みサービスを利用するためのクラス。
@@ -15,6 +21,7 @@ class AzureEmbedder:
     Attributes:
         client (AzureOpenAI): Azure OpenAI APIクライアント
         deployment_name (str): 使用する埋め込みモデルのデプロイメント名
+        cache (Optional[EmbeddingCache]): 埋め込みベクトルのキャッシュ
 
     使用例:
         embedder = AzureEmbedder(
@@ -30,9 +37,24 @@ class AzureEmbedder:
         # 複数のテキストをバッチで埋め込む
         texts = ["Hello, World!", "埋め込みは有用です"]
         batch_embeddings = embedder.embed_batch(texts)
+
+        # 大量のテキストをバッチ単位で並列に埋め込む
+        batch_embeddings = embedder.embed_batch_parallel(texts, max_concurrency=8)
     """
 
-    def __init__(self, api_key: str, api_version: str, azure_endpoint: str, deployment_name: str):
+    # 1回のリクエストで送信できる入力の最大数（Azure OpenAIの埋め込みAPIの上限）
+    MAX_BATCH_SIZE = 2048
+    # 1回のリクエストに含めるトークン数の上限（リクエストあたりの上限とレート制限に収まるように抑える）
+    MAX_BATCH_TOKENS = 100_000
+    # 全てのインスタンスで共有する接続プールの最大接続数と、keep-aliveで保持する接続数
+    MAX_CONNECTIONS = 64
+    MAX_KEEPALIVE_CONNECTIONS = 32
+
+    __shared_http_client: Optional[httpx.Client] = None
+    __shared_http_client_lock = threading.Lock()
+
+    def __init__(self, api_key: str, api_version: str, azure_endpoint: str, deployment_name: str,
+                 cache: Optional[EmbeddingCache] = None, http_client: Optional[httpx.Client] = None):
         """
         AzureEmbedderのコンストラクタ。
 
@@ -41,16 +63,36 @@ class AzureEmbedder:
             api_version (str): 使用するAPIのバージョン
             azure_endpoint (str): Azure OpenAIのエンドポイントURL
             deployment_name (str): 使用する埋め込みモデルのデプロイメント名
+            cache (Optional[EmbeddingCache], optional): 埋め込みベクトルのキャッシュ。
+                指定した場合、embed_batchはdocument_keyを渡されたドキュメントについて、キャッシュに存在するテキストの埋め込みを省略します。
+            http_client (Optional[httpx.Client], optional): APIの呼び出しに使用するHTTPクライアント。
+                省略した場合は、全てのインスタンスで共有する接続プールを使用します。
         """
         self.client = AzureOpenAI(
             api_key=api_key,
             api_version=api_version,
             azure_endpoint=azure_endpoint,
-            max_retries=5
+            max_retries=5,
+            http_client=http_client if http_client is not None else self.__get_shared_http_client()
         )
         self.deployment_name = deployment_name
+        self.cache = cache
         self.logger = logging.getLogger(__name__)
 
+    @classmethod
+    def __get_shared_http_client(cls) -> httpx.Client:
+        """
+        全てのインスタンスで共有するHTTPクライアントを返します（初回の呼び出し時に作成します）。
+        インスタンスごとに接続プールを作らないため、検索ごとにTLSのハンドシェイクを行わずにkeep-aliveの接続を再利用できます。
+        """
+        with cls.__shared_http_client_lock:
+            if cls.__shared_http_client is None:
+                cls.__shared_http_client = httpx.Client(
+                    limits=httpx.Limits(max_connections=cls.MAX_CONNECTIONS,
+                                        max_keepalive_connections=cls.MAX_KEEPALIVE_CONNECTIONS)
+                )
+            return cls.__shared_http_client
+
     def embed_single(self, text: str) -> np.ndarray:
         """
         単一のテキストを埋め込みベクトルに変換します。
@@ -64,15 +106,23 @@ class AzureEmbedder:
         Raises:
             ValueError: 入力テキストが空の場合
         """
-        return np.array(self.__embed([text])[0], dtype=np.float32)
+        return self.__embed([text])[0]
 
-    def embed_batch(self, texts: List[str], batch_size: int = 100) -> np.ndarray:
+    def embed_batch(self, texts: List[str], batch_size: int = MAX_BATCH_SIZE,
+                    document_key: Optional[str] = None, lookup_cache: bool = True) -> np.ndarray:
         """
         複数のテキストをバッチで埋め込みベクトルに変換します。
+        バッチはテキストの数がbatch_size以下、トークン数の合計がMAX_BATCH_TOKENS以下になるように分割します。
+        キャッシュを指定したインスタンスでdocument_keyを渡した場合は、ドキュメントのキャッシュを1回読み込み、
+        存在しないテキストだけを埋め込んでから、ドキュメントの全てのベクトルを1回で保存します。
 
         Args:
             texts (List[str]): 埋め込むテキストのリスト
-            batch_size (int, optional): 一度に処理するテキストの数。デフォルトは100。
+            batch_size (int, optional): 一度に処理するテキストの最大数。デフォルトはMAX_BATCH_SIZE（2048）。
+            document_key (Optional[str], optional): EmbeddingCache.make_document_keyで作成したドキュメントのキー。
+                省略した場合はキャッシュを使用しません。
+            lookup_cache (bool, optional): キャッシュを読み込むかどうか。一度もインデックスしていないドキュメントでは
+                キャッシュが存在しないため、Falseを指定すると読み込みを省略して保存だけを行います。デフォルトはTrue。
 
         Returns:
             np.ndarray: 埋め込みベクトルの2次元配列（float32型）
@@ -83,15 +133,97 @@ class AzureEmbedder:
         if not texts:
             raise ValueError("テキストリストが空です。")
 
-        all_embeddings = []
-        for i in range(0, len(texts), batch_size):
-            batch = texts[i:i + batch_size]
-            batch_embeddings = self.__embed(batch)
-            all_embeddings.extend(batch_embeddings)
+        if self.cache is None or document_key is None:
+            return self.__embed_in_batches(texts, batch_size)
+
+        # キャッシュに存在しないテキストだけを埋め込み、入力順に並べ直す
+        keys = [EmbeddingCache.make_key(self.deployment_name, text) for text in texts]
+        embeddings = self.cache.get_many(document_key, keys) if lookup_cache else {}
+        missing = {key: text for key, text in zip(keys, texts) if key not in embeddings}
+        self.logger.info(f"Embedding cache hits: {len(texts) - len(missing)}/{len(texts)}")
+
+        if missing:
+            embeddings.update(zip(missing.keys(), self.__embed_in_batches(list(missing.values()), batch_size)))
+            # ドキュメントの現在のチャンクのベクトルだけを保存し、削除されたチャンクのベクトルは残さない
+            self.cache.put_many(document_key, {key: embeddings[key] for key in dict.fromkeys(keys)})
+
+        # 出力配列を一度だけ確保し、入力順に埋める
+        out = np.empty((len(keys), embeddings[keys[0]].shape[0]), dtype=np.float32)
+        for i, key in enumerate(keys):
+            out[i] = embeddings[key]
+        return out
+
+    def __embed_in_batches(self, texts: List[str], batch_size: int) -> np.ndarray:
+        """
+        内部メソッド: テキストをバッチ単位で順に埋め込みベクトルに変換します。
 
-        return np.array(all_embeddings, dtype=np.float32)
+        Args:
+            texts (List[str]): 埋め込むテキストのリスト
+            batch_size (int): 一度に処理するテキストの最大数
 
-    def __embed(self, texts: List[str]) -> List[List[float]]:
+        Returns:
+            np.ndarray: 埋め込みベクトルの2次元配列（float32型）
+        """
+        out = None
+        for start, end in self.__split_batches(texts, batch_size):
+            batch_embeddings = self.__embed(texts[start:end])
+            if out is None:
+                # 次元数は最初のバッチの結果から決定し、出力配列を一度だけ確保する
+                out = np.empty((len(texts), batch_embeddings.shape[1]), dtype=np.float32)
+            out[start:end] = batch_embeddings
+
+        return out
+
+    def __split_batches(self, texts: List[str], batch_size: int) -> List[Tuple[int, int]]:
+        """
+        内部メソッド: テキストの数がbatch_size以下、トークン数の合計がMAX_BATCH_TOKENS以下になるようにバッチの範囲を求めます。
+        トークン数はtiktokenで並列に数えます（埋め込みモデルのトークナイザーとの差は上限に余裕を持たせて吸収します）。
+
+        Args:
+            texts (List[str]): 埋め込むテキストのリスト
+            batch_size (int): 一度に処理するテキストの最大数
+
+        Returns:
+            List[Tuple[int, int]]: 各バッチの開始位置と終了位置のリスト
+        """
+        batch_size = max(1, min(batch_size, self.MAX_BATCH_SIZE))
+        batches = []
+        start = 0
+        batch_tokens = 0
+        for i, num_tokens in enumerate(check_tokens(texts)):
+            if i > start and (i - start >= batch_size or batch_tokens + num_tokens > self.MAX_BATCH_TOKENS):
+                batches.append((start, i))
+                start = i
+                batch_tokens = 0
+            batch_tokens += num_tokens
+        batches.append((start, len(texts)))
+        return batches
+
+    def embed_batch_parallel(self, texts: List[str], batch_size: int = MAX_BATCH_SIZE, max_concurrency: int = 8) -> np.ndarray:
+        """
+        複数のテキストをバッチに分割し、並列に埋め込みベクトルに変換します。
+        出力の順序は入力テキストの順序と同じです。
+
+        Args:
+            texts (List[str]): 埋め込むテキストのリスト
+            batch_size (int, optional): 一度に処理するテキストの最大数。デフォルトはMAX_BATCH_SIZE（2048）。
+            max_concurrency (int, optional): 同時に実行するリクエストの最大数。デフォルトは8。
+
+        Returns:
+            np.ndarray: 埋め込みベクトルの2次元配列（float32型）
+
+        Raises:
+            ValueError: 入力テキストリストが空の場合
+        """
+        if not texts:
+            raise ValueError("テキストリストが空です。")
+
+        batches = [texts[start:end] for start, end in self.__split_batches(texts, batch_size)]
+        with ThreadPoolExecutor(max_workers=min(max_concurrency, len(batches))) as executor:
+            batch_embeddings = executor.map(self.__embed, batches)
+            return np.concatenate(list(batch_embeddings))
+
+    def __embed(self, texts: List[str]) -> np.ndarray:
         """
         内部メソッド: テキストリストを埋め込みベクトルに変換します。
 
@@ -99,7 +231,7 @@ class AzureEmbedder:
             texts (List[str]): 埋め込むテキストのリスト
 
         Returns:
-            List[List[float]]: 埋め込みベクトルのリスト
+            np.ndarray: 埋め込みベクトルの2次元配列（float32型）
 
         Raises:
             ValueError: 入力テキストリストが空の場合
@@ -112,7 +244,7 @@ class AzureEmbedder:
                 input=texts,
                 model=self.deployment_name
             )
-            return [data.embedding for data in response.data]
+            return np.asarray([data.embedding for data in response.data], dtype=np.float32)
         except RateLimitError as e:
             self.logger.error(f"Rate limit exceeded: {str(e)}")
             raise
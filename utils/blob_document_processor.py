@@ -1,39 +1,40 @@
 from datetime import datetime
-import json
+import orjson
 import os
 import logging
-from typing import List, Dict, Tuple, Union
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Optional, Tuple, Union
 from utils.blobs.blob_manager import BlobManager
+from utils.chunk_store import ChunkStore
 from utils.document_parser import DocumentParser
 from utils.azure_embedder import AzureEmbedder
+from utils.embedding_cache import EmbeddingCache
 from utils.mapping.chunk_mapping_manager import ChunkMappingManager
 
 class BlobDocumentProcessor:
-    def __init__(self, blob_manager: BlobManager, document_parser: DocumentParser, embedding: AzureEmbedder, mapping_manager: ChunkMappingManager, db_container_name = 'db-container'):
+    def __init__(self, blob_manager: BlobManager, document_parser: DocumentParser, embedding: AzureEmbedder, mapping_manager: ChunkMappingManager, db_container_name = 'db-container', max_workers: int = 16,
+                 chunk_store: Optional[ChunkStore] = None):
         self.blob_manager = blob_manager
+        self.chunk_store = chunk_store if chunk_store is not None else ChunkStore(blob_manager, db_container_name, max_workers=max_workers)
         self.container_manager = self.blob_manager.container_manager
         self.document_parser = document_parser
         self.embedding = embedding
         self.mapping_manager = mapping_manager
         self.db_container_name = db_container_name
+        self.max_workers = max_workers
         
     def __parse_document(self, blob_content: bytes, ext: str) -> Tuple[List[Dict[str, Union[str, int]]], List[Dict[str, Union[str, int]]], str]:
         """ドキュメントを解析し、全チャンク、ページごとのチャンク、全文を取得します。"""
         parsed_content = self.document_parser.parse_by_page(blob_content, ext)
-        full_text = self.document_parser.parse_full_text(blob_content, ext)
         all_chunks = [{'text': text, 'page_number': page['page_number']} for page in parsed_content for text in page['texts']]
         page_chunks = [{'text': ''.join(page['texts']), 'page_number': page['page_number']} for page in parsed_content]
+        # 全文はparse_full_textと同じく全チャンクの連結なので、再解析せずにページごとの結果から作成する
+        full_text = ''.join(page_chunk['text'] for page_chunk in page_chunks)
         return all_chunks, page_chunks, full_text
     
-    def __get_file_extension(self, blob_name: str) -> str:
-        """ファイル名から拡張子を取得します。"""
-        _, ext = os.path.splitext(blob_name)
-        return ext.lstrip('.').lower()
-    
-    def __process_document_to_chunks_and_fulltext(self, container_name: str, blob_name: str) -> Tuple[List[str], str]:
+    def __process_document_to_chunks_and_fulltext(self, container_name: str, blob_name: str, ext: str) -> Tuple[List[str], str]:
         """ドキュメントを処理し、チャンクと全文を取得します。"""
         blob_content = self.blob_manager.read(container_name, blob_name, as_byte=True)
-        ext = self.__get_file_extension(blob_name)
         return self.__parse_document(blob_content, ext)
 
     def process_and_save_document(self, container_name: str, blob_name: str):
@@ -45,6 +46,9 @@ class BlobDocumentProcessor:
             container_name (str): ドキュメントが格納されているコンテナ名
             blob_name (str): 処理するドキュメントのブロブ名
         """
+        # 拡張子はここで一度だけ求めて解析処理に渡す
+        ext = os.path.splitext(blob_name)[1][1:].lower()
+
         try:
             # 既存のドキュメント、チャンク、ページチャンク、マッピングを確認
             existing_chunk_ids = self.mapping_manager.chunk_blob_mapping_manager.get_chunk_ids_by_blob(container_name, blob_name)
@@ -52,27 +56,37 @@ class BlobDocumentProcessor:
             if existing_chunk_ids:
                 self.__delete_document_internal(container_name, blob_name)
                 
-            all_chunks, page_chunks, full_text = self.__process_document_to_chunks_and_fulltext(container_name, blob_name)
+            all_chunks, page_chunks, full_text = self.__process_document_to_chunks_and_fulltext(container_name, blob_name, ext)
             
-            # チャンクの保存
-            self.chunk_info_list = self.mapping_manager.add(container_name, blob_name, [chunk['text'] for chunk in all_chunks])
-            for (chunk_id, chunk), all_chunk in zip(self.chunk_info_list, all_chunks):
-                self.blob_manager.upload(self.db_container_name, f'chunks/chunk_{chunk_id}.json', json.dumps({
-                    'text': chunk,
-                    'document_name': blob_name,
-                    'page_number': all_chunk['page_number'],
-                    'createdAt': datetime.now().isoformat()
-                }))
+            # チャンクはチャンクごとのBlobにせず、パックにまとめて追記する（ドキュメント名はマッピングに保存される）
+            created_at = datetime.now()
+            chunk_locations = self.chunk_store.append([
+                ChunkStore.encode_chunk(chunk['text'], chunk['page_number'], created_at)
+                for chunk in all_chunks
+            ])
+
+            # チャンクの保存（パックでの位置はマッピングに保存する）
+            chunk_info_list = self.mapping_manager.add(container_name, blob_name,
+                                                       [chunk['text'] for chunk in all_chunks],
+                                                       [chunk['page_number'] for chunk in all_chunks],
+                                                       chunk_locations,
+                                                       # 一度もインデックスしていないドキュメントには埋め込みのキャッシュが存在しない
+                                                       lookup_embedding_cache=bool(existing_chunk_ids))
 
             # ページチャンクの保存
-            for page_chunk in page_chunks:
-                self.blob_manager.upload(self.db_container_name, f'pages/{blob_name}_{page_chunk["page_number"]}.txt', page_chunk['text'])
+            uploads = [
+                (f'pages/{blob_name}_{page_chunk["page_number"]}.txt', page_chunk['text'])
+                for page_chunk in page_chunks
+            ]
 
             # 全文の保存
-            self.blob_manager.upload(self.db_container_name, f'texts/{blob_name}.txt', full_text)
+            uploads.append((f'texts/{blob_name}.txt', full_text))
+
+            # ページチャンクと全文をまとめて並列にアップロード
+            self.blob_manager.upload_many(self.db_container_name, uploads, max_workers=self.max_workers)
 
             # メタデータを更新
-            safe_chunk_ids = json.dumps([str(id) for id, _ in self.chunk_info_list])
+            safe_chunk_ids = orjson.dumps([str(id) for id, _ in chunk_info_list]).decode()
             self.blob_manager.add_metadata(container_name, blob_name, {"chunk_ids": safe_chunk_ids})
             logging.info(f"ドキュメント {blob_name} の処理が正常に完了しました。")
 
@@ -92,23 +106,42 @@ class BlobDocumentProcessor:
         """
         try:
             self.__delete_document_internal(container_name, blob_name)
+            # 再インデックスで使用するため、埋め込みのキャッシュはドキュメントを削除した場合にのみ削除する
+            if self.embedding.cache is not None:
+                self.embedding.cache.delete(EmbeddingCache.make_document_key(container_name, blob_name))
         except Exception as e:
             logging.error(f"ドキュメント {blob_name} の削除中にエラーが発生しました: {str(e)}")
             raise
 
+    def __read_page_number(self, chunk_blob_name: str) -> Union[int, None]:
+        """チャンクのJSONを読み込み、ページ番号を取得します。"""
+        chunk_content = self.blob_manager.read(self.db_container_name, chunk_blob_name)
+        return orjson.loads(chunk_content).get('page_number')
+
     def __delete_document_internal(self, container_name: str, blob_name: str):
-        chunk_ids = self.mapping_manager.chunk_blob_mapping_manager.get_chunk_ids_by_blob(container_name, blob_name)
-        for chunk_id in chunk_ids:
-            chunk_blob_name = f'chunks/chunk_{chunk_id}.json'
-            chunk_content = self.blob_manager.read(self.db_container_name, chunk_blob_name)
-            chunk_data = json.loads(chunk_content)
-            page_number = chunk_data.get('page_number')
-            
-            self.mapping_manager.remove(chunk_id)
-            self.blob_manager.delete(self.db_container_name, chunk_blob_name)
-            
-            if page_number and self.blob_manager.blob_exist(self.db_container_name, f'pages/{blob_name}_{page_number}.txt'):
-                self.blob_manager.delete(self.db_container_name, f'pages/{blob_name}_{page_number}.txt')
+        chunks = self.mapping_manager.chunk_blob_mapping_manager.get_chunks_by_blob(container_name, blob_name)
+        chunk_ids = [chunk_id for chunk_id, _ in chunks]
+        chunk_blob_names = [self.chunk_store.legacy_blob_name(chunk_id) for chunk_id in chunk_ids]
+        # パックに保存したチャンクは位置がマッピングから削除されるだけで、個別のBlobは存在しない
+        blob_mapping = self.mapping_manager.chunk_blob_mapping_manager
+        legacy_blob_names_to_delete = [name for name, chunk_id in zip(chunk_blob_names, chunk_ids)
+                                       if not (blob_mapping.get_blob_info(chunk_id) or {}).get('chunk')]
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            # ページ番号はマッピングから取得し、重複なく集める
+            # ページ番号が保存されていない以前のマッピングのみ、チャンクのJSONを並列に読み込む
+            page_numbers = {page_number for _, page_number in chunks if page_number is not None}
+            legacy_chunk_blob_names = [name for name, (_, page_number) in zip(chunk_blob_names, chunks) if page_number is None]
+            page_numbers.update(executor.map(self.__read_page_number, legacy_chunk_blob_names))
+            page_numbers.discard(None)
+
+            if chunk_ids:
+                self.mapping_manager.remove(chunk_ids)
+
+            # チャンクとページのブロブを並列に削除（同じページは一度だけ削除する）
+            # 存在しないブロブの削除はBlobManager.delete側で無視される
+            page_blob_names = [f'pages/{blob_name}_{page_number}.txt' for page_number in page_numbers]
+            list(executor.map(lambda name: self.blob_manager.delete(self.db_container_name, name), legacy_blob_names_to_delete + page_blob_names))
 
         # 全文の削除
         self.blob_manager.delete(self.db_container_name, f'texts/{blob_name}.txt')
@@ -0,0 +1,64 @@
+import asyncio
+from typing import Dict, List, Tuple, Union
+
+from .blob_manager import BlobManager
+
+class AsyncBlobFacade:
+    """
+    同期のBlobManagerをasyncioから利用するためのクラス。
+
+    各操作をasyncio.to_threadでスレッドに移して実行するため、イベントループを止めずに
+    多数のBlob操作を並行に実行できます。内部のBlobManagerは1つのBlobServiceClientと接続プールを共有するため、
+    同時実行数はBlobManagerのmax_connections以下にしてください。
+    非同期クライアントでの実装はAsyncBlobManagerを参照してください。
+
+    使用例:
+        facade = AsyncBlobFacade(blob_manager)
+
+        # 複数のBlobを並行に読み込む
+        texts = await asyncio.gather(*(facade.read("my-container", name, as_byte=False) for name in blob_names))
+
+        # データを書き込む
+        await facade.upload("my-container", "hello.txt", "Hello, World!")
+    """
+
+    def __init__(self, blob_manager: BlobManager):
+        """
+        AsyncBlobFacadeのインスタンスを初期化します。
+
+        Args:
+            blob_manager (BlobManager): 操作を委譲するBlobManager
+        """
+        self.__blob_manager = blob_manager
+
+    async def read(self, container_name: str, blob_name: str, as_byte: bool = True) -> Union[bytes, str]:
+        """BlobManager.readをスレッドで実行します。"""
+        return await asyncio.to_thread(self.__blob_manager.read, container_name, blob_name, as_byte)
+
+    async def upload(self, container_name: str, blob_name: str, data: Union[str, bytes, None] = None, overwrite: bool = True) -> None:
+        """BlobManager.uploadをスレッドで実行します。"""
+        await asyncio.to_thread(self.__blob_manager.upload, container_name, blob_name, data, overwrite=overwrite)
+
+    async def upload_many(self, container_name: str, items: List[Tuple[str, Union[str, bytes, None]]], max_workers: int = 32) -> None:
+        """BlobManager.upload_manyをスレッドで実行します。"""
+        await asyncio.to_thread(self.__blob_manager.upload_many, container_name, items, max_workers)
+
+    async def delete(self, container_name: str, blob_name: str) -> None:
+        """BlobManager.deleteをスレッドで実行します。"""
+        await asyncio.to_thread(self.__blob_manager.delete, container_name, blob_name)
+
+    async def add_metadata(self, container_name: str, blob_name: str, metadata: Dict[str, str], merge: bool = True) -> bool:
+        """BlobManager.add_metadataをスレッドで実行します。"""
+        return await asyncio.to_thread(self.__blob_manager.add_metadata, container_name, blob_name, metadata, merge)
+
+    async def get_metadata(self, container_name: str, blob_name: str) -> Dict[str, str]:
+        """BlobManager.get_metadataをスレッドで実行します。"""
+        return await asyncio.to_thread(self.__blob_manager.get_metadata, container_name, blob_name)
+
+    async def blob_exist(self, container_name: str, blob_name: str) -> bool:
+        """BlobManager.blob_existをスレッドで実行します。"""
+        return await asyncio.to_thread(self.__blob_manager.blob_exist, container_name, blob_name)
+
+    async def list_blobs(self, container_name: str) -> List[str]:
+        """BlobManager.list_blobsをスレッドで実行します。"""
+        return await asyncio.to_thread(self.__blob_manager.list_blobs, container_name)
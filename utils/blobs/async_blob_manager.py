@@ -0,0 +1,354 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional, Union
+
+import aiohttp
+from azure.core.exceptions import AzureError, HttpResponseError, ResourceNotFoundError
+from azure.core.pipeline.transport import AioHttpTransport
+from azure.storage.blob.aio import BlobClient, BlobLeaseClient, BlobServiceClient
+
+from .blob_container_manager import backoff_delay
+
+class AsyncBlobManager:
+    """
+    Azure Blob Storageを非同期に操作するためのクラス。
+
+    BlobManagerと同じ操作（読み込み、書き込み、削除、メタデータの操作、一覧の取得）を
+    azure.storage.blob.aio のクライアントで提供します。同じサービスクライアントから派生したクライアントは
+    接続プールを共有するため、asyncio.gatherで多数のBlob操作を1つのイベントループ上で並行に実行できます。
+    書き込みと削除はBlobManagerと同様にリースを取得せずに行い、メタデータの追加はリースを取得して行います。
+
+    Attributes:
+        __service_client (BlobServiceClient): 非同期のBlobServiceClient
+        __max_connections (int): 接続プールの最大接続数
+
+    使用例:
+        from azure.identity.aio import DefaultAzureCredential
+
+        async with AsyncBlobManager(account_url="https://your_account.blob.core.windows.net",
+                                    credential=DefaultAzureCredential()) as blob_manager:
+            # データを並行に書き込む
+            await asyncio.gather(*(blob_manager.upload("my-container", f"chunk_{i}.txt", "Hello") for i in range(100)))
+
+            # データを読み込む
+            data = await blob_manager.read("my-container", "chunk_0.txt", as_byte=False)
+
+            # 複数のBlobを並行に読み込む
+            contents = await blob_manager.read_many("my-container", [f"chunk_{i}.txt" for i in range(100)])
+
+            # コンテナ内のBlob一覧を取得
+            blob_names = await blob_manager.list_blobs("my-container")
+    """
+
+    def __init__(self, connection_string: Optional[str] = None, account_url: Optional[str] = None,
+                 credential: Any = None, max_connections: int = 64):
+        """
+        AsyncBlobManagerのインスタンスを初期化します。
+        クライアントはイベントループ上で作成する必要があるため、async with で使用するか、open()を呼び出してください。
+
+        Args:
+            connection_string (Optional[str]): Azure Storage接続文字列
+            account_url (Optional[str]): BlobストレージのアカウントURL
+            credential (Any): 非同期の認証情報（azure.identity.aio.DefaultAzureCredentialなど）。
+                account_urlのみ指定した場合は、azure.identity.aio.DefaultAzureCredentialを作成して使用します。
+            max_connections (int, optional): 接続プールの最大接続数。デフォルトは64。
+        """
+        if not connection_string and not account_url:
+            raise ValueError("Either connection_string or account_url must be provided")
+
+        self.__connection_string = connection_string
+        self.__account_url = account_url
+        self.__credential = credential
+        self.__owns_credential = False
+        self.__max_connections = max_connections
+        self.__session: Optional[aiohttp.ClientSession] = None
+        self.__service_client: Optional[BlobServiceClient] = None
+
+    async def __aenter__(self) -> "AsyncBlobManager":
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback) -> None:
+        await self.close()
+
+    async def open(self) -> None:
+        """
+        接続プールとBlobServiceClientを作成します。
+        """
+        if self.__service_client is not None:
+            return
+
+        # 接続プールの上限を明示したセッションを、全てのBlob操作で共有する
+        self.__session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.__max_connections))
+        transport = AioHttpTransport(session=self.__session, session_owner=False)
+
+        try:
+            if self.__connection_string:
+                self.__service_client = BlobServiceClient.from_connection_string(self.__connection_string, transport=transport)
+            else:
+                if self.__credential is None:
+                    from azure.identity.aio import DefaultAzureCredential
+                    self.__credential = DefaultAzureCredential()
+                    self.__owns_credential = True
+                self.__service_client = BlobServiceClient(account_url=self.__account_url, credential=self.__credential, transport=transport)
+            logging.info('Async BlobServiceClient created successfully.')
+        except AzureError as e:
+            logging.error(f"Failed to create async BlobServiceClient: {str(e)}")
+            await self.close()
+            raise
+
+    async def close(self) -> None:
+        """
+        BlobServiceClientと接続プールを閉じます。
+        """
+        if self.__service_client is not None:
+            await self.__service_client.close()
+            self.__service_client = None
+        if self.__session is not None:
+            await self.__session.close()
+            self.__session = None
+        if self.__owns_credential:
+            await self.__credential.close()
+            self.__credential = None
+            self.__owns_credential = False
+
+    def __get_blob_client(self, container_name: str, blob_name: str) -> BlobClient:
+        if self.__service_client is None:
+            raise RuntimeError("AsyncBlobManager is not opened. Use 'async with' or call open() first.")
+        return self.__service_client.get_blob_client(container=container_name, blob=blob_name)
+
+    @asynccontextmanager
+    async def __blob_lease(self, container_name: str, blob_name: str, max_retries: int = 12,
+                           retry_delay: int = 5) -> AsyncIterator[tuple]:
+        """
+        Blobのリースを取得し、処理後にリースを解放します。
+        Blobが存在しない場合は空のBlobを作成してからリースを取得します。
+
+        Args:
+            container_name (str): コンテナ名
+            blob_name (str): Blob名
+            max_retries (int): 最大再試行回数
+            retry_delay (int): 再試行間の待機時間（秒）
+
+        Yields:
+            tuple: (BlobClient, リースID)
+        """
+        blob_client = self.__get_blob_client(container_name, blob_name)
+        if not await blob_client.exists():
+            await blob_client.upload_blob(data=b"", overwrite=True)
+            logging.info(f"Blob '{blob_name}' created in container '{container_name}'.")
+
+        lease_client: Optional[BlobLeaseClient] = None
+        for attempt in range(max_retries):
+            try:
+                lease_client = await blob_client.acquire_lease(lease_duration=20)
+                break
+            except HttpResponseError as e:
+                # 他のクライアントがリースを保持している場合は待機して再試行する
+                if e.status_code != 409 or attempt == max_retries - 1:
+                    logging.error(f"Failed to acquire lease for blob: {blob_name} in container: {container_name}. Error: {str(e)}")
+                    raise
+                delay = backoff_delay(retry_delay, attempt)
+                logging.info(f"Blob '{blob_name}' in container '{container_name}' has an active lease. Attempt {attempt + 1}/{max_retries}. Waiting {delay:.1f} seconds before retry.")
+                await asyncio.sleep(delay)
+
+        try:
+            yield blob_client, lease_client.id
+        finally:
+            try:
+                await lease_client.release()
+            except AzureError as e:
+                if "BlobNotFound" in str(e):
+                    logging.debug(f"Blob associated with lease '{lease_client.id}' does not exist.")
+                else:
+                    logging.error(f"Failed to release lease '{lease_client.id}': {str(e)}")
+
+    async def read(self, container_name: str, blob_name: str, as_byte: bool = True) -> Union[bytes, str]:
+        """
+        指定されたコンテナとBlobからデータを読み込みます。
+        この操作はリースを取得せずに行われます。
+
+        Args:
+            container_name (str): コンテナ名
+            blob_name (str): Blob名
+            as_byte (bool, optional): Trueの場合、データをバイトとして返します。Falseの場合、文字列として返します。デフォルトはTrue。
+
+        Returns:
+            Union[bytes, str]: 読み込んだデータ。
+
+        Raises:
+            ResourceNotFoundError: Blobが存在しない場合
+            Exception: データの読み込みに失敗した場合
+        """
+        try:
+            blob_client = self.__get_blob_client(container_name, blob_name)
+            stream = await blob_client.download_blob()
+            data = await stream.readall()
+            if as_byte:
+                return data
+            return data.decode('utf-8')
+        except ResourceNotFoundError:
+            logging.warning(f"Blob '{blob_name}' not found in container '{container_name}'")
+            raise
+        except Exception as e:
+            logging.error(f"Failed to read blob '{blob_name}' from container '{container_name}': {str(e)}")
+            raise
+
+    async def read_from(self, container_name: str, blob_name: str, offset: int, length: Optional[int] = None) -> bytes:
+        """
+        指定されたBlobの、offsetバイト目から末尾（lengthを指定した場合はlengthバイト）までのデータを読み込みます。
+        この操作はリースを取得せずに行われます。
+
+        Args:
+            container_name (str): コンテナ名
+            blob_name (str): Blob名
+            offset (int): 読み込みを開始する位置（バイト）
+            length (Optional[int], optional): 読み込むバイト数。省略した場合は末尾まで読み込みます。
+
+        Returns:
+            bytes: 読み込んだデータ
+
+        Raises:
+            ResourceNotFoundError: Blobが存在しない場合
+        """
+        try:
+            blob_client = self.__get_blob_client(container_name, blob_name)
+            stream = await blob_client.download_blob(offset=offset, length=length)
+            return await stream.readall()
+        except ResourceNotFoundError:
+            logging.warning(f"Blob '{blob_name}' not found in container '{container_name}'")
+            raise
+        except Exception as e:
+            logging.error(f"Failed to read blob '{blob_name}' from container '{container_name}' at offset {offset}: {str(e)}")
+            raise
+
+    async def read_many(self, container_name: str, blob_names: List[str], as_byte: bool = True) -> Dict[str, Union[bytes, str]]:
+        """
+        指定されたコンテナから複数のBlobを並行に読み込みます。
+        スレッドを使わずにasyncio.gatherで1つのイベントループ上で読み込むため、小さなBlobを多数読み込む場合に適しています。
+        同時に実行される読み込みの数は接続プールの最大接続数で制限されます。
+
+        Args:
+            container_name (str): コンテナ名
+            blob_names (List[str]): 読み込むBlob名のリスト
+            as_byte (bool, optional): Trueの場合、データをバイトとして返します。Falseの場合、文字列として返します。デフォルトはTrue。
+
+        Returns:
+            Dict[str, Union[bytes, str]]: Blob名と読み込んだデータのディクショナリ
+
+        Raises:
+            ResourceNotFoundError: いずれかのBlobが存在しない場合
+            Exception: いずれかのBlobの読み込みに失敗した場合
+        """
+        blob_names = list(dict.fromkeys(blob_names))  # 重複を除く（順序は保つ）
+        contents = await asyncio.gather(*(self.read(container_name, blob_name, as_byte) for blob_name in blob_names))
+        return dict(zip(blob_names, contents))
+
+    async def upload(self, container_name: str, blob_name: str, data: Union[str, bytes, None] = None,
+                     lease_id: Optional[str] = None, overwrite: bool = True) -> None:
+        """
+        指定されたコンテナとBlobにデータを書き込みます。
+        書き込みは1回のリクエストでサーバー側で直列化されるため、この操作はリースを取得せずに行われます。
+        呼び出し元がBlobのリースを保持している場合は、lease_idを指定して書き込みます。
+        データが渡されなかった場合、空のファイルを作成します。
+
+        Args:
+            container_name (str): コンテナ名
+            blob_name (str): Blob名
+            data (Union[str, bytes, None], optional): アップロードするデータ。デフォルトはNone。
+            lease_id (Optional[str], optional): 保持しているリースのID。デフォルトはNone。
+            overwrite (bool, optional): 上書きを許可するかどうか。デフォルトはTrue。
+        """
+        if data is None:
+            data = b''
+        elif isinstance(data, str):
+            data = data.encode('utf-8')
+
+        blob_client = self.__get_blob_client(container_name, blob_name)
+        await blob_client.upload_blob(data, overwrite=overwrite, lease=lease_id)
+        logging.info(f"Successfully wrote data to blob '{blob_name}' in container '{container_name}'")
+
+    async def delete(self, container_name: str, blob_name: str, lease_id: Optional[str] = None) -> None:
+        """
+        指定されたコンテナとBlobを削除します。
+        削除は1回のリクエストで完結するため、この操作はリースを取得せずに行われます。
+        呼び出し元がBlobのリースを保持している場合は、lease_idを指定して削除します。
+        Blobが存在しない場合は何もしません。
+
+        Args:
+            container_name (str): コンテナ名
+            blob_name (str): Blob名
+            lease_id (Optional[str], optional): 保持しているリースのID。デフォルトはNone。
+        """
+        blob_client = self.__get_blob_client(container_name, blob_name)
+        try:
+            await blob_client.delete_blob(lease=lease_id)
+        except ResourceNotFoundError:
+            logging.warning(f"Blob '{blob_name}' not found in container '{container_name}'. Nothing to delete.")
+            return
+        logging.info(f"Successfully deleted blob '{blob_name}' from container '{container_name}'")
+
+    async def add_metadata(self, container_name: str, blob_name: str, metadata: Dict[str, str]) -> bool:
+        """
+        指定されたblobにメタデータを追加します。
+        この操作はリースを取得して行われます。
+
+        Args:
+            container_name (str): コンテナ名
+            blob_name (str): Blob名
+            metadata (Dict[str, str]): 追加するメタデータ
+
+        Returns:
+            bool: メタデータの追加に成功した場合はTrue
+        """
+        async with self.__blob_lease(container_name, blob_name) as (blob_client, lease_id):
+            properties = await blob_client.get_blob_properties()
+            existing_metadata = properties.metadata if properties.metadata else {}
+            existing_metadata.update(metadata)
+            await blob_client.set_blob_metadata(metadata=existing_metadata, lease=lease_id)
+        logging.info(f"Metadata added successfully. Blob: {blob_name}, Container: {container_name}")
+        return True
+
+    async def get_metadata(self, container_name: str, blob_name: str) -> Dict[str, str]:
+        """
+        指定されたコンテナとBlobのメタデータを取得します。
+        この操作はリースを取得せずに行われます。
+
+        Args:
+            container_name (str): コンテナ名
+            blob_name (str): Blob名
+
+        Returns:
+            Dict[str, str]: Blobのメタデータ。
+
+        Raises:
+            ResourceNotFoundError: Blobが存在しない場合
+            AzureError: メタデータの取得に失敗した場合
+        """
+        try:
+            blob_client = self.__get_blob_client(container_name, blob_name)
+            properties = await blob_client.get_blob_properties()
+            return properties.metadata
+        except ResourceNotFoundError:
+            logging.warning(f"Blob '{blob_name}' not found in container '{container_name}'")
+            raise
+        except AzureError as e:
+            logging.error(f"Failed to get metadata for blob '{blob_name}' in container '{container_name}': {str(e)}")
+            raise
+
+    async def list_blobs(self, container_name: str) -> List[str]:
+        """
+        指定されたコンテナ内のすべてのBlobをリストアップします。
+
+        Args:
+            container_name (str): コンテナ名
+
+        Returns:
+            List[str]: コンテナ内のBlobの名前のリスト
+        """
+        if self.__service_client is None:
+            raise RuntimeError("AsyncBlobManager is not opened. Use 'async with' or call open() first.")
+        container_client = self.__service_client.get_container_client(container_name)
+        # 名前だけを取得し、Blobごとのプロパティの転送と解析を省く
+        return [name async for name in container_client.list_blob_names(results_per_page=5000)]
@@ -1,14 +1,40 @@
+from collections import OrderedDict
 from datetime import datetime, timedelta
 import logging
-from typing import Tuple, Dict, Optional, Union
-import time
+import random
+import threading
+from typing import Tuple, Dict, Optional, Set, Union
+from concurrent.futures import ThreadPoolExecutor
 
+import requests
+from requests.adapters import HTTPAdapter
+from azure.core.pipeline.transport import RequestsTransport
 from azure.storage.blob import BlobServiceClient, ContainerClient, BlobClient, BlobLeaseClient
-from azure.core.exceptions import AzureError, ResourceNotFoundError
+from azure.core.exceptions import AzureError, HttpResponseError, ResourceNotFoundError
 from azure.identity import DefaultAzureCredential
 
 from .blob_lease_manager import BlobLeaseManager
 
+def backoff_delay(base_delay: float, attempt: int, max_delay: float = 30.0) -> float:
+    """
+    再試行までの待機時間を、ジッター付きの指数バックオフで求めます。
+    多数のワーカーが同じリースを取り合う場合に、再試行のタイミングが揃わないようにします。
+
+    Args:
+        base_delay (float): 最初の再試行の待機時間（秒）
+        attempt (int): 試行回数（0始まり）
+        max_delay (float, optional): 待機時間の上限（秒）。デフォルトは30秒。
+
+    Returns:
+        float: 待機時間（秒）
+    """
+    return min(max_delay, random.uniform(base_delay, base_delay * 2 ** attempt))
+
+class ShutdownRequested(Exception):
+    """
+    BlobContainerManagerの終了処理が要求されたため、再試行の待機を中断したことを示す例外。
+    """
+
 class BlobContainerManager:
     """
     Azure Blob Storageのコンテナとblobを管理するためのクラスです。
@@ -40,32 +66,115 @@ class BlobContainerManager:
     
     # すべてのリースを解放
     manager.release_all_leases()
+
+    # 待機中の再試行を中断し、すべてのリースを解放
+    manager.close()
+
+    # withブロックを抜ける際にすべてのリースを解放
+    with BlobContainerManager(connection_string=connection_string) as manager:
+        blob_client, lease_id = manager.acquire_lease(container_name, blob_name)
     """
     
-    def __init__(self, connection_string: str = None, account_url: str = None, credential = None):
+    # キャッシュするBlobClientの最大数（埋め込みキャッシュなど大量のblobを扱う場合にメモリを使い過ぎないようにする）
+    MAX_CACHED_BLOB_CLIENTS = 4096
+
+    # プロセス内のインスタンス間で共有する認証情報（トークンキャッシュを再利用するため）
+    _shared_credential = None
+    _shared_credential_lock = threading.Lock()
+
+    @classmethod
+    def get_shared_credential(cls) -> DefaultAzureCredential:
+        """
+        プロセス内で共有するDefaultAzureCredentialを取得します。
+        初回呼び出し時に1度だけ作成し、以降は同じインスタンス（とそのトークンキャッシュ）を返します。
+
+        Returns:
+            DefaultAzureCredential: 共有の認証情報
+        """
+        with cls._shared_credential_lock:
+            if cls._shared_credential is None:
+                cls._shared_credential = DefaultAzureCredential()
+            return cls._shared_credential
+
+    def __init__(self, connection_string: str = None, account_url: str = None, credential = None, max_connections: int = 64):
         """
         BlobContainerManagerのインスタンスを初期化します。
 
         Args:
             connection_string (str, optional): Azure Storage接続文字列
             account_url (str, optional): BlobストレージのアカウントURL
-            credential (Any, optional): 認証情報（DefaultAzureCredentialなど）
+            credential (Any, optional): 認証情報（DefaultAzureCredentialなど）。
+                account_urlのみ指定した場合は、プロセス内で共有するDefaultAzureCredentialを使用します。
+            max_connections (int, optional): 接続プールの最大接続数。複数スレッドから同時に操作する場合に
+                接続が使い回されるよう、スレッド数以上を指定します。デフォルトは64。
         """
+        # 終了処理が要求されたことを再試行の待機に伝えるイベント
+        self.__stop = threading.Event()
+        self.__transport = self.__create_transport(max_connections)
         if connection_string:
             self.__service_client = self.__get_service_client_from_connection_string(connection_string)
-        elif account_url and credential:
-            self.__service_client = self.__get_service_client_from_credential(account_url, credential)
+        elif account_url:
+            self.__service_client = self.__get_service_client_from_credential(account_url, credential or self.get_shared_credential())
         else:
-            raise ValueError("Either connection_string or both account_url and credential must be provided")
+            raise ValueError("Either connection_string or account_url must be provided")
         
         self.__leases: Dict[str, str] = {}  # キー: リソース識別子, 値: リースID
+        # 同じサービスクライアントから派生したクライアントは接続プールを共有するため、名前ごとにキャッシュして再利用する
+        self.__container_cache: Dict[str, ContainerClient] = {}
+        self.__blob_cache: "OrderedDict[Tuple[str, str], BlobClient]" = OrderedDict()
+        self.__blob_cache_lock = threading.Lock()
+        self.__validated: Set[str] = set()  # 存在確認済み（または作成済み）のコンテナ名
         
-    def __del__(self):
+    def __enter__(self) -> "BlobContainerManager":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
         """
-        オブジェクトが破棄される際に呼び出され、すべてのリースを解放します。
+        withブロックを抜ける際に、待機中の再試行を中断し、すべてのリースを解放します。
         """
+        self.close()
+
+    def close(self) -> None:
+        """
+        終了処理を行います。
+        他のスレッドで待機中の再試行をShutdownRequestedで中断させ、保持しているすべてのリースを解放します。
+        以降の再試行は待機せずにShutdownRequestedを送出します。
+        """
+        self.__stop.set()
         self.release_all_leases()
+
+    def __wait(self, delay: float) -> None:
+        """
+        再試行の前に指定された時間だけ待機します。
+        待機中に終了処理が要求された場合は、直ちに中断します。
+
+        Args:
+            delay (float): 待機時間（秒）
+
+        Raises:
+            ShutdownRequested: 終了処理が要求された場合
+        """
+        if self.__stop.wait(delay):
+            raise ShutdownRequested("BlobContainerManager is shutting down.")
         
+    @staticmethod
+    def __create_transport(max_connections: int) -> RequestsTransport:
+        """
+        接続プールの大きさを指定したHTTPトランスポートを作成します。
+        requestsの既定の接続プールは10接続のため、それ以上のスレッドから同時に操作すると接続が作り直されます。
+
+        Args:
+            max_connections (int): 接続プールの最大接続数
+
+        Returns:
+            RequestsTransport: サービスクライアントと派生したクライアントで共有するトランスポート
+        """
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_connections, pool_maxsize=max_connections)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return RequestsTransport(session=session, session_owner=False)
+
     def __get_service_client_from_connection_string(self, connection_string: str) -> BlobServiceClient:
         """
         接続文字列からBlobServiceClientインスタンスを取得します。
@@ -77,7 +186,7 @@ class BlobContainerManager:
             BlobServiceClient: BlobServiceClientインスタンス
         """
         try:
-            service_client = BlobServiceClient.from_connection_string(connection_string)
+            service_client = BlobServiceClient.from_connection_string(connection_string, transport=self.__transport)
             logging.info('BlobServiceClient created successfully from connection string.')
             return service_client
         except AzureError as e:
@@ -87,7 +196,7 @@ class BlobContainerManager:
     def __get_service_client_from_credential(self, account_url: str, credential) -> BlobServiceClient:
         """
         アカウントURLと認証情報からBlobServiceClientインスタンスを取得します。
-        認証に失敗した場合、一度だけ再試行します。
+        認証に失敗した場合、同じ認証情報で一度だけ再試行します。
 
         Args:
             account_url (str): BlobストレージのアカウントURL
@@ -98,14 +207,13 @@ class BlobContainerManager:
         """
         for attempt in range(2):  # 最初の試行と1回の再試行
             try:
-                service_client = BlobServiceClient(account_url=account_url, credential=credential)
+                service_client = BlobServiceClient(account_url=account_url, credential=credential, transport=self.__transport)
                 logging.info('BlobServiceClient created successfully from account URL and credential.')
                 return service_client
             except AzureError as e:
                 if attempt == 0:
                     logging.warning(f"Authentication failed. Retrying: {str(e)}")
-                    time.sleep(1)  # 1秒待機してから再試行
-                    credential=DefaultAzureCredential()
+                    self.__wait(backoff_delay(1, 1))  # 1〜2秒待機してから再試行（トークンキャッシュを保つため認証情報は作り直さない）
                 else:
                     logging.error(f"Failed to create BlobServiceClient after 2 attempts: {str(e)}")
                     raise
@@ -113,63 +221,128 @@ class BlobContainerManager:
     def get_client(self, container_name: str, blob_name: str = None, max_retries: int = 12, retry_delay: int = 5, create_if_not_exists: bool = True) -> Union[ContainerClient, BlobClient]:
         """
         指定されたコンテナのContainerClientまたはblobのBlobClientを取得または作成します。
+        create_if_not_existsがFalseの場合は通信を行わずにクライアントを返します。
+        存在しないコンテナやblobに対する操作は、実際の操作時にResourceNotFoundErrorとなります。
 
         Args:
             container_name (str): コンテナの名前
             blob_name (str, optional): blobの名前。指定しない場合はコンテナのクライアントを返します。
-            max_retries (int, optional): 最大再試行回数。デフォルトは5回。
-            retry_delay (int, optional): 再試行間の待機時間（秒）。デフォルトは20秒。
-            create_if_not_exists (bool, optional): クライアントが存在しない場合に作成するかどうか。デフォルトはTrue。
+            max_retries (int, optional): 最大再試行回数。デフォルトは12回。
+            retry_delay (int, optional): 再試行間の待機時間（秒）。デフォルトは5秒。
+            create_if_not_exists (bool, optional): コンテナやblobが存在しない場合に作成するかどうか。デフォルトはTrue。
 
         Returns:
             Union[ContainerClient, BlobClient]: 成功した場合はContainerClientまたはBlobClientインスタンス
 
         Raises:
             AzureError: Azure Storageとの通信中にエラーが発生した場合
-            ResourceNotFoundError: コンテナまたはblobが存在せず、create_if_not_existsがFalseの場合
+            ResourceNotFoundError: コンテナを作成できなかった場合
         """
-        for attempt in range(max_retries):
+        if create_if_not_exists:
+            container_client = self.__ensure_container(container_name, max_retries, retry_delay)
+        else:
+            container_client = self.__get_cached_container_client(container_name)
+
+        if not blob_name:
+            return container_client
+
+        blob_client = self.__get_cached_blob_client(container_client, container_name, blob_name)
+        if create_if_not_exists:
             try:
-                container_client = self.__service_client.get_container_client(container_name)
-                container_client.get_container_properties()  # コンテナの存在確認
+                blob_client.get_blob_properties()
             except ResourceNotFoundError:
-                if create_if_not_exists:
-                    # コンテナが存在しない場合、ここで作成を試みる
-                    try:
-                        container_client = self.__service_client.create_container(container_name)
-                        logging.info(f"Container '{container_name}' created successfully.")
-                    except AzureError as e:
-                        if "ContainerBeingDeleted" in str(e):
-                            if attempt < max_retries - 1:
-                                logging.warning(f"Container '{container_name}' is being deleted. Attempt {attempt + 1}/{max_retries}. Waiting {retry_delay} seconds before retry.")
-                                time.sleep(retry_delay)
-                                continue  # 次の試行へ
-                            else:
-                                logging.error(f"Failed to create container '{container_name}' after {max_retries} attempts.")
-                                raise ResourceNotFoundError(f"Container '{container_name}' not found or could not be created.")
-                        else:
-                            logging.error(f"Failed to create container '{container_name}': {str(e)}")
-                            raise
-                else:
-                    raise ResourceNotFoundError(f"Container '{container_name}' not found.")
+                blob_client.upload_blob(data="", overwrite=True)
+                logging.info(f"Blob '{blob_name}' created in container '{container_name}'.")
+        return blob_client
 
-            if blob_name:
-                blob_client = container_client.get_blob_client(blob_name)
+    def __get_cached_container_client(self, container_name: str) -> ContainerClient:
+        """
+        キャッシュからContainerClientを取得します。存在しない場合は通信を行わずに作成してキャッシュします。
+
+        Args:
+            container_name (str): コンテナの名前
+
+        Returns:
+            ContainerClient: ContainerClientインスタンス
+        """
+        container_client = self.__container_cache.get(container_name)
+        if container_client is None:
+            container_client = self.__service_client.get_container_client(container_name)
+            self.__container_cache[container_name] = container_client
+        return container_client
+
+    def __ensure_container(self, container_name: str, max_retries: int, retry_delay: int) -> ContainerClient:
+        """
+        コンテナが存在することを確認し、存在しない場合は作成します。
+        存在確認はコンテナごとに初回のみ行います。
+
+        Args:
+            container_name (str): コンテナの名前
+            max_retries (int): 最大再試行回数
+            retry_delay (int): 再試行間の待機時間（秒）
+
+        Returns:
+            ContainerClient: ContainerClientインスタンス
+
+        Raises:
+            AzureError: Azure Storageとの通信中にエラーが発生した場合
+            ResourceNotFoundError: コンテナを作成できなかった場合
+        """
+        container_client = self.__get_cached_container_client(container_name)
+        if container_name in self.__validated:
+            return container_client
+
+        for attempt in range(max_retries):
+            try:
+                container_client.get_container_properties()
+                self.__validated.add(container_name)
+                return container_client
+            except ResourceNotFoundError:
+                # コンテナが存在しない場合、ここで作成を試みる
                 try:
-                    blob_client.get_blob_properties()
-                except ResourceNotFoundError:
-                    if create_if_not_exists:
-                        blob_client.upload_blob(data="", overwrite=True)
-                        logging.info(f"Blob '{blob_name}' created in container '{container_name}'.")
+                    container_client = self.__service_client.create_container(container_name)
+                    self.__container_cache[container_name] = container_client
+                    self.__validated.add(container_name)
+                    logging.info(f"Container '{container_name}' created successfully.")
+                    return container_client
+                except AzureError as e:
+                    if "ContainerBeingDeleted" in str(e):
+                        if attempt < max_retries - 1:
+                            delay = backoff_delay(retry_delay, attempt)
+                            logging.warning(f"Container '{container_name}' is being deleted. Attempt {attempt + 1}/{max_retries}. Waiting {delay:.1f} seconds before retry.")
+                            self.__wait(delay)
+                            continue  # 次の試行へ
                     else:
-                        raise ResourceNotFoundError(f"Blob '{blob_name}' not found in container '{container_name}'.")
-                return blob_client
-            else:
-                return container_client
+                        logging.error(f"Failed to create container '{container_name}': {str(e)}")
+                        raise
 
         logging.error(f"Failed to get or create container '{container_name}' after {max_retries} attempts.")
         raise ResourceNotFoundError(f"Container '{container_name}' not found or could not be created.")
 
+    def __get_cached_blob_client(self, container_client: ContainerClient, container_name: str, blob_name: str) -> BlobClient:
+        """
+        キャッシュからBlobClientを取得します。存在しない場合はContainerClientから作成してキャッシュします。
+
+        Args:
+            container_client (ContainerClient): blobが属するコンテナのクライアント
+            container_name (str): コンテナの名前
+            blob_name (str): blobの名前
+
+        Returns:
+            BlobClient: BlobClientインスタンス
+        """
+        key = (container_name, blob_name)
+        with self.__blob_cache_lock:
+            blob_client = self.__blob_cache.get(key)
+            if blob_client is None:
+                blob_client = container_client.get_blob_client(blob_name)
+                self.__blob_cache[key] = blob_client
+                if len(self.__blob_cache) > self.MAX_CACHED_BLOB_CLIENTS:
+                    self.__blob_cache.popitem(last=False)
+            else:
+                self.__blob_cache.move_to_end(key)
+            return blob_client
+
     def acquire_lease(self, container_name: str, blob_name: str = None, max_retries: int = 12, retry_delay: int = 5) -> Tuple[Union[ContainerClient, BlobClient], str]:
         """
         指定されたコンテナまたはblobのリースを取得します。
@@ -187,30 +360,52 @@ class BlobContainerManager:
             AzureError: リース取得に失敗した場合
         """
         client = self.get_client(container_name, blob_name)
+        key = f"{container_name}/{blob_name}" if blob_name else container_name
+        # ログ用の表記は再試行ループの外で一度だけ組み立てる
+        if isinstance(client, BlobClient):
+            resource_label = f"Blob '{blob_name}' in container '{container_name}'"
+        else:
+            resource_label = f"Container '{container_name}'"
 
         for attempt in range(max_retries):
-            properties = client.get_blob_properties() if isinstance(client, BlobClient) else client.get_container_properties()
-            if properties.lease.state != "leased":
+            # リースの有無はサーバー側で原子的に判定されるため、事前にプロパティを確認せず直接取得を試みる
+            try:
                 lease_client = BlobLeaseManager.acquire_lease(client)
-                if lease_client:
-                    # クライアントのメタデータから一意の識別子を取得
-                    key = f"{properties['container']}/{properties['name']}" if isinstance(client, BlobClient) else properties['name']
-                    self.__leases[key] = {
-                        'lease_id': lease_client.id,
-                        'lease_client': lease_client
-                    }
-                    return client, lease_client.id
+            except HttpResponseError as e:
+                if e.status_code != 409:
+                    raise
+                lease_client = None
+
+            if lease_client:
+                self.__leases[key] = {
+                    'lease_id': lease_client.id,
+                    'lease_client': lease_client
+                }
+                return client, lease_client.id
 
             if attempt < max_retries - 1:
-                resource_type = "Blob" if isinstance(client, BlobClient) else "Container"
-                resource_name = f"'{blob_name}' in container '{container_name}'" if isinstance(client, BlobClient) else f"'{container_name}'"
-                logging.info(f"{resource_type} {resource_name} has an active lease or lease acquisition failed. Attempt {attempt + 1}/{max_retries}. Waiting {retry_delay} seconds before retry.")
-                time.sleep(retry_delay)
+                delay = backoff_delay(retry_delay, attempt)
+                if logging.getLogger().isEnabledFor(logging.INFO):
+                    logging.info(f"{resource_label} has an active lease or lease acquisition failed. Attempt {attempt + 1}/{max_retries}. Waiting {delay:.1f} seconds before retry.")
+                self.__wait(delay)
+
+        logging.error(f"Failed to acquire lease for {resource_label} after {max_retries} attempts.")
+        raise AzureError(f"Failed to acquire lease for {resource_label}.")
+
+    def get_lease_id(self, container_name: str, blob_name: str = None) -> Optional[str]:
+        """
+        このインスタンスが保持しているリースのIDを取得します。
+
+        Args:
+            container_name (str): コンテナの名前
+            blob_name (str, optional): blobの名前。指定しない場合はコンテナのリースIDを返します。
 
-        resource_type = "Blob" if blob_name else "Container"
-        resource_name = f"'{blob_name}' in container '{container_name}'" if blob_name else f"'{container_name}'"
-        logging.error(f"Failed to acquire lease for {resource_type} {resource_name} after {max_retries} attempts.")
-        raise AzureError(f"Failed to acquire lease for {resource_type} {resource_name}.")
+        Returns:
+            Optional[str]: リースID。リースを保持していない場合はNone。
+        """
+        key = f"{container_name}/{blob_name}" if blob_name else container_name
+        lease = self.__leases.get(key)
+        return lease['lease_id'] if lease else None
 
     def release_lease(self, container_name: str, blob_name: str = None):
         """
@@ -239,22 +434,20 @@ class BlobContainerManager:
             resource_name = f"{blob_name} in {container_name}" if blob_name else container_name
             logging.warning(f"No matching lease found for {resource_type} '{resource_name}'.")
 
-    def release_all_leases(self):
+    def release_all_leases(self, max_workers: int = 16):
         """
-        すべてのリースを解放します。
+        すべてのリースを並列に解放します。
+
+        Args:
+            max_workers (int, optional): 同時に解放するリースの最大数。デフォルトは16。
         """
-        errors = []
-        for key, lease in list(self.__leases.items()):
-            try:
-                lease_client = lease.get('lease_client')
-                BlobLeaseManager.release(lease_client)
-                del self.__leases[key]
-                logging.info(f"Lease '{key}' successfully released.")
-            except Exception as e:
-                if "LeaseIdMismatchWithLeaseOperation" in str(e):
-                    logging.debug(f"Lease '{key}' has already been released or acquired by another client.")
-                else:
-                    logging.error(f"An error occurred while releasing lease '{key}': {str(e)}")
+        leases = list(self.__leases.items())
+        if not leases:
+            logging.info("All leases successfully released.")
+            return
+
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(leases))) as executor:
+            errors = [error for error in executor.map(self.__release_one, leases) if error]
 
         if errors:
             for error in errors:
@@ -262,3 +455,26 @@ class BlobContainerManager:
             logging.warning(f"Errors occurred while releasing {len(errors)} lease(s). {len(self.__leases)} lease(s) remain unreleased.")
         else:
             logging.info("All leases successfully released.")
+
+    def __release_one(self, item: Tuple[str, Dict]) -> Optional[str]:
+        """
+        1件のリースを解放します。
+
+        Args:
+            item (Tuple[str, Dict]): リソース識別子とリース情報のタプル
+
+        Returns:
+            Optional[str]: 解放に失敗した場合はエラーメッセージ、成功した場合はNone
+        """
+        key, lease = item
+        try:
+            BlobLeaseManager.release(lease.get('lease_client'))
+            self.__leases.pop(key, None)
+            logging.info(f"Lease '{key}' successfully released.")
+        except Exception as e:
+            if "LeaseIdMismatchWithLeaseOperation" in str(e):
+                logging.debug(f"Lease '{key}' has already been released or acquired by another client.")
+                self.__leases.pop(key, None)
+            else:
+                return f"An error occurred while releasing lease '{key}': {str(e)}"
+        return None
\ No newline at end of file
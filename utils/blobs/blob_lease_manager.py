@@ -2,7 +2,7 @@ import logging
 from typing import Optional
 
 from azure.storage.blob import ContainerClient, BlobClient, BlobLeaseClient
-from azure.core.exceptions import AzureError
+from azure.core.exceptions import AzureError, HttpResponseError
 
 class BlobLeaseManager:
     """
@@ -18,7 +18,7 @@ class BlobLeaseManager:
 
         Args:
             client: リースを取得するクライアント（ContainerClientまたはBlobClient）
-            lease_duration (int): リースの有効期間（秒）。デフォルトは60秒
+            lease_duration (int): リースの有効期間（秒）。デフォルトは20秒
 
         Returns:
             Optional[str]: 成功した場合はリースID、失敗した場合はNone
@@ -42,7 +42,10 @@ class BlobLeaseManager:
             
             return lease_client
         except AzureError as e:
-            if isinstance(client, ContainerClient):
+            if isinstance(e, HttpResponseError) and e.status_code == 409:
+                # 他のクライアントがリースを保持している場合は呼び出し元で再試行されるため、エラーとして記録しない
+                logging.debug(f"Lease is already present for {client.url}.")
+            elif isinstance(client, ContainerClient):
                 logging.error(f"Failed to acquire lease for container: {client.container_name}. Error: {str(e)}")
             elif isinstance(client, BlobClient):
                 logging.error(f"Failed to acquire lease for blob: {client.blob_name} in container: {client.container_name}. Error: {str(e)}")
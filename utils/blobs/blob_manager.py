@@ -1,11 +1,44 @@
-import functools
-from typing import Callable, Any, Union, Dict, Optional, List, Tuple
+import codecs
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Union, Dict, Iterator, Optional, List, Tuple
 from azure.storage.blob import ContainerClient, BlobClient
-from azure.core.exceptions import ResourceNotFoundError, AzureError
+from azure.core import MatchConditions
+from azure.core.exceptions import (ResourceNotFoundError, ResourceModifiedError, ResourceNotModifiedError, ResourceExistsError,
+                                   HttpResponseError, AzureError)
 import logging
 
 from .blob_container_manager import BlobContainerManager
 
+class AppendBlobSealedError(ResourceModifiedError):
+    """
+    シールされたAppend Blobに追記しようとしたことを示す例外。
+    シールされたログは別の世代に切り替えられているため、最新の状態を読み込み直してから再試行してください。
+    """
+
+class _BufferWriter:
+    """
+    事前に確保したバッファへ先頭から順に書き込む、書き込み専用のストリーム。
+    StorageStreamDownloader.readintoの書き込み先として使用します。
+    """
+
+    def __init__(self, buffer: bytearray):
+        self.__view = memoryview(buffer)
+        self.__offset = 0
+
+    def write(self, data: bytes) -> int:
+        size = len(data)
+        self.__view[self.__offset:self.__offset + size] = data
+        self.__offset += size
+        return size
+
+    def writable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return False
+
 class BlobManager:
     """
     Azure Blob Storageを管理するためのクラス。
@@ -35,6 +68,10 @@ class BlobManager:
         # バイトデータとして読み込む
         byte_data = blob_manager.read("my-container", "hello.txt", as_byte=True)
 
+        # 大きなテキストをチャンクごとに読み込む
+        for text in blob_manager.read_text_stream("my-container", "large.txt"):
+            print(text)
+
         # データを削除する
         blob_manager.delete("my-container", "hello.txt")
 
@@ -44,6 +81,10 @@ class BlobManager:
         # メタデータを取得する
         metadata = blob_manager.get_metadata("my-container", "hello.txt")
 
+        # withブロックを抜ける際に保持しているリースを解放する
+        with BlobManager(connection_string="your_connection_string") as blob_manager:
+            blob_manager.add_metadata("my-container", "hello.txt", {"key": "value"})
+
         # Blobの存在を確認する
         exists = blob_manager.blob_exist("my-container", "hello.txt")
 
@@ -62,46 +103,39 @@ class BlobManager:
         success = self.transaction("my-container", operations)
     """
 
-    def __init__(self, connection_string: Optional[str] = None, account_url: Optional[str] = None, credential: Any = None):
+    # キャッシュするメタデータの最大数
+    MAX_CACHED_METADATA = 4096
+
+    def __init__(self, connection_string: Optional[str] = None, account_url: Optional[str] = None, credential: Any = None,
+                 max_connections: int = 64):
         """
         BlobManagerのインスタンスを初期化します。
 
         Args:
             connection_string (Optional[str]): Azure Storage接続文字列
             account_url (Optional[str]): BlobストレージのアカウントURL
-            credential (Any): 認証情報（DefaultAzureCredentialなど）
+            credential (Any): 認証情報（DefaultAzureCredentialなど）。省略した場合はプロセス内で共有するDefaultAzureCredentialを使用します。
+            max_connections (int, optional): 接続プールの最大接続数。デフォルトは64。
         """
         self.__container_manager = BlobContainerManager(
             connection_string=connection_string,
             account_url=account_url,
-            credential=credential
+            credential=credential,
+            max_connections=max_connections
         )
+        # Blobごとのメタデータと対応するETag（add_metadataで再取得を省くために使用する）
+        self.__metadata_cache: "OrderedDict[Tuple[str, str], Tuple[str, Dict[str, str]]]" = OrderedDict()
+        self.__metadata_cache_lock = threading.Lock()
 
-    def with_blob_lease(method: Callable) -> Callable:
-        """
-        Blobのリースを取得し、メソッド実行後にリースを解放するデコレーター。
-
-        Args:
-            method (Callable): デコレートするメソッド
+    def __enter__(self) -> "BlobManager":
+        return self
 
-        Returns:
-            Callable: ラップされたメソッド
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
         """
-        @functools.wraps(method)
-        def wrapper(self, container_name: str, blob_name: str, *args, **kwargs):
-            blob_client, lease_id = self.__container_manager.acquire_lease(container_name, blob_name)
-            try:
-                kwargs['blob_client'] = blob_client
-                kwargs['lease_id'] = lease_id
-                return method(self, container_name, blob_name, *args, **kwargs)
-            except Exception as e:
-                logging.error(f"Error occurred during execution with lease. Container: {container_name}, Blob: {blob_name}. Error: {str(e)}")
-                raise
-            finally:
-                if lease_id:
-                    self.__container_manager.release_lease(container_name, blob_name)
-        return wrapper
-    
+        withブロックを抜ける際に、待機中の再試行を中断し、保持しているすべてのリースを解放します。
+        """
+        self.__container_manager.close()
+
     def read(self, container_name: str, blob_name: str, as_byte: bool = True) -> Union[bytes, str]:
         """
         指定されたコンテナとBlobからデータを読み込みます。
@@ -110,7 +144,7 @@ class BlobManager:
         Args:
             container_name (str): コンテナ名
             blob_name (str): Blob名
-            as_byte (bool, optional): Trueの場合、データをバイトとして返します。Falseの場合、文字列として返します。デフォルトはFalse。
+            as_byte (bool, optional): Trueの場合、データをバイトとして返します。Falseの場合、文字列として返します。デフォルトはTrue。
 
         Returns:
             Union[bytes, str]: 読み込んだデータ。
@@ -121,10 +155,14 @@ class BlobManager:
         """
         try:
             blob_client = self.__container_manager.get_client(container_name, blob_name, create_if_not_exists=False)
-            data = blob_client.download_blob().readall()
+            downloader = blob_client.download_blob()
             if as_byte:
-                return data
-            return data.decode('utf-8')
+                return downloader.readall()
+
+            # 文字列として返す場合は、サイズ分のバッファを1度だけ確保して読み込み、そのままデコードする
+            buffer = bytearray(downloader.size)
+            downloader.readinto(_BufferWriter(buffer))
+            return buffer.decode('utf-8')
         except ResourceNotFoundError:
             logging.warning(f"Blob '{blob_name}' not found in container '{container_name}'")
             raise
@@ -132,77 +170,381 @@ class BlobManager:
             logging.error(f"Failed to read blob '{blob_name}' from container '{container_name}': {str(e)}")
             raise
 
-    @with_blob_lease
-    def upload(self, container_name: str, blob_name: str, data: Union[str, bytes, None] = None, blob_client: BlobClient = None, lease_id: str = None, overwrite: bool = True) -> None:
+    def read_if_modified(self, container_name: str, blob_name: str, etag: Optional[str] = None) -> Tuple[Optional[bytes], Optional[str]]:
+        """
+        指定されたBlobが前回の読み込みから変更されている場合のみ、データを読み込みます。
+        If-None-Match付きで要求するため、変更がない場合はデータを転送せずにサーバーから304が返ります。
+        この操作はリースを取得せずに行われます。
+
+        Args:
+            container_name (str): コンテナ名
+            blob_name (str): Blob名
+            etag (Optional[str], optional): 前回読み込んだ時のETag。Noneの場合は常に読み込みます。
+
+        Returns:
+            Tuple[Optional[bytes], Optional[str]]: 読み込んだデータとETagのタプル。変更がない場合、データはNoneで、ETagは引数の値です。
+
+        Raises:
+            ResourceNotFoundError: Blobが存在しない場合
+            Exception: データの読み込みに失敗した場合
+        """
+        try:
+            blob_client = self.__container_manager.get_client(container_name, blob_name, create_if_not_exists=False)
+            if etag is None:
+                downloader = blob_client.download_blob()
+            else:
+                downloader = blob_client.download_blob(etag=etag, match_condition=MatchConditions.IfModified)
+            return downloader.readall(), downloader.properties.etag
+        except ResourceNotModifiedError:
+            logging.debug(f"Blob '{blob_name}' in container '{container_name}' is not modified")
+            return None, etag
+        except ResourceNotFoundError:
+            logging.warning(f"Blob '{blob_name}' not found in container '{container_name}'")
+            raise
+        except Exception as e:
+            logging.error(f"Failed to read blob '{blob_name}' from container '{container_name}': {str(e)}")
+            raise
+
+    def download_to_file(self, container_name: str, blob_name: str, file_path: str, max_concurrency: int = 8) -> int:
+        """
+        指定されたBlobをファイルにダウンロードします。
+        データはチャンクごとにファイルへ書き込まれるため、大きなBlobでもBlob全体をメモリに保持しません。
+        この操作はリースを取得せずに行われます。
+
+        Args:
+            container_name (str): コンテナ名
+            blob_name (str): Blob名
+            file_path (str): 書き込み先のファイルパス
+            max_concurrency (int, optional): 並列にダウンロードするチャンクの数。デフォルトは8。
+
+        Returns:
+            int: ダウンロードしたバイト数
+
+        Raises:
+            ResourceNotFoundError: Blobが存在しない場合
+            Exception: ダウンロードに失敗した場合
+        """
+        try:
+            blob_client = self.__container_manager.get_client(container_name, blob_name, create_if_not_exists=False)
+            with open(file_path, 'wb') as f:
+                return blob_client.download_blob(max_concurrency=max_concurrency).readinto(f)
+        except ResourceNotFoundError:
+            logging.warning(f"Blob '{blob_name}' not found in container '{container_name}'")
+            raise
+        except Exception as e:
+            logging.error(f"Failed to download blob '{blob_name}' from container '{container_name}' to '{file_path}': {str(e)}")
+            raise
+
+    def read_many(self, container_name: str, blob_names: List[str], as_byte: bool = True, max_workers: int = 16) -> Dict[str, Union[bytes, str]]:
+        """
+        指定されたコンテナから複数のBlobを並列に読み込みます。
+        各Blobの読み込みはreadと同様にリースを取得せずに行われます。
+
+        Args:
+            container_name (str): コンテナ名
+            blob_names (List[str]): 読み込むBlob名のリスト
+            as_byte (bool, optional): Trueの場合、データをバイトとして返します。Falseの場合、文字列として返します。デフォルトはTrue。
+            max_workers (int, optional): 同時に読み込むBlobの最大数。デフォルトは16。
+
+        Returns:
+            Dict[str, Union[bytes, str]]: Blob名と読み込んだデータのディクショナリ
+
+        Raises:
+            ResourceNotFoundError: いずれかのBlobが存在しない場合
+            Exception: いずれかのBlobの読み込みに失敗した場合
+        """
+        blob_names = list(dict.fromkeys(blob_names))  # 重複を除く（順序は保つ）
+        if not blob_names:
+            return {}
+        if len(blob_names) == 1:
+            return {blob_names[0]: self.read(container_name, blob_names[0], as_byte)}
+
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(blob_names))) as executor:
+            contents = executor.map(lambda blob_name: self.read(container_name, blob_name, as_byte), blob_names)
+            return dict(zip(blob_names, contents))
+
+    def read_text_stream(self, container_name: str, blob_name: str) -> Iterator[str]:
+        """
+        指定されたコンテナとBlobからテキストを読み込み、ダウンロードしたチャンクごとに文字列として返します。
+        この操作はリースを取得せずに行われます。
+        チャンクの境界で分割されたマルチバイト文字はインクリメンタルデコーダーで次のチャンクとつなげてデコードするため、
+        大きなテキストでもBlob全体をメモリに保持せずに処理できます。
+
+        Args:
+            container_name (str): コンテナ名
+            blob_name (str): Blob名
+
+        Yields:
+            str: デコードしたテキストの断片
+
+        Raises:
+            ResourceNotFoundError: Blobが存在しない場合
+            Exception: データの読み込みに失敗した場合
+        """
+        try:
+            blob_client = self.__container_manager.get_client(container_name, blob_name, create_if_not_exists=False)
+            decoder = codecs.getincrementaldecoder('utf-8')()
+            for chunk in blob_client.download_blob().chunks():
+                text = decoder.decode(chunk)
+                if text:
+                    yield text
+            text = decoder.decode(b'', final=True)
+            if text:
+                yield text
+        except ResourceNotFoundError:
+            logging.warning(f"Blob '{blob_name}' not found in container '{container_name}'")
+            raise
+        except Exception as e:
+            logging.error(f"Failed to read blob '{blob_name}' from container '{container_name}': {str(e)}")
+            raise
+
+    def upload(self, container_name: str, blob_name: str, data: Union[str, bytes, None] = None, lease_id: str = None, overwrite: bool = True,
+               max_concurrency: int = 1, etag: Optional[str] = None) -> Optional[str]:
         """
         指定されたコンテナとBlobにデータを書き込みます。
-        この操作はリースを取得して行われます。
+        書き込みは1回のリクエストでサーバー側で直列化されるため、この操作はリースを取得せずに行われます。
+        このインスタンスがBlobのリースを保持している場合は、そのリースIDを指定して書き込みます。
         データが渡されなかった場合、空のファイルを作成します。
 
         Args:
             container_name (str): コンテナ名
             blob_name (str): Blob名
             data (Union[str, bytes, None], optional): アップロードするデータ。デフォルトはNone。
-            blob_client (BlobClient, optional): Blobクライアント
-            lease_id (str, optional): リースID
+            lease_id (str, optional): リースID。省略した場合は保持しているリースのIDを使用します。
             overwrite (bool, optional): 上書きを許可するかどうか。デフォルトはTrue。
+            max_concurrency (int, optional): ブロックを並列にアップロードする数。デフォルトは1。
+                SDKの単一PUTの上限（既定で64MiB）を超えるデータはブロックに分割してアップロードされるため、
+                大きなデータでは並列数を増やすと転送が速くなります。並列数に比例してブロックのバッファ分のメモリを使用します。
+            etag (Optional[str], optional): 指定した場合、BlobのETagが一致する場合のみ書き込みます（If-Match）。
+                読み込んでから他のクライアントが書き込んでいた場合は、ResourceModifiedErrorが発生します。
 
         Returns:
-            None
+            Optional[str]: 書き込んだBlobのETag
+
+        Raises:
+            ResourceModifiedError: etagを指定し、BlobのETagが一致しなかった場合
         """
         if data is None:
             data = b''  
-        elif isinstance(data, str):
-            data = data.encode('utf-8')
         
-        blob_client.upload_blob(data, overwrite=overwrite, lease=lease_id)
+        self.__container_manager.get_client(container_name)  # コンテナの存在確認（初回のみ）
+        blob_client = self.__container_manager.get_client(container_name, blob_name, create_if_not_exists=False)
+        lease_id = lease_id or self.__container_manager.get_lease_id(container_name, blob_name)
+        # 文字列はSDK側でUTF-8にエンコードされるため、そのまま渡す
+        length = len(data) if isinstance(data, (bytes, bytearray)) else None
+        conditions = {'etag': etag, 'match_condition': MatchConditions.IfNotModified} if etag else {}
+        response = blob_client.upload_blob(data, length=length, overwrite=overwrite, lease=lease_id, encoding='utf-8',
+                                           max_concurrency=max_concurrency, **conditions)
         logging.info(f"Successfully wrote data to blob '{blob_name}' in container '{container_name}'")
+        return response.get('etag')
+
+    def upload_many(self, container_name: str, items: List[Tuple[str, Union[str, bytes, None]]], max_workers: int = 32) -> None:
+        """
+        指定されたコンテナに複数のBlobを並列に書き込みます。
+        各Blobの書き込みはuploadと同様にリースを取得せずに行われます。
+
+        Args:
+            container_name (str): コンテナ名
+            items (List[Tuple[str, Union[str, bytes, None]]]): Blob名とアップロードするデータのタプルのリスト
+            max_workers (int, optional): 同時に書き込むBlobの最大数。デフォルトは32。
+
+        Returns:
+            None
+
+        Raises:
+            Exception: いずれかのBlobの書き込みに失敗した場合
+        """
+        if not items:
+            return
+
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as executor:
+            futures = [executor.submit(self.upload, container_name, blob_name, data) for blob_name, data in items]
+            for future in futures:
+                future.result()
+
+    def read_from(self, container_name: str, blob_name: str, offset: int, length: Optional[int] = None) -> bytes:
+        """
+        指定されたBlobの、offsetバイト目から末尾（lengthを指定した場合はlengthバイト）までのデータを読み込みます。
+        Append Blobに前回の読み込み以降に追記されたデータや、まとめて保存したレコードの一部だけを取得するために使用します。
+        この操作はリースを取得せずに行われます。
+
+        Args:
+            container_name (str): コンテナ名
+            blob_name (str): Blob名
+            offset (int): 読み込みを開始する位置（バイト）
+            length (Optional[int], optional): 読み込むバイト数。省略した場合は末尾まで読み込みます。
+
+        Returns:
+            bytes: 読み込んだデータ。offsetがBlobの末尾以降の場合は空のバイト列。
+
+        Raises:
+            ResourceNotFoundError: Blobが存在しない場合
+        """
+        blob_client = self.__container_manager.get_client(container_name, blob_name, create_if_not_exists=False)
+        try:
+            return blob_client.download_blob(offset=offset, length=length).readall()
+        except HttpResponseError as e:
+            if e.status_code == 416:  # 追記されたデータがない
+                return b''
+            if not isinstance(e, ResourceNotFoundError):
+                logging.error(f"Failed to read blob '{blob_name}' from container '{container_name}' at offset {offset}: {str(e)}")
+            raise
 
-    @with_blob_lease
-    def delete(self, container_name: str, blob_name: str, blob_client: BlobClient = None, lease_id: str = None) -> None:
+    def append(self, container_name: str, blob_name: str, data: bytes, append_position: Optional[int] = None) -> int:
+        """
+        Append Blobの末尾にデータを1回のリクエストで追記します。Blobが存在しない場合は作成します。
+        1回の追記はサーバー側でアトミックに行われるため、この操作はリースを取得せずに行われます。
+
+        Args:
+            container_name (str): コンテナ名
+            blob_name (str): Blob名
+            data (bytes): 追記するデータ（4MiB以下）
+            append_position (Optional[int], optional): 指定した場合、Blobのサイズがこの値と一致する場合のみ追記します。
+                読み込んでから他のクライアントが追記していた場合は、ResourceModifiedErrorが発生します。
+
+        Returns:
+            int: 追記後のBlobのサイズ
+
+        Raises:
+            ResourceModifiedError: append_positionがBlobのサイズと一致しない場合
+            AppendBlobSealedError: Blobがシールされている場合
+        """
+        blob_client = self.__container_manager.get_client(container_name, blob_name, create_if_not_exists=False)
+        for attempt in range(2):
+            try:
+                response = blob_client.append_block(data, length=len(data), appendpos_condition=append_position)
+                return int(response['blob_append_offset']) + len(data)
+            except ResourceNotFoundError:
+                if attempt == 1:
+                    raise
+                try:
+                    # 既に他のクライアントが作成していた場合は、そのまま追記する
+                    blob_client.create_append_blob(if_none_match='*')
+                except ResourceExistsError:
+                    pass
+            except HttpResponseError as e:
+                if e.error_code == 'BlobIsSealed':
+                    raise AppendBlobSealedError(message=str(e), response=e.response) from e
+                if e.error_code == 'AppendPositionConditionNotMet' and not isinstance(e, ResourceModifiedError):
+                    raise ResourceModifiedError(message=str(e), response=e.response) from e
+                raise
+
+    def seal(self, container_name: str, blob_name: str, append_position: Optional[int] = None) -> None:
+        """
+        Append Blobをシールし、以降の追記を禁止します。
+
+        Args:
+            container_name (str): コンテナ名
+            blob_name (str): Blob名
+            append_position (Optional[int], optional): 指定した場合、Blobのサイズがこの値と一致する場合のみシールします。
+
+        Raises:
+            ResourceModifiedError: append_positionがBlobのサイズと一致しない場合
+        """
+        blob_client = self.__container_manager.get_client(container_name, blob_name, create_if_not_exists=False)
+        try:
+            blob_client.seal_append_blob(appendpos_condition=append_position)
+        except HttpResponseError as e:
+            if e.error_code == 'AppendPositionConditionNotMet' and not isinstance(e, ResourceModifiedError):
+                raise ResourceModifiedError(message=str(e), response=e.response) from e
+            raise
+
+    def delete(self, container_name: str, blob_name: str, lease_id: str = None) -> None:
         """
         指定されたコンテナとBlobを削除します。
-        この操作はリースを取得して行われます。
+        削除は1回のリクエストで完結するため、この操作はリースを取得せずに行われます。
+        このインスタンスがBlobのリースを保持している場合は、そのリースIDを指定して削除します。
+        Blobが存在しない場合は何もしません。
 
         Args:
             container_name (str): コンテナ名
             blob_name (str): Blob名
-            blob_client (BlobClient, optional): Blobクライアント
-            lease_id (str, optional): リースID
+            lease_id (str, optional): リースID。省略した場合は保持しているリースのIDを使用します。
 
         Returns:
             None
         """
-        blob_client.delete_blob(lease=lease_id)
+        blob_client = self.__container_manager.get_client(container_name, blob_name, create_if_not_exists=False)
+        lease_id = lease_id or self.__container_manager.get_lease_id(container_name, blob_name)
+        try:
+            blob_client.delete_blob(lease=lease_id)
+        except ResourceNotFoundError:
+            logging.warning(f"Blob '{blob_name}' not found in container '{container_name}'. Nothing to delete.")
+            return
         logging.info(f"Successfully deleted blob '{blob_name}' from container '{container_name}'")
         
-    @with_blob_lease
-    def add_metadata(self, container_name: str, blob_name: str, metadata: Dict[str, str], blob_client: BlobClient = None, lease_id: str = None) -> bool:
+    def add_metadata(self, container_name: str, blob_name: str, metadata: Dict[str, str], merge: bool = True, lease_id: str = None) -> bool:
         """
         指定されたblobにメタデータを追加します。
-        この操作はリースを取得して行われます。
+        この操作はリースを取得せず、ETagによる楽観的同時実行制御で行われます。
+        前回取得または更新したメタデータとETagをキャッシュし、他から更新されていなければ1回のリクエストで更新します。
+        更新されていた場合は、最新のメタデータを取得し直して1度だけ再試行します。
+        このインスタンスがBlobのリースを保持している場合は、そのリースIDを指定して更新します。
 
         Args:
             container_name (str): コンテナ名
             blob_name (str): Blob名
             metadata (Dict[str, str]): 追加するメタデータ
-            blob_client (BlobClient, optional): Blobクライアント
-            lease_id (str, optional): リースID
+            merge (bool, optional): Trueの場合、既存のメタデータに追加します。Falseの場合、メタデータを置き換えます。デフォルトはTrue。
+            lease_id (str, optional): リースID。省略した場合は保持しているリースのIDを使用します。
 
         Returns:
             bool: メタデータの追加に成功した場合はTrue
+
+        Raises:
+            ResourceModifiedError: 再試行しても他の更新と競合した場合
         """
-        properties = blob_client.get_blob_properties()
-        existing_metadata = properties.metadata if properties.metadata else {}
-        existing_metadata.update(metadata)
-        blob_client.set_blob_metadata(metadata=existing_metadata, lease=lease_id)
-        logging.info(f"Metadata added successfully. Blob: {blob_name}, Container: {container_name}")
-        return True
+        blob_client = self.__container_manager.get_client(container_name, blob_name, create_if_not_exists=False)
+        lease_id = lease_id or self.__container_manager.get_lease_id(container_name, blob_name)
+        key = (container_name, blob_name)
+
+        if not merge:
+            result = blob_client.set_blob_metadata(metadata=metadata, lease=lease_id)
+            self.__cache_metadata(key, result['etag'], metadata)
+            logging.info(f"Metadata added successfully. Blob: {blob_name}, Container: {container_name}")
+            return True
+
+        with self.__metadata_cache_lock:
+            cached = self.__metadata_cache.get(key)
+        for attempt in range(2):
+            if cached is None:
+                properties = blob_client.get_blob_properties()
+                cached = (properties.etag, properties.metadata or {})
+
+            etag, existing_metadata = cached
+            merged_metadata = {**existing_metadata, **metadata}
+            try:
+                result = blob_client.set_blob_metadata(metadata=merged_metadata, lease=lease_id,
+                                                       etag=etag, match_condition=MatchConditions.IfNotModified)
+            except ResourceModifiedError:
+                # キャッシュ取得後に他から更新されている場合は、最新の状態を取得し直して再試行する
+                with self.__metadata_cache_lock:
+                    self.__metadata_cache.pop(key, None)
+                if attempt == 1:
+                    logging.error(f"Metadata of blob '{blob_name}' in container '{container_name}' was modified concurrently.")
+                    raise
+                cached = None
+                continue
+
+            self.__cache_metadata(key, result['etag'], merged_metadata)
+            logging.info(f"Metadata added successfully. Blob: {blob_name}, Container: {container_name}")
+            return True
+
+    def __cache_metadata(self, key: Tuple[str, str], etag: str, metadata: Dict[str, str]) -> None:
+        """
+        Blobのメタデータと対応するETagをキャッシュします。上限を超えた場合は最も古いものから破棄します。
+        """
+        with self.__metadata_cache_lock:
+            self.__metadata_cache[key] = (etag, dict(metadata))
+            self.__metadata_cache.move_to_end(key)
+            while len(self.__metadata_cache) > self.MAX_CACHED_METADATA:
+                self.__metadata_cache.popitem(last=False)
 
     def get_metadata(self, container_name: str, blob_name: str) -> Dict[str, str]:
         """
         指定されたコンテナとBlobのメタデータを取得します。
         この操作はリースを取得せずに行われます。
+        取得したメタデータはETagとともにキャッシュされ、add_metadataで使用されます。
 
         Args:
             container_name (str): コンテナ名
@@ -216,8 +558,9 @@ class BlobManager:
             AzureError: メタデータの取得に失敗した場合
         """
         try:
-            blob_client = self.__container_manager.get_client(container_name, blob_name)
+            blob_client = self.__container_manager.get_client(container_name, blob_name, create_if_not_exists=False)
             properties = blob_client.get_blob_properties()
+            self.__cache_metadata((container_name, blob_name), properties.etag, properties.metadata or {})
             return properties.metadata
         except ResourceNotFoundError:
             logging.warning(f"Blob '{blob_name}' not found in container '{container_name}'")
@@ -265,21 +608,21 @@ class BlobManager:
         except ResourceNotFoundError:
             return False
 
-    def list_blobs(self, container_name: str) -> List[str]:
+    def list_blobs(self, container_name: str, name_starts_with: Optional[str] = None) -> List[str]:
         """
         指定されたコンテナ内のすべてのBlobをリストアップします。
         この操作はコンテナのリースを取得して行われます。
 
         Args:
             container_name (str): コンテナ名
-            container_client (ContainerClient, optional): コンテナクライアント
+            name_starts_with (Optional[str], optional): 指定した場合、この接頭辞で始まるBlobだけをリストアップします。
 
         Returns:
             List[str]: コンテナ内のBlobの名前のリスト
         """
         container_client = self.__container_manager.get_client(container_name, create_if_not_exists=False)
-        blobs = container_client.list_blobs()
-        return [blob.name for blob in blobs]
+        # 名前だけを取得し、Blobごとのプロパティの転送と解析を省く
+        return list(container_client.list_blob_names(name_starts_with=name_starts_with, results_per_page=5000))
     
     @property
     def container_manager(self):
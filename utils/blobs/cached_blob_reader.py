@@ -0,0 +1,296 @@
+import asyncio
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from ..compression import compress, decompress
+from .async_blob_manager import AsyncBlobManager
+from .blob_manager import BlobManager
+
+class CachedBlobReader:
+    """
+    書き込み後に変更されないBlob（チャンクのJSONなど）の読み込みをキャッシュするクラス。
+
+    直近に読み込んだBlobはメモリ上のLRUに保持し、cache_dirを指定した場合はローカルディスクにもキーごとのファイルとして
+    zstdで圧縮して保存します。キーはコンテナ名とBlob名のSHA-256ハッシュ値です。
+    ファイルは一時ファイルに書き込んでから置き換えるため、同じcache_dirを複数のプロセスで共有できます。
+    ディスクキャッシュの合計サイズがmax_disk_bytesを超えた場合は、最後に使用した日時が古いファイルから削除します。
+    ディスクキャッシュの読み書きに失敗した場合は、キャッシュに存在しないものとして扱います。
+    Blobの内容が変わらないことを前提とするため、上書きされるBlob（マッピングファイルなど）には使用しないでください。
+    マッピングファイルはETagによる条件付きの読み込みで転送を省略しています。
+
+    Attributes:
+        __blob_manager (BlobManager): Blobストレージを操作するためのインスタンス
+        __max_memory_items (int): メモリ上に保持するBlobの最大数
+        __cache_path (Optional[str]): ディスクキャッシュのファイルを保存するディレクトリのパス
+        __max_disk_bytes (int): ディスクキャッシュの最大サイズ（バイト）
+
+    使用例:
+        reader = CachedBlobReader(blob_manager, cache_dir="/tmp/blob-cache")
+        contents = reader.read_many("db-container", ["chunks/chunk_0.json", "chunks/chunk_1.json"])
+
+        # イベントループ上では、キャッシュにないBlobをAsyncBlobManagerで並行に読み込む
+        contents = await reader.aread_many("db-container", ["chunks/chunk_0.json"], async_blob_manager)
+    """
+
+    def __init__(self, blob_manager: BlobManager, cache_dir: Optional[str] = None, max_memory_items: int = 4096,
+                 max_disk_bytes: int = 1024 * 1024 * 1024):
+        """
+        CachedBlobReaderのインスタンスを初期化します。
+
+        Args:
+            blob_manager (BlobManager): Blobストレージを操作するためのインスタンス
+            cache_dir (Optional[str], optional): ディスクキャッシュを保存するディレクトリ。Noneの場合はメモリ上にのみ保持します。
+            max_memory_items (int, optional): メモリ上に保持するBlobの最大数。デフォルトは4096。
+            max_disk_bytes (int, optional): ディスクキャッシュの最大サイズ（バイト）。デフォルトは1GiB。
+        """
+        self.logger = logging.getLogger(__name__)
+        self.__blob_manager = blob_manager
+        self.__max_memory_items = max_memory_items
+        self.__memory: "OrderedDict[str, bytes]" = OrderedDict()
+        self.__lock = threading.Lock()
+        self.__cache_path = None
+        self.__max_disk_bytes = max_disk_bytes
+        self.__written_bytes = 0  # 前回の削除処理以降にディスクキャッシュに書き込んだバイト数
+        if cache_dir:
+            self.__cache_path = os.path.join(cache_dir, "objects")
+            os.makedirs(self.__cache_path, exist_ok=True)
+            self.__remove_legacy_files(cache_dir)
+            self.__evict()
+
+    @staticmethod
+    def __make_key(container_name: str, blob_name: str) -> str:
+        return hashlib.sha256(f"{container_name}\n{blob_name}".encode("utf-8")).hexdigest()
+
+    def __key_path(self, key: str) -> str:
+        """キーに対応するディスクキャッシュのファイルのパスを返す（1つのディレクトリにファイルが集中しないよう先頭2文字で分ける）"""
+        return os.path.join(self.__cache_path, key[:2], key)
+
+    @staticmethod
+    def __remove_legacy_files(cache_dir: str) -> None:
+        """以前のdbm形式のディスクキャッシュ（"blobs"で始まるファイル）を削除する"""
+        try:
+            for entry in os.scandir(cache_dir):
+                if entry.name.startswith("blobs") and entry.is_file():
+                    os.remove(entry.path)
+        except OSError as e:
+            logging.warning(f"Failed to remove the legacy disk cache in {cache_dir}: {e}")
+
+    def read(self, container_name: str, blob_name: str) -> bytes:
+        """
+        Blobのデータを読み込みます。キャッシュに存在する場合は通信を行いません。
+
+        Args:
+            container_name (str): コンテナ名
+            blob_name (str): Blob名
+
+        Returns:
+            bytes: 読み込んだデータ
+        """
+        return self.read_many(container_name, [blob_name])[blob_name]
+
+    def read_many(self, container_name: str, blob_names: List[str],
+                  fetch_many: Optional[Callable[[List[str]], Dict[str, bytes]]] = None) -> Dict[str, bytes]:
+        """
+        複数のBlobのデータを読み込みます。キャッシュに存在しないBlobだけをまとめて並列に読み込みます。
+
+        Args:
+            container_name (str): コンテナ名
+            blob_names (List[str]): 読み込むBlob名のリスト
+            fetch_many (Optional[Callable[[List[str]], Dict[str, bytes]]], optional): キャッシュにないデータを読み込む関数。
+                Blob全体ではなくBlobの一部の範囲などをキャッシュする場合に、blob_namesに任意のキーを渡して使用します。
+                省略した場合はBlobManager.read_manyでBlobを読み込みます。
+
+        Returns:
+            Dict[str, bytes]: Blob名と読み込んだデータのディクショナリ
+
+        Raises:
+            ResourceNotFoundError: いずれかのBlobが存在しない場合
+        """
+        keys, found = self.__lookup(container_name, blob_names)
+        missing = [blob_name for blob_name in keys if blob_name not in found]
+        if missing:
+            if fetch_many is not None:
+                downloaded = fetch_many(missing)
+            else:
+                downloaded = self.__blob_manager.read_many(container_name, missing)
+            self.__store(keys, downloaded)
+            found.update(downloaded)
+
+        self.logger.debug(f"Read {len(keys)} blobs from '{container_name}' ({len(missing)} downloaded)")
+        return found
+
+    async def aread_many(self, container_name: str, blob_names: List[str],
+                         async_blob_manager: Optional[AsyncBlobManager] = None,
+                         fetch_many: Optional[Callable[[List[str]], Awaitable[Dict[str, bytes]]]] = None) -> Dict[str, bytes]:
+        """
+        read_manyの非同期版です。キャッシュにないBlobだけを、async_blob_managerを指定した場合はasyncio.gatherで、
+        指定しない場合はBlobManager.read_manyをスレッドで実行して読み込みます。
+
+        Args:
+            container_name (str): コンテナ名
+            blob_names (List[str]): 読み込むBlob名のリスト
+            async_blob_manager (Optional[AsyncBlobManager], optional): 読み込みに使用するオープン済みのAsyncBlobManager
+            fetch_many (Optional[Callable[[List[str]], Awaitable[Dict[str, bytes]]]], optional): キャッシュにないデータを読み込むコルーチン関数。
+                指定した場合はasync_blob_managerより優先します。
+
+        Returns:
+            Dict[str, bytes]: Blob名と読み込んだデータのディクショナリ
+
+        Raises:
+            ResourceNotFoundError: いずれかのBlobが存在しない場合
+        """
+        keys, found = self.__lookup(container_name, blob_names)
+        missing = [blob_name for blob_name in keys if blob_name not in found]
+        if missing:
+            if fetch_many is not None:
+                downloaded = await fetch_many(missing)
+            elif async_blob_manager is not None:
+                downloaded = await async_blob_manager.read_many(container_name, missing)
+            else:
+                downloaded = await asyncio.to_thread(self.__blob_manager.read_many, container_name, missing)
+            self.__store(keys, downloaded)
+            found.update(downloaded)
+
+        self.logger.debug(f"Read {len(keys)} blobs from '{container_name}' ({len(missing)} downloaded)")
+        return found
+
+    def __lookup(self, container_name: str, blob_names: List[str]) -> Tuple[Dict[str, str], Dict[str, bytes]]:
+        """Blob名とキャッシュのキーの対応と、キャッシュに存在したBlobのデータを返す"""
+        keys = {blob_name: self.__make_key(container_name, blob_name) for blob_name in blob_names}
+        found: Dict[str, bytes] = {}
+        with self.__lock:
+            for blob_name, key in keys.items():
+                data = self.__memory.get(key)
+                if data is not None:
+                    self.__memory.move_to_end(key)
+                    found[blob_name] = data
+
+        if self.__cache_path:
+            for blob_name in [blob_name for blob_name in keys if blob_name not in found]:
+                data = self.__read_disk(keys[blob_name])
+                if data is not None:
+                    found[blob_name] = data
+                    with self.__lock:
+                        self.__remember(keys[blob_name], data)
+        return keys, found
+
+    def __read_disk(self, key: str) -> Optional[bytes]:
+        """ディスクキャッシュからデータを読み込む。存在しない場合や読み込みに失敗した場合はNoneを返す"""
+        path = self.__key_path(key)
+        try:
+            with open(path, "rb") as f:
+                data = decompress(f.read())
+            # 最後に使用した日時を更新し、削除の対象になりにくくする
+            os.utime(path)
+            return data
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            self.logger.warning(f"Failed to read the disk cache {path}: {e}")
+            return None
+
+    def __write_disk(self, key: str, data: bytes) -> int:
+        """ディスクキャッシュにデータを書き込み、書き込んだバイト数を返す（失敗した場合は0）"""
+        path = self.__key_path(key)
+        temp_path = None
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            compressed = compress(data)
+            fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+            with os.fdopen(fd, "wb") as f:
+                f.write(compressed)
+            # 他のプロセスが読み込み中でも、書き込み途中のファイルが読まれることはない
+            os.replace(temp_path, path)
+            return len(compressed)
+        except OSError as e:
+            self.logger.warning(f"Failed to write the disk cache {path}: {e}")
+            if temp_path is not None:
+                try:
+                    os.remove(temp_path)
+                except OSError:
+                    pass
+            return 0
+
+    def __evict(self) -> None:
+        """ディスクキャッシュの合計サイズがmax_disk_bytesを超えている場合は、最後に使用した日時が古いファイルから削除する"""
+        files: List[Tuple[float, int, str]] = []
+        try:
+            for directory in os.scandir(self.__cache_path):
+                if not directory.is_dir():
+                    continue
+                for entry in os.scandir(directory.path):
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    files.append((stat.st_mtime, stat.st_size, entry.path))
+        except OSError as e:
+            self.logger.warning(f"Failed to scan the disk cache {self.__cache_path}: {e}")
+            return
+
+        total = sum(size for _, size, _ in files)
+        if total <= self.__max_disk_bytes:
+            return
+        # 上限の9割まで削除し、削除処理が頻繁に行われないようにする
+        target = self.__max_disk_bytes * 9 // 10
+        files.sort()
+        removed = 0
+        for _, size, path in files:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        self.logger.info(f"Evicted {removed} files from the disk cache {self.__cache_path}")
+
+    def __store(self, keys: Dict[str, str], downloaded: Dict[str, bytes]) -> None:
+        """読み込んだBlobのデータをメモリ上のLRUとディスクキャッシュに保存する"""
+        with self.__lock:
+            for blob_name, data in downloaded.items():
+                self.__remember(keys[blob_name], data)
+        if not self.__cache_path:
+            return
+
+        written = sum(self.__write_disk(keys[blob_name], data) for blob_name, data in downloaded.items())
+        with self.__lock:
+            self.__written_bytes += written
+            # 他のプロセスも書き込むため、上限の1割を書き込むごとにディレクトリ全体のサイズを確認する
+            evict = self.__written_bytes >= self.__max_disk_bytes // 10
+            if evict:
+                self.__written_bytes = 0
+        if evict:
+            self.__evict()
+
+    def invalidate(self, container_name: str, blob_name: str) -> None:
+        """
+        Blobのキャッシュを削除します。Blobを削除または上書きした場合に呼び出してください。
+
+        Args:
+            container_name (str): コンテナ名
+            blob_name (str): Blob名
+        """
+        key = self.__make_key(container_name, blob_name)
+        with self.__lock:
+            self.__memory.pop(key, None)
+        if self.__cache_path:
+            try:
+                os.remove(self.__key_path(key))
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                self.logger.warning(f"Failed to remove the disk cache {self.__key_path(key)}: {e}")
+
+    def __remember(self, key: str, data: bytes) -> None:
+        """メモリ上のLRUにデータを保持する（ロックを取得した状態で呼び出す）"""
+        self.__memory[key] = data
+        self.__memory.move_to_end(key)
+        while len(self.__memory) > self.__max_memory_items:
+            self.__memory.popitem(last=False)
\ No newline at end of file
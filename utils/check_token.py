@@ -1,6 +1,36 @@
+import os
 import tiktoken
+from functools import lru_cache
+from typing import List
 
+@lru_cache(maxsize=None)
+def get_encoding() -> tiktoken.Encoding:
+    """
+    GPT-4oのトークナイザーを取得します。
+    初期化のコストが大きいため、インスタンスは初回呼び出し時に1度だけ作成します。
+
+    Returns:
+        tiktoken.Encoding: GPT-4oのトークナイザー
+    """
+    return tiktoken.encoding_for_model("gpt-4o")
+
+# 検索結果の同じチャンクが繰り返しトークン数を数えられるため、結果をキャッシュする
+@lru_cache(maxsize=8192)
 def check_token(text: str) -> int:
-    encoding = tiktoken.get_encoding("cl100k_base")
-    token_integers = encoding.encode(text)
-    return len(token_integers)
\ No newline at end of file
+    token_integers = get_encoding().encode(text)
+    return len(token_integers)
+
+def check_tokens(texts: List[str]) -> List[int]:
+    """
+    複数のテキストのトークン数をまとめて数えます。
+    tiktokenのスレッドプールで並列にトークン化するため、1件ずつcheck_tokenを呼び出すより高速です。
+    文書のテキストに "<|endoftext|>" などの特殊トークンの文字列が含まれていてもエラーにならないよう、通常のテキストとしてトークン化します。
+
+    Args:
+        texts (List[str]): トークン数を数えるテキストのリスト
+
+    Returns:
+        List[int]: 各テキストのトークン数
+    """
+    token_integers_list = get_encoding().encode_ordinary_batch(texts, num_threads=os.cpu_count() or 1)
+    return [len(token_integers) for token_integers in token_integers_list]
@@ -0,0 +1,263 @@
+import asyncio
+import logging
+import struct
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import orjson
+from azure.core.exceptions import HttpResponseError
+
+from .blobs.async_blob_manager import AsyncBlobManager
+from .blobs.blob_manager import AppendBlobSealedError, BlobManager
+from .blobs.cached_blob_reader import CachedBlobReader
+
+# チャンクのレコードの位置（パックの世代, レコードのオフセット, レコードの長さ）。マッピングにはJSONのリストとして保存する
+ChunkLocation = List[int]
+
+class ChunkStore:
+    """
+    チャンクを、チャンクごとのBlobではなくAppend Blob（パック）にまとめて保存するクラス。
+
+    各レコードは4バイト（ビッグエンディアン）の長さとencode_chunkで作成したバイト列からなり、1ドキュメント分のレコードを1回の追記で保存します。
+    バイト列はバージョン、ページ番号、作成日時の固定長のヘッダーとUTF-8のテキストからなり、検索時にJSONを解析せずにテキストを取り出せます。
+    レコードの位置（ChunkLocation）はChunkBlobMappingのBlob情報に "chunk" として保存し、読み込みはその範囲だけを指定して行います。
+    パックが PACK_MAX_BYTES を超えた場合はパックをシールし、他のプロセスの追記もシールされたことによるエラーで次の世代に進めます。
+    ブロック数の上限に達した場合も、次の世代のパックに追記します。
+    追記先の世代は、最初の追記の前に既存のパックの一覧から最新の世代を求めます（プロセスの起動ごとに世代0から辿らない）。
+    削除したチャンクのレコードはパックに残りますが、位置がマッピングから削除されるため読み込まれることはありません。
+    位置を持たない以前のチャンクは、従来通り "<prefix>chunk_<チャンクID>.json" のBlobから読み込みます。
+
+    Attributes:
+        __blob_manager (BlobManager): Blobストレージを操作するためのインスタンス
+        __container_name (str): チャンクを保存するコンテナ名
+        __prefix (str): チャンクを保存するBlob名の接頭辞
+        __generation (Optional[int]): 追記先のパックの世代（最初の追記の前はNone）
+
+    使用例:
+        store = ChunkStore(blob_manager, "db-container")
+        locations = store.append([ChunkStore.encode_chunk("こんにちは", 1, datetime.now())])
+        contents = store.read_many([("0", locations[0]), ("1", None)])  # 位置がないチャンクは個別のBlobから読み込む
+        text, page_number = ChunkStore.decode_chunk(contents["0"])
+    """
+
+    # パックがこのサイズを超えたら、次の世代のパックに追記する
+    PACK_MAX_BYTES = 1024 * 1024 * 1024
+    # 1回の追記（Append Block）で送るデータの最大サイズ
+    MAX_BLOCK_BYTES = 4 * 1024 * 1024
+
+    __HEADER = struct.Struct(">I")
+    # レコードのヘッダー（バージョン, ページ番号（ない場合は-1）, 作成日時のUNIX時間（ミリ秒））
+    __RECORD_VERSION = 1
+    __RECORD_HEADER = struct.Struct(">Biq")
+
+    def __init__(self, blob_manager: BlobManager, container_name: str, prefix: str = "chunks/",
+                 cache_dir: Optional[str] = None, max_workers: int = 16):
+        """
+        ChunkStoreのインスタンスを初期化します。
+
+        Args:
+            blob_manager (BlobManager): Blobストレージを操作するためのインスタンス
+            container_name (str): チャンクを保存するコンテナ名
+            prefix (str, optional): チャンクを保存するBlob名の接頭辞。デフォルトは "chunks/"。
+            cache_dir (Optional[str], optional): 読み込んだチャンクをキャッシュするディレクトリ。Noneの場合はメモリ上にのみ保持します。
+            max_workers (int, optional): 並列に読み込む範囲の最大数。デフォルトは16。
+        """
+        self.logger = logging.getLogger(__name__)
+        self.__blob_manager = blob_manager
+        self.__container_name = container_name
+        self.__prefix = prefix
+        self.__max_workers = max_workers
+        self.__generation: Optional[int] = None
+        self.__lock = threading.Lock()
+        # パックのレコードは書き込み後に変更されないため、個別のBlobと同様にキャッシュできる
+        self.__reader = CachedBlobReader(blob_manager, cache_dir)
+
+    def pack_name(self, generation: int) -> str:
+        """指定された世代のパックのBlob名を返す"""
+        return f"{self.__prefix}pack.{generation}"
+
+    def legacy_blob_name(self, chunk_id: str) -> str:
+        """位置を持たない以前のチャンクのBlob名を返す"""
+        return f"{self.__prefix}chunk_{chunk_id}.json"
+
+    @classmethod
+    def encode_chunk(cls, text: str, page_number: Optional[int], created_at: datetime) -> bytes:
+        """
+        チャンクをパックに保存するレコードのバイト列に変換します。
+
+        Args:
+            text (str): チャンクのテキスト
+            page_number (Optional[int]): チャンクのページ番号
+            created_at (datetime): チャンクの作成日時
+
+        Returns:
+            bytes: レコードのバイト列
+        """
+        header = cls.__RECORD_HEADER.pack(cls.__RECORD_VERSION, -1 if page_number is None else page_number,
+                                          int(created_at.timestamp() * 1000))
+        return header + text.encode('utf-8')
+
+    @classmethod
+    def decode_chunk(cls, data: bytes) -> Tuple[str, Optional[int]]:
+        """
+        レコードのバイト列からチャンクのテキストとページ番号を取り出します。
+        以前のJSON形式のチャンクは、JSONを解析して取り出します。
+
+        Args:
+            data (bytes): レコードまたはJSONのバイト列
+
+        Returns:
+            Tuple[str, Optional[int]]: チャンクのテキストとページ番号
+        """
+        if data[:1] == bytes((cls.__RECORD_VERSION,)):
+            _, page_number, _ = cls.__RECORD_HEADER.unpack_from(data)
+            # テキスト部分はコピーせずにデコードする
+            return str(memoryview(data)[cls.__RECORD_HEADER.size:], 'utf-8'), (None if page_number < 0 else page_number)
+        chunk_data = orjson.loads(data)
+        return chunk_data.get('text', ''), chunk_data.get('page_number')
+
+    def append(self, records: List[bytes]) -> List[ChunkLocation]:
+        """
+        チャンクのレコードをパックに追記します。レコードは MAX_BLOCK_BYTES ごとにまとめて1回の追記で保存します。
+
+        Args:
+            records (List[bytes]): encode_chunkで作成したレコードのバイト列のリスト
+
+        Returns:
+            List[ChunkLocation]: 各レコードの位置のリスト（recordsと同じ順序）
+
+        Raises:
+            ValueError: 1つのレコードが MAX_BLOCK_BYTES を超える場合
+        """
+        locations: List[ChunkLocation] = []
+        for block, entries in self.__split_blocks(records):
+            generation, start = self.__append_block(bytes(block))
+            locations.extend([generation, start + offset, length] for offset, length in entries)
+        self.logger.debug(f"Appended {len(records)} chunks to {self.__prefix}pack")
+        return locations
+
+    def __split_blocks(self, records: List[bytes]) -> List[Tuple[bytearray, List[Tuple[int, int]]]]:
+        """レコードを、長さを先頭に付けて MAX_BLOCK_BYTES 以下のブロックに分ける（各ブロック内のレコードのオフセットと長さも返す）"""
+        blocks: List[Tuple[bytearray, List[Tuple[int, int]]]] = []
+        block, entries = bytearray(), []
+        for record in records:
+            size = self.__HEADER.size + len(record)
+            if size > self.MAX_BLOCK_BYTES:
+                raise ValueError(f"Chunk record of {len(record)} bytes exceeds the maximum block size of {self.MAX_BLOCK_BYTES} bytes")
+            if len(block) + size > self.MAX_BLOCK_BYTES:
+                blocks.append((block, entries))
+                block, entries = bytearray(), []
+            block += self.__HEADER.pack(len(record))
+            entries.append((len(block), len(record)))
+            block += record
+        if entries:
+            blocks.append((block, entries))
+        return blocks
+
+    def __find_latest_generation(self) -> int:
+        """既存のパックのうち最新の世代を返す（パックがない場合は0）"""
+        pack_prefix = self.pack_name("")
+        names = self.__blob_manager.list_blobs(self.__container_name, name_starts_with=pack_prefix)
+        generations = [int(name[len(pack_prefix):]) for name in names if name[len(pack_prefix):].isdigit()]
+        return max(generations, default=0)
+
+    def __seal_pack(self, generation: int) -> None:
+        """PACK_MAX_BYTES を超えたパックをシールし、他のプロセスが追記しないようにする（失敗した場合はログに出力して続行する）"""
+        try:
+            self.__blob_manager.seal(self.__container_name, self.pack_name(generation))
+            self.logger.info(f"Sealed {self.pack_name(generation)}.")
+        except HttpResponseError as e:
+            self.logger.warning(f"Failed to seal {self.pack_name(generation)}: {str(e)}")
+
+    def __append_block(self, data: bytes) -> Tuple[int, int]:
+        """ブロックをパックに追記し、追記したパックの世代とブロックの開始位置を返す"""
+        with self.__lock:
+            if self.__generation is None:
+                self.__generation = self.__find_latest_generation()
+            generation = self.__generation
+        while True:
+            try:
+                end = self.__blob_manager.append(self.__container_name, self.pack_name(generation), data)
+                break
+            except HttpResponseError as e:
+                if not isinstance(e, AppendBlobSealedError) and e.error_code != 'BlockCountExceedsLimit':
+                    raise
+                self.logger.info(f"{self.pack_name(generation)} is full. Appending to the next pack.")
+                generation += 1
+        if end >= self.PACK_MAX_BYTES:
+            self.__seal_pack(generation)
+        with self.__lock:
+            # 他のスレッドが先に次の世代に進めていた場合は戻さない
+            next_generation = generation + 1 if end >= self.PACK_MAX_BYTES else generation
+            self.__generation = max(self.__generation, next_generation)
+        return generation, end - len(data)
+
+    def __resolve(self, chunks: Sequence[Tuple[str, Optional[ChunkLocation]]]) -> Tuple[Dict[str, str], Dict[str, Tuple[str, int, Optional[int]]]]:
+        """チャンクIDごとのキャッシュのキーと、キーごとの読み込み範囲（Blob名, オフセット, 長さ）を返す"""
+        keys: Dict[str, str] = {}
+        ranges: Dict[str, Tuple[str, int, Optional[int]]] = {}
+        for chunk_id, location in chunks:
+            if location:
+                generation, offset, length = location
+                key = f"{self.pack_name(generation)}@{offset}+{length}"
+                ranges[key] = (self.pack_name(generation), offset, length)
+            else:
+                key = self.legacy_blob_name(chunk_id)
+                ranges[key] = (key, 0, None)
+            keys[chunk_id] = key
+        return keys, ranges
+
+    def __read_range(self, blob_name: str, offset: int, length: Optional[int]) -> bytes:
+        if length is None:
+            return self.__blob_manager.read(self.__container_name, blob_name)
+        return self.__blob_manager.read_from(self.__container_name, blob_name, offset, length)
+
+    def read_many(self, chunks: Sequence[Tuple[str, Optional[ChunkLocation]]]) -> Dict[str, bytes]:
+        """
+        複数のチャンクのレコードを読み込みます。キャッシュにないチャンクだけを、レコードの範囲を指定して並列に読み込みます。
+
+        Args:
+            chunks (Sequence[Tuple[str, Optional[ChunkLocation]]]): チャンクIDと位置のタプルのリスト。位置がNoneの場合は個別のBlobから読み込みます。
+
+        Returns:
+            Dict[str, bytes]: チャンクIDとレコード（以前のチャンクはJSON）のバイト列のディクショナリ。decode_chunkで取り出します。
+
+        Raises:
+            ResourceNotFoundError: 位置がないチャンクのBlobが存在しない場合
+        """
+        keys, ranges = self.__resolve(chunks)
+
+        def fetch_many(missing: List[str]) -> Dict[str, bytes]:
+            if len(missing) == 1:
+                return {missing[0]: self.__read_range(*ranges[missing[0]])}
+            with ThreadPoolExecutor(max_workers=min(self.__max_workers, len(missing))) as executor:
+                return dict(zip(missing, executor.map(lambda key: self.__read_range(*ranges[key]), missing)))
+
+        contents = self.__reader.read_many(self.__container_name, list(dict.fromkeys(keys.values())), fetch_many)
+        return {chunk_id: contents[key] for chunk_id, key in keys.items()}
+
+    async def aread_many(self, chunks: Sequence[Tuple[str, Optional[ChunkLocation]]],
+                         async_blob_manager: Optional[AsyncBlobManager] = None) -> Dict[str, bytes]:
+        """
+        read_manyの非同期版です。async_blob_managerを指定した場合は、キャッシュにないチャンクをasyncio.gatherで並行に読み込みます。
+
+        Args:
+            chunks (Sequence[Tuple[str, Optional[ChunkLocation]]]): チャンクIDと位置のタプルのリスト
+            async_blob_manager (Optional[AsyncBlobManager], optional): 読み込みに使用するオープン済みのAsyncBlobManager
+
+        Returns:
+            Dict[str, bytes]: チャンクIDとレコード（以前のチャンクはJSON）のバイト列のディクショナリ
+        """
+        keys, ranges = self.__resolve(chunks)
+
+        async def fetch_many(missing: List[str]) -> Dict[str, bytes]:
+            if async_blob_manager is None:
+                contents = await asyncio.gather(*(asyncio.to_thread(self.__read_range, *ranges[key]) for key in missing))
+            else:
+                contents = await asyncio.gather(*(async_blob_manager.read_from(self.__container_name, *ranges[key]) for key in missing))
+            return dict(zip(missing, contents))
+
+        contents = await self.__reader.aread_many(self.__container_name, list(dict.fromkeys(keys.values())), fetch_many=fetch_many)
+        return {chunk_id: contents[key] for chunk_id, key in keys.items()}
@@ -0,0 +1,67 @@
+import shutil
+from typing import BinaryIO
+
+import zstandard
+
+# zstdフレームの先頭に付くマジックナンバー
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+def compress(data: bytes, level: int = 3) -> bytes:
+    """
+    データをzstdで圧縮します。
+    圧縮後のデータには元のサイズが記録されるため、decompressで1度に展開できます。
+
+    Args:
+        data (bytes): 圧縮するデータ
+        level (int, optional): 圧縮レベル。デフォルトは3（速度を優先する）。
+
+    Returns:
+        bytes: zstdで圧縮したデータ
+    """
+    # ZstdCompressorはスレッドセーフではないため、呼び出しごとに作成する
+    return zstandard.ZstdCompressor(level=level).compress(data)
+
+def is_compressed(data: bytes) -> bool:
+    """
+    データがzstdで圧縮されているかどうかを判定します。
+
+    Args:
+        data (bytes): 判定するデータ
+
+    Returns:
+        bool: zstdで圧縮されている場合はTrue
+    """
+    return bytes(data[:len(ZSTD_MAGIC)]) == ZSTD_MAGIC
+
+def decompress(data: bytes) -> bytes:
+    """
+    zstdで圧縮されたデータを展開します。
+    圧縮されていないデータはそのまま返すため、圧縮前に保存されたデータも同じ方法で読み込めます。
+
+    Args:
+        data (bytes): 展開するデータ
+
+    Returns:
+        bytes: 展開したデータ
+    """
+    if not is_compressed(data):
+        return data
+    return zstandard.ZstdDecompressor().decompress(data)
+
+def decompress_stream(source: BinaryIO, destination: BinaryIO) -> None:
+    """
+    ストリームのデータを展開しながら別のストリームに書き込みます。
+    データ全体をメモリに保持しないため、大きなファイルの展開に使用します。
+    圧縮されていないデータはそのまま書き込みます。
+
+    Args:
+        source (BinaryIO): 読み込むストリーム（現在の位置から読み込みます。シーク可能である必要があります）
+        destination (BinaryIO): 書き込み先のストリーム
+    """
+    start = source.tell()
+    header = source.read(len(ZSTD_MAGIC))
+    source.seek(start)
+    if header == ZSTD_MAGIC:
+        zstandard.ZstdDecompressor().copy_stream(source, destination)
+    else:
+        shutil.copyfileobj(source, destination)
\ No newline at end of file
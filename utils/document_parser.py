@@ -1,6 +1,9 @@
 import logging
-from functools import partial
-from typing import List, Dict, Any
+import os
+import threading
+from functools import lru_cache, partial
+from types import MappingProxyType
+from typing import List, Dict, Any, Mapping
 
 from Parser import (
     TextParser,
@@ -12,6 +15,51 @@ from Parser import (
     MailParser,
     PowerpointParser
 )
+from utils.check_token import get_encoding
+
+@lru_cache(maxsize=8)
+def _build_parser_dict(api_endpoint: str, api_key: str) -> Mapping[str, Any]:
+    """
+    ファイル拡張子とパーサーのマッピングを作成する。
+    同じAPIエンドポイントとキーの組み合わせでは作成済みのマッピングを共有するため、
+    変更できないようにMappingProxyTypeで返す。
+
+    Args:
+        api_endpoint (str): 外部APIのエンドポイントURL。
+        api_key (str): 外部APIの認証キー。
+
+    Returns:
+        Mapping[str, Any]: ファイル拡張子とパーサーのマッピング（読み取り専用）。
+    """
+    # 各ファイル拡張子に対応するパーサーを定義
+    extensions = {
+        "image": ["png", "jpg", "jpeg"],
+        "excel": ["xls", "xlsx"],
+        "word": ["doc", "docx"],
+        "powerpoint": ["ppt", "pptx"]
+    }
+    
+    # 各ファイルタイプに対応するパーサークラスを定義
+    parsers = {
+        "image": partial(IMGParser.IMGChunkParser, api_endpoint=api_endpoint, api_key=api_key),
+        "excel": ExcelParser.ExcelChunkParser,
+        "word": WordParser.DocxChunkParser,
+        "powerpoint": PowerpointParser.PPTXChunkParser
+    }
+    
+    # 基本的なファイルタイプのパーサーを定義
+    parser_dict = {
+        "txt": TextParser.TextChunkParser,
+        "csv": CSVParser.CSVChunkParser,
+        "pdf": partial(PDFParser.PDFChunkParser, api_endpoint=api_endpoint, api_key=api_key),
+        "msg": MailParser.MSGChunkParser,
+    }
+
+    # 拡張子とパーサーを関連付ける
+    for parser_type, exts in extensions.items():
+        parser_dict.update({ext: parsers[parser_type] for ext in exts})
+
+    return MappingProxyType(parser_dict)
 
 class DocumentParser:
     """
@@ -23,7 +71,8 @@ class DocumentParser:
 
     Attributes:
         logger (logging.Logger): ロギング用のロガーオブジェクト。
-        __parser_dict (dict): ファイル拡張子とそれに対応するパーサーのマッピング。
+        __parser_dict (Mapping): ファイル拡張子とそれに対応するパーサーのマッピング（読み取り専用）。
+        __parser_instances (dict): 作成済みのパーサーのインスタンス。パーサーごとに初回使用時に1度だけ作成する。
 
     使用方法:
         api_endpoint = "https://your-api-endpoint.com"
@@ -39,6 +88,9 @@ class DocumentParser:
 
         # 全テキストを取得
         full_text = parser.parse_full_text(content, "pdf")
+
+        # ページごとのトークン数を取得
+        page_tokens = parser.count_tokens_by_page(content, "pdf")
     """
 
     def __init__(self, api_endpoint: str, api_key: str):
@@ -50,49 +102,10 @@ class DocumentParser:
             api_key (str): 外部APIの認証キー。
         """
         self.logger = logging.getLogger(__name__)
-        self.__parser_dict = self.__create_parser_dict(api_endpoint, api_key)
+        self.__parser_dict = _build_parser_dict(api_endpoint, api_key)
+        self.__parser_instances: Dict[Any, Any] = {}
+        self.__parser_instances_lock = threading.Lock()
 
-    def __create_parser_dict(self, api_endpoint: str, api_key: str) -> Dict[str, Any]:
-        """
-        ファイル拡張子とパーサーのマッピングを作成する。
-
-        Args:
-            api_endpoint (str): 外部APIのエンドポイントURL。
-            api_key (str): 外部APIの認証キー。
-
-        Returns:
-            Dict[str, Any]: ファイル拡張子とパーサーのマッピング。
-        """
-        # 各ファイル拡張子に対応するパーサーを定義
-        extensions = {
-            "image": ["png", "jpg", "jpeg"],
-            "excel": ["xls", "xlsx"],
-            "word": ["doc", "docx"],
-            "powerpoint": ["ppt", "pptx"]
-        }
-        
-        # 各ファイルタイプに対応するパーサークラスを定義
-        parsers = {
-            "image": partial(IMGParser.IMGChunkParser, api_endpoint=api_endpoint, api_key=api_key),
-            "excel": ExcelParser.ExcelChunkParser,
-            "word": WordParser.DocxChunkParser,
-            "powerpoint": PowerpointParser.PPTXChunkParser
-        }
-        
-        # 基本的なファイルタイプのパーサーを定義
-        parser_dict = {
-            "txt": TextParser.TextChunkParser,
-            "csv": CSVParser.CSVChunkParser,
-            "pdf": partial(PDFParser.PDFChunkParser, api_endpoint=api_endpoint, api_key=api_key),
-            "msg": MailParser.MSGChunkParser,
-        }
-
-        # 拡張子とパーサーを関連付ける
-        for parser_type, exts in extensions.items():
-            parser_dict.update({ext: parsers[parser_type] for ext in exts})
-
-        return parser_dict
-    
     def parse_by_page(self, content: bytes, ext: str) -> List[Dict[str, Any]]:
         """
         ドキュメントをページごとに解析する。
@@ -109,13 +122,34 @@ class DocumentParser:
             ValueError: サポートされていないファイル拡張子が指定された場合。
         """
         # 指定された拡張子に対応するパーサーを使用してコンテンツを解析
-        parser = self.__parser_dict.get(ext)
-        if parser is None:
+        parser_factory = self.__parser_dict.get(ext)
+        if parser_factory is None:
             self.logger.error(f"Unsupported file extension: {ext}")
             raise ValueError(f"Unsupported file extension: {ext}")
         
-        parsed_content = parser().parse(content)
+        parsed_content = self.__get_parser(parser_factory).parse(content)
         return parsed_content
+
+    def __get_parser(self, parser_factory: Any) -> Any:
+        """
+        パーサーのインスタンスを取得する。
+        APIクライアントなどの初期化を解析のたびに行わないよう、インスタンスは初回使用時に作成して再利用する。
+        同じパーサーを使う拡張子（xlsとxlsxなど）は同じインスタンスを共有する。
+
+        Args:
+            parser_factory (Any): パーサーのクラスまたはfunctools.partial。
+
+        Returns:
+            Any: パーサーのインスタンス。
+        """
+        parser = self.__parser_instances.get(parser_factory)
+        if parser is None:
+            with self.__parser_instances_lock:
+                parser = self.__parser_instances.get(parser_factory)
+                if parser is None:
+                    parser = parser_factory()
+                    self.__parser_instances[parser_factory] = parser
+        return parser
         
     def parse_full_text(self, content: bytes, ext: str) -> str:
         """
@@ -131,9 +165,25 @@ class DocumentParser:
         Raises:
             ValueError: サポートされていないファイル拡張子が指定された場合。
         """
-        # ページごとに解析されたコンテンツから全テキストを抽出
-        page_with_chunks = self.parse_by_page(content, ext)
-        all_chunks = []
-        for page in page_with_chunks:
-            all_chunks.extend(page['texts'])
-        return ''.join(all_chunks)
\ No newline at end of file
+        # ページごとに解析されたコンテンツから全テキストを抽出（中間リストを作らずに連結する）
+        return ''.join(chunk for page in self.parse_by_page(content, ext) for chunk in page['texts'])
+
+    def count_tokens_by_page(self, content: bytes, ext: str) -> List[int]:
+        """
+        ドキュメントをページごとに解析し、各ページのトークン数を数える。
+        全ページを1回の呼び出しでまとめてトークン化するため、ページごとにcheck_tokenを呼び出すより高速です。
+
+        Args:
+            content (bytes): 解析するドキュメントのバイナリデータ。
+            ext (str): ドキュメントのファイル拡張子。
+
+        Returns:
+            List[int]: ページごとのトークン数。parse_by_pageの結果と同じ順序。
+
+        Raises:
+            ValueError: サポートされていないファイル拡張子が指定された場合。
+        """
+        page_texts = [''.join(page['texts']) for page in self.parse_by_page(content, ext)]
+        # 特殊トークンの判定は不要なため、encode_ordinary_batchでスレッドを使って並列にトークン化する
+        token_integers_list = get_encoding().encode_ordinary_batch(page_texts, num_threads=os.cpu_count() or 1)
+        return [len(token_integers) for token_integers in token_integers_list]
\ No newline at end of file
@@ -0,0 +1,141 @@
+import hashlib
+import logging
+import struct
+from typing import Dict, Iterable
+
+import numpy as np
+from azure.core.exceptions import ResourceNotFoundError
+
+from .blobs.blob_manager import BlobManager
+
+class EmbeddingCache:
+    """
+    埋め込みベクトルをドキュメント単位でBlobストレージにキャッシュするクラス。
+
+    テキストとモデル名のSHA-256ハッシュ値をキーとして、1つのドキュメントのチャンクの埋め込みベクトルを
+    1つのBlobにまとめてfloat32のバイト列で保存します。ドキュメントを再度インデックスする際に、
+    変更のないチャンクについてAzure OpenAIへのリクエストを省略するために使用します。
+    読み込みと書き込みはチャンクの数によらず、ドキュメントごとに1回です。
+
+    Blobの形式は、ヘッダー（ベクトル数, 次元数。それぞれ4バイトのビッグエンディアン）、
+    各キーのハッシュ値（32バイト）、各ベクトル（float32）の順です。
+
+    Attributes:
+        __blob_manager (BlobManager): Blobストレージを操作するためのインスタンス
+        __container_name (str): キャッシュを保存するコンテナ名
+        __prefix (str): キャッシュを保存するBlob名の接頭辞
+
+    使用例:
+        cache = EmbeddingCache(blob_manager, "db-container")
+        document_key = EmbeddingCache.make_document_key("doc-container", "report.pdf")
+        key = EmbeddingCache.make_key("text-embedding-3-large", "こんにちは")
+        cache.put_many(document_key, {key: np.zeros(3072, dtype=np.float32)})
+        embeddings = cache.get_many(document_key, [key])
+    """
+
+    __HEADER = struct.Struct(">II")
+    __KEY_BYTES = 32
+
+    def __init__(self, blob_manager: BlobManager, container_name: str, prefix: str = "embeddings/"):
+        """
+        EmbeddingCacheのインスタンスを初期化します。
+
+        Args:
+            blob_manager (BlobManager): Blobストレージを操作するためのインスタンス
+            container_name (str): キャッシュを保存するコンテナ名
+            prefix (str, optional): キャッシュを保存するBlob名の接頭辞。デフォルトは "embeddings/"。
+        """
+        self.logger = logging.getLogger(__name__)
+        self.__blob_manager = blob_manager
+        self.__container_name = container_name
+        self.__prefix = prefix
+
+    @staticmethod
+    def make_key(model: str, text: str) -> str:
+        """
+        モデル名とテキストからキャッシュのキーを作成します。
+
+        Args:
+            model (str): 埋め込みモデルのデプロイメント名
+            text (str): 埋め込むテキスト
+
+        Returns:
+            str: キャッシュのキー（SHA-256の16進数文字列）
+        """
+        return hashlib.sha256(f"{model}\n{text}".encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def make_document_key(container_name: str, blob_name: str) -> str:
+        """
+        ドキュメントのコンテナ名とBlob名から、ベクトルをまとめて保存するBlobのキーを作成します。
+
+        Args:
+            container_name (str): ドキュメントが格納されているコンテナ名
+            blob_name (str): ドキュメントのBlob名
+
+        Returns:
+            str: ドキュメントのキー（SHA-256の16進数文字列）
+        """
+        return hashlib.sha256(f"{container_name}\n{blob_name}".encode("utf-8")).hexdigest()
+
+    def get_many(self, document_key: str, keys: Iterable[str]) -> Dict[str, np.ndarray]:
+        """
+        ドキュメントのBlobを1回読み込み、指定されたキーの埋め込みベクトルを取得します。
+
+        Args:
+            document_key (str): make_document_keyで作成したドキュメントのキー
+            keys (Iterable[str]): 取得するキー
+
+        Returns:
+            Dict[str, np.ndarray]: キャッシュに存在したキーと埋め込みベクトルの辞書
+        """
+        try:
+            data = self.__blob_manager.read(self.__container_name, self.__blob_name(document_key), as_byte=True)
+            count, ndims = self.__HEADER.unpack_from(data)
+            offset = self.__HEADER.size + count * self.__KEY_BYTES
+            digests = [data[self.__HEADER.size + i * self.__KEY_BYTES:self.__HEADER.size + (i + 1) * self.__KEY_BYTES]
+                       for i in range(count)]
+            vectors = np.frombuffer(data, dtype=np.float32, count=count * ndims, offset=offset).reshape(count, ndims)
+        except ResourceNotFoundError:
+            return {}
+        except Exception as e:
+            self.logger.warning(f"Failed to read cached embeddings '{document_key}': {str(e)}")
+            return {}
+
+        rows = {digest.hex(): i for i, digest in enumerate(digests)}
+        return {key: vectors[rows[key]] for key in dict.fromkeys(keys) if key in rows}
+
+    def put_many(self, document_key: str, embeddings: Dict[str, np.ndarray]) -> None:
+        """
+        ドキュメントの埋め込みベクトルを1つのBlobにまとめて保存します（既存のBlobは上書きします）。
+        保存に失敗した場合はログに出力し、例外は送出しません。
+
+        Args:
+            document_key (str): make_document_keyで作成したドキュメントのキー
+            embeddings (Dict[str, np.ndarray]): ドキュメントの全てのチャンクのキーと埋め込みベクトルの辞書
+        """
+        if not embeddings:
+            return
+
+        try:
+            vectors = np.ascontiguousarray(np.stack(list(embeddings.values())), dtype=np.float32)
+            data = b"".join([self.__HEADER.pack(*vectors.shape), *map(bytes.fromhex, embeddings.keys()), vectors.tobytes()])
+            self.__blob_manager.upload(self.__container_name, self.__blob_name(document_key), data)
+        except Exception as e:
+            self.logger.warning(f"Failed to write cached embeddings '{document_key}': {str(e)}")
+
+    def delete(self, document_key: str) -> None:
+        """
+        ドキュメントのキャッシュを削除します。ドキュメントが削除された場合に呼び出してください。
+        削除に失敗した場合はログに出力し、例外は送出しません。
+
+        Args:
+            document_key (str): make_document_keyで作成したドキュメントのキー
+        """
+        try:
+            self.__blob_manager.delete(self.__container_name, self.__blob_name(document_key))
+        except Exception as e:
+            self.logger.warning(f"Failed to delete cached embeddings '{document_key}': {str(e)}")
+
+    def __blob_name(self, document_key: str) -> str:
+        return f"{self.__prefix}documents/{document_key}.bin"
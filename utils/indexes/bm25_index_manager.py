@@ -1,11 +1,321 @@
 import io
 import logging
+import multiprocessing
+import os
 import pickle
-from typing import Dict, List, Optional, Tuple, Union
-
+import tempfile
+from collections import Counter, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from itertools import chain
+from typing import BinaryIO, Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
 from janome.tokenizer import Tokenizer
 from rank_bm25 import BM25Okapi
 
+from ..compression import compress, decompress, decompress_stream
+
+@lru_cache(maxsize=1)
+def _get_tokenizer() -> Tokenizer:
+    """
+    プロセス内で共有するJanomeトークナイザーを取得します。
+    辞書の読み込みに時間がかかるため、初回呼び出し時に1度だけ作成します。
+
+    Returns:
+        Tokenizer: 分かち書きモードのJanomeトークナイザー
+    """
+    return Tokenizer(wakati=True)
+
+@lru_cache(maxsize=4096)
+def _tokenize(text: str) -> Tuple[str, ...]:
+    """
+    テキストをトークン化します。
+    同じクエリや文書を繰り返しトークン化しないよう、結果をキャッシュします。
+
+    Args:
+        text (str): トークン化するテキスト
+
+    Returns:
+        Tuple[str, ...]: トークンのタプル
+    """
+    return tuple(_get_tokenizer().tokenize(text))
+
+def _tokenize_many(texts: List[str]) -> List[Tuple[str, ...]]:
+    """
+    複数のテキストをトークン化します。
+    文書の追加時に使用するため、クエリ用のキャッシュには載せません。プロセスプールからも呼び出されます。
+
+    Args:
+        texts (List[str]): トークン化するテキストのリスト
+
+    Returns:
+        List[Tuple[str, ...]]: テキストごとのトークンのタプル
+    """
+    tokenizer = _get_tokenizer()
+    return [tuple(tokenizer.tokenize(text)) for text in texts]
+
+def _pack_strings(strings: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    文字列のリストを、UTF-8で連結したバイト列と各文字列の開始位置の配列に変換します。
+
+    Args:
+        strings (List[str]): 文字列のリスト
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: 連結したバイト列（uint8）と開始位置（int64、長さは文字列数+1）
+    """
+    encoded = [string.encode('utf-8') for string in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum(np.fromiter((len(data) for data in encoded), dtype=np.int64, count=len(encoded)), out=offsets[1:])
+    return np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets
+
+def _unpack_strings(data: np.ndarray, offsets: np.ndarray) -> List[str]:
+    """
+    _pack_stringsで変換したバイト列と開始位置の配列から、文字列のリストを復元します。
+
+    Args:
+        data (np.ndarray): 連結したバイト列（uint8）
+        offsets (np.ndarray): 各文字列の開始位置（長さは文字列数+1）
+
+    Returns:
+        List[str]: 文字列のリスト
+    """
+    blob = data.tobytes()
+    bounds = offsets.tolist()
+    return [blob[start:end].decode('utf-8') for start, end in zip(bounds[:-1], bounds[1:])]
+
+class _BM25Postings:
+    """
+    トークン化済みの文書から作成するBM25の転置インデックス。
+
+    語彙ごとの出現文書と出現回数をCSR形式のNumPy配列で保持し、クエリの語ごとに
+    出現する文書のスコアだけをまとめて加算します。スコアとIDFの計算式はrank_bm25のBM25Okapiと同じです。
+
+    Attributes:
+        vocab (Dict[str, int]): 語から語IDへのマッピング。
+        term_ptr (np.ndarray): 語IDごとのpost_docs/post_tf内の開始位置（長さは語彙数+1）。
+        post_docs (np.ndarray): 語ごとに連続して並べた出現文書の番号（int32）。
+        post_tf (np.ndarray): post_docsに対応する出現回数（float32）。
+        idf (np.ndarray): 語IDごとのIDF（float32）。
+        doc_len (np.ndarray): 文書ごとのトークン数（float32）。
+        doc_norm (np.ndarray): 文書ごとの k1 * (1 - b + b * 文書長 / 平均文書長)（float32）。
+        post_weight (np.ndarray): post_docsに対応する、語と文書の組ごとのスコア
+            idf * tf * (k1 + 1) / (tf + doc_norm)（float32）。k1、b、IDF、文書長は検索ごとに変わらないため、事前に計算しておく。
+        term_max (np.ndarray): 語IDごとのpost_weightの最大値（float32）。MaxScoreの枝刈りでスコアの上限として使う。
+        term_min (np.ndarray): 語IDごとのpost_weightの最小値（float32）。IDFが負の語によるスコアの下限として使う。
+    """
+
+    def __init__(self, corpus: List[Sequence[str]], k1: float, b: float, epsilon: float = 0.25):
+        """
+        転置インデックスを作成します。
+
+        Args:
+            corpus (List[Sequence[str]]): トークン化済みの文書のリスト。
+            k1 (float): BM25アルゴリズムのk1パラメータ。
+            b (float): BM25アルゴリズムのbパラメータ。
+            epsilon (float): 負のIDFを置き換える値（平均IDFに対する割合）。
+        """
+        self.k1 = k1
+        self.b = b
+        self.epsilon = epsilon
+        self.num_docs = 0
+        self.vocab: Dict[str, int] = {}
+        self.term_ptr = np.zeros(1, dtype=np.int64)
+        self.post_docs = np.empty(0, dtype=np.int32)
+        self.post_tf = np.empty(0, dtype=np.float32)
+        self.doc_len = np.empty(0, dtype=np.float32)
+        self.extend(corpus)
+
+    def extend(self, corpus: List[Sequence[str]]) -> None:
+        """
+        文書を末尾に追加します。
+        追加する文書だけを数え、既存の出現情報とは語IDで安定ソートして結合するため、既存の文書は数え直しません。
+        文書数と平均文書長が変わるため、IDFと文書長の正規化項は全体で計算し直します。
+
+        Args:
+            corpus (List[Sequence[str]]): 追加するトークン化済みの文書のリスト。
+        """
+        new_terms: List[int] = []
+        new_docs: List[int] = []
+        new_tfs: List[int] = []
+        for doc_id, doc in enumerate(corpus, start=self.num_docs):
+            for term, tf in Counter(doc).items():
+                new_terms.append(self.vocab.setdefault(term, len(self.vocab)))
+                new_docs.append(doc_id)
+                new_tfs.append(tf)
+
+        # 既存の出現情報の語IDを復元し、追加分と合わせて語IDの順に並べ直す（同じ語の中では文書の順序を保つ）
+        old_terms = np.repeat(np.arange(len(self.term_ptr) - 1, dtype=np.int64), np.diff(self.term_ptr))
+        all_terms = np.concatenate([old_terms, np.asarray(new_terms, dtype=np.int64)])
+        order = np.argsort(all_terms, kind='stable')
+        self.post_docs = np.concatenate([self.post_docs, np.asarray(new_docs, dtype=np.int32)])[order]
+        self.post_tf = np.concatenate([self.post_tf, np.asarray(new_tfs, dtype=np.float32)])[order]
+        self.term_ptr = np.zeros(len(self.vocab) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(all_terms, minlength=len(self.vocab)), out=self.term_ptr[1:])
+
+        self.doc_len = np.concatenate([self.doc_len, np.fromiter((len(doc) for doc in corpus), dtype=np.float32, count=len(corpus))])
+        self.num_docs += len(corpus)
+        self.__update_weights()
+
+    def __update_weights(self) -> None:
+        """
+        出現文書数からIDFを、文書長から正規化項を計算します。
+        """
+        df = np.diff(self.term_ptr)
+        idf = np.log(self.num_docs - df + 0.5) - np.log(df + 0.5)
+        if len(idf):
+            idf[idf < 0] = self.epsilon * idf.mean()
+        self.idf = idf.astype(np.float32)
+
+        avgdl = float(self.doc_len.mean()) if self.num_docs else 1.0
+        self.doc_norm = (self.k1 * (1 - self.b + self.b * self.doc_len / avgdl)).astype(np.float32)
+        self.__update_post_weight()
+
+    def __update_post_weight(self) -> None:
+        """
+        語と文書の組ごとのスコアを計算します。検索時はクエリ中の出現回数を掛けて加算するだけになります。
+        """
+        post_idf = np.repeat(self.idf, np.diff(self.term_ptr))
+        tf = self.post_tf
+        self.post_weight = (post_idf * (tf * np.float32(self.k1 + 1) / (tf + self.doc_norm[self.post_docs]))).astype(np.float32)
+        # 語彙に含まれる語は必ず1つ以上の文書に出現するため、各区間は空にならない
+        if len(self.post_weight):
+            self.term_max = np.maximum.reduceat(self.post_weight, self.term_ptr[:-1])
+            self.term_min = np.minimum.reduceat(self.post_weight, self.term_ptr[:-1])
+        else:
+            self.term_max = np.zeros(len(self.term_ptr) - 1, dtype=np.float32)
+            self.term_min = np.zeros(len(self.term_ptr) - 1, dtype=np.float32)
+
+    @classmethod
+    def from_arrays(cls, terms: List[str], term_ptr: np.ndarray, post_docs: np.ndarray, post_tf: np.ndarray,
+                    idf: np.ndarray, doc_norm: np.ndarray, k1: float, b: float, epsilon: float = 0.25) -> '_BM25Postings':
+        """
+        保存された配列から転置インデックスを復元します。
+
+        Args:
+            terms (List[str]): 語IDの順に並べた語のリスト。
+            term_ptr (np.ndarray): 語IDごとのpost_docs/post_tf内の開始位置。
+            post_docs (np.ndarray): 出現文書の番号。
+            post_tf (np.ndarray): 出現回数。
+            idf (np.ndarray): 語IDごとのIDF。
+            doc_norm (np.ndarray): 文書ごとの文書長による正規化項。
+            k1 (float): BM25アルゴリズムのk1パラメータ。
+            b (float): BM25アルゴリズムのbパラメータ。
+            epsilon (float): 負のIDFを置き換える値（平均IDFに対する割合）。
+
+        Returns:
+            _BM25Postings: 復元した転置インデックス。
+        """
+        postings = cls.__new__(cls)
+        postings.k1 = k1
+        postings.b = b
+        postings.epsilon = epsilon
+        postings.num_docs = len(doc_norm)
+        postings.vocab = {term: term_id for term_id, term in enumerate(terms)}
+        postings.term_ptr = term_ptr
+        postings.post_docs = post_docs
+        postings.post_tf = post_tf
+        postings.idf = idf
+        postings.doc_norm = doc_norm
+        # 文書長は出現回数の合計から求める（追加時に正規化項を計算し直すため）
+        postings.doc_len = np.bincount(post_docs, weights=post_tf, minlength=postings.num_docs).astype(np.float32)
+        postings.__update_post_weight()
+        return postings
+
+    def get_scores(self, query: Sequence[str]) -> np.ndarray:
+        """
+        クエリに対する全文書のBM25スコアを計算します。
+
+        Args:
+            query (Sequence[str]): トークン化済みのクエリ。
+
+        Returns:
+            np.ndarray: 文書ごとのスコア（float64）。
+        """
+        scores = np.zeros(self.num_docs, dtype=np.float64)
+        for term, count in Counter(query).items():
+            term_id = self.vocab.get(term)
+            if term_id is None:
+                continue
+            start, end = self.term_ptr[term_id], self.term_ptr[term_id + 1]
+            # 1つの語の出現文書は重複しないため、ファンシーインデックスでそのまま加算できる
+            scores[self.post_docs[start:end]] += count * self.post_weight[start:end]
+        return scores
+
+    def top_k(self, query: Sequence[str], k: int, excluded: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        クエリに対するスコアの上位k件の文書を取得します。
+
+        MaxScoreによる枝刈りを行います。語ごとのスコアの上限（term_max）が大きい語から順に加算し、
+        k番目のスコアが未処理の語の上限の合計以上になった時点で、それ以降は上位k件に入り得る文書のスコアだけを加算します。
+        多くの文書に出現する語はIDFが負になり、加算するとスコアが下がります。そのため語ごとの上限は0以上に切り上げ、
+        k番目のスコアには未処理の語で下がり得る分（term_minの負の部分の合計）を加えてから比較します。
+
+        Args:
+            query (Sequence[str]): トークン化済みのクエリ。
+            k (int): 取得する件数。
+            excluded (Optional[np.ndarray]): 結果から除外する文書を示すbool配列。
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: スコアの降順に並べた文書の番号とスコア。
+        """
+        scores = np.zeros(self.num_docs, dtype=np.float64)
+        num_eligible = self.num_docs
+        if excluded is not None:
+            scores[excluded] = -np.inf
+            num_eligible -= int(np.count_nonzero(excluded))
+        k = min(k, num_eligible)
+        if k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+
+        terms = [(self.vocab[term], count) for term, count in Counter(query).items() if term in self.vocab]
+        # 語のスコアが負の場合も上限として成り立つよう、0未満の上限は0とする
+        upper_bounds = [count * max(float(self.term_max[term_id]), 0.0) for term_id, count in terms]
+        # 未処理の語によってスコアが下がり得る分（0以下）。k番目のスコアの下限を求めるために使う
+        lower_bounds = [count * min(float(self.term_min[term_id]), 0.0) for term_id, count in terms]
+        remaining = sum(upper_bounds)
+        remaining_lower = sum(lower_bounds)
+
+        candidates: Optional[np.ndarray] = None  # 上位k件に入り得る文書の番号（Noneの場合は全文書）
+        candidate_mask: Optional[np.ndarray] = None
+        for i in sorted(range(len(terms)), key=upper_bounds.__getitem__, reverse=True):
+            term_id, count = terms[i]
+            remaining -= upper_bounds[i]
+            remaining_lower -= lower_bounds[i]
+            start, end = self.term_ptr[term_id], self.term_ptr[term_id + 1]
+            docs = self.post_docs[start:end]
+            weights = self.post_weight[start:end]
+            if candidate_mask is not None:
+                keep = candidate_mask[docs]
+                docs, weights = docs[keep], weights[keep]
+            scores[docs] += count * weights
+
+            pool = scores if candidates is None else scores[candidates]
+            if len(pool) <= k:
+                continue
+            # 現在のk番目のスコアから、残りの語で下がり得る分を引いたものが最終的なk番目のスコアの下限になる
+            threshold = np.partition(pool, len(pool) - k)[len(pool) - k] + remaining_lower
+            if not np.isfinite(threshold) or threshold < remaining:
+                # 除外された文書がk番目に含まれる場合や、まだスコアが加算されていない文書も上位k件に入り得る場合は枝刈りしない
+                continue
+            # 残りの語のスコアをすべて加えてもk番目に届かない文書は、以降の計算から除外する
+            if candidates is None:
+                candidates = np.flatnonzero(scores + remaining >= threshold)
+            else:
+                candidates = candidates[pool + remaining >= threshold]
+            candidate_mask = np.zeros(self.num_docs, dtype=bool)
+            candidate_mask[candidates] = True
+
+        positions = np.arange(self.num_docs) if candidates is None else candidates
+        pool = scores[positions]
+        if k < len(pool):
+            top = np.argpartition(-pool, k - 1)[:k]
+        else:
+            top = np.arange(len(pool))
+        top = top[np.argsort(-pool[top], kind='stable')]
+        return positions[top], pool[top]
+
 class BM25IndexManager:
     """
     BM25アルゴリズムを使用して文書のインデックスを管理するクラス。
@@ -16,10 +326,12 @@ class BM25IndexManager:
     Attributes:
         __k1 (float): BM25アルゴリズムのk1パラメータ。
         __b (float): BM25アルゴリズムのbパラメータ。
-        __tokenizer (Tokenizer): Janomeトークナイザーのインスタンス。
-        __index (BM25Okapi): BM25Okapiインデックスのインスタンス。
+        __index (_BM25Postings): BM25の転置インデックス。
         __docs (List[str]): インデックス化された文書のリスト。
-        __deleted_flags (set): 削除されたドキュメントのインデックスを保持するセット。
+        __tokenized_docs (List[Tuple[str, ...]]): __docsと同じ順序で保持するトークン化済みの文書のリスト。
+        __deleted_mask (np.ndarray): 文書ごとの削除フラグ（__docsと同じ長さのbool配列）。
+        __indexed_ids (np.ndarray): 転置インデックスに含まれる文書のID（インデックス内の順序）。
+            削除された文書は次の再構築まで残り、検索時に除外されます。
 
     使用例:
         # インスタンスの作成
@@ -42,11 +354,14 @@ class BM25IndexManager:
         # 複数の文書の削除
         bm25_manager.remove([1, 2])
 
+        # 削除された文書をインデックスから取り除く
+        bm25_manager.compact(threshold=0.0)
+
         # インデックスの保存
-        bm25_manager.save_to_file("index.pkl")
+        bm25_manager.save_to_file("index.bin")
 
         # インデックスの読み込み
-        loaded_manager = BM25IndexManager.load_from_file("index.pkl")
+        loaded_manager = BM25IndexManager.load_from_file("index.bin")
 
         # インデックスのエクスポート
         exported_data = bm25_manager.export()
@@ -58,42 +373,126 @@ class BM25IndexManager:
         stats = bm25_manager.stats
     """
 
-    def __init__(self, index: Optional[BM25Okapi] = None, docs: Optional[List[str]] = None, 
-             deleted_flags: Optional[set] = None, k1: float = 1.5, b: float = 0.75):
+    # export()の出力の先頭に付ける識別子（以前の形式のpickleと区別するため）
+    FORMAT_MAGIC = b"BM25SOA1"
+
+    # この件数以上の文書を一度に追加する場合は、プロセスプールで並列にトークン化する
+    PARALLEL_TOKENIZE_THRESHOLD = 2048
+    # 並列にトークン化する際に1つのプロセスに渡す文書数
+    TOKENIZE_BATCH_SIZE = 1024
+
+    # 検索結果をキャッシュするクエリの最大数
+    SEARCH_CACHE_SIZE = 1024
+
+    # 削除された文書がインデックス内の文書のこの割合を超えたら、インデックスを再構築する
+    COMPACT_THRESHOLD = 0.2
+
+    def __init__(self, index: Optional[Union[_BM25Postings, BM25Okapi]] = None, docs: Optional[List[str]] = None, 
+             deleted_flags: Optional[Union[set, np.ndarray]] = None, k1: float = 1.5, b: float = 0.75,
+             tokenized_docs: Optional[List[Sequence[str]]] = None, indexed_ids: Optional[Sequence[int]] = None):
         """
         BM25IndexManagerのコンストラクタ。
 
         Args:
-            index (Optional[BM25Okapi]): 既存のBM25Okapiインデックス。デフォルトはNone。
+            index (Optional[Union[_BM25Postings, BM25Okapi]]): 既存の転置インデックス。デフォルトはNone。
+                以前の形式のBM25Okapiインデックスが渡された場合は、トークン化済みの文書から転置インデックスを作成し直します。
             docs (Optional[List[str]]): インデックス化する文書のリスト。デフォルトはNone。
-            deleted_flags (Optional[set]): 削除されたドキュメントのインデックスを保持するセット。デフォルトはNone。
+            deleted_flags (Optional[Union[set, np.ndarray]]): 削除された文書のIDのセット、または文書ごとの削除フラグのbool配列。デフォルトはNone。
             k1 (float): BM25アルゴリズムのk1パラメータ。デフォルトは1.5。
             b (float): BM25アルゴリズムのbパラメータ。デフォルトは0.75。
+            tokenized_docs (Optional[List[Sequence[str]]]): docsをトークン化したリスト。省略した場合はdocsをトークン化します。
+            indexed_ids (Optional[Sequence[int]]): indexに含まれる文書のID。省略した場合は削除されていない文書のIDとみなします。
         """
         self.logger = logging.getLogger(__name__)
         self.__k1 = k1
         self.__b = b
-        self.__tokenizer = Tokenizer()
+        # (クエリ, k)ごとの検索結果。インデックスを変更するたびに破棄する
+        self.__search_cache: "OrderedDict[Tuple[str, int], Tuple[List[int], List[float]]]" = OrderedDict()
         
         if index is not None and (docs is None or deleted_flags is None):
             raise ValueError(f"If index is provided, docs and deleted_flags must also be provided. Got: index={index}, docs={docs}, deleted_flags={deleted_flags}")
 
-        if index:
-            if not isinstance(index, BM25Okapi):
-                raise TypeError("index must be a BM25Okapi object")
-            self.__index = index
+        if index is not None:
+            if not isinstance(index, (_BM25Postings, BM25Okapi)):
+                raise TypeError("index must be a _BM25Postings or BM25Okapi object")
             self.__docs = docs
-            self.__deleted_flags = deleted_flags
-            self.__update_index()
+            self.__tokenized_docs = self.__prepare_tokenized_docs(docs, tokenized_docs)
+            self.__deleted_mask = self.__to_deleted_mask(deleted_flags, len(self.__docs))
+            # 保存されたインデックスは保存時の文書から構築されているため、再構築せずにそのまま使用する
+            self.__index = index
+            if indexed_ids is None:
+                self.__indexed_ids = np.flatnonzero(~self.__deleted_mask)
+            else:
+                self.__indexed_ids = np.asarray(indexed_ids, dtype=np.int64)
+            if isinstance(index, BM25Okapi):
+                self.__index = _BM25Postings([self.__tokenized_docs[i] for i in self.__indexed_ids.tolist()], k1=self.__k1, b=self.__b)
         else:
             self.__index = None
-            self.__docs = []
-            self.__deleted_flags = set()
+            self.__docs = docs or []
+            self.__tokenized_docs = self.__prepare_tokenized_docs(self.__docs, tokenized_docs)
+            self.__deleted_mask = self.__to_deleted_mask(deleted_flags, len(self.__docs))
+            self.__indexed_ids = np.empty(0, dtype=np.int64)
+            if self.__docs:
+                self.__update_index()
+
+    @staticmethod
+    def __to_deleted_mask(deleted_flags: Optional[Union[set, np.ndarray]], num_docs: int) -> np.ndarray:
+        """
+        削除された文書のIDのセット（以前の形式）またはbool配列から、文書数と同じ長さの削除フラグの配列を作成する内部メソッド。
 
-        if docs:
-            self.__update_index()
+        Args:
+            deleted_flags (Optional[Union[set, np.ndarray]]): 削除された文書のIDのセット、または削除フラグのbool配列。
+            num_docs (int): 文書数。
 
-    def __tokenize(self, text: str) -> List[str]:
+        Returns:
+            np.ndarray: 文書ごとの削除フラグ。
+        """
+        mask = np.zeros(num_docs, dtype=bool)
+        if isinstance(deleted_flags, np.ndarray) and deleted_flags.dtype == bool:
+            size = min(num_docs, len(deleted_flags))
+            mask[:size] = deleted_flags[:size]
+        elif deleted_flags is not None and len(deleted_flags) > 0:
+            ids = np.fromiter(deleted_flags, dtype=np.int64)
+            mask[ids[(ids >= 0) & (ids < num_docs)]] = True
+        return mask
+
+    def __prepare_tokenized_docs(self, docs: List[str], tokenized_docs: Optional[List[Sequence[str]]]) -> List[Sequence[str]]:
+        """
+        トークン化済みの文書のリストを用意する内部メソッド。
+        渡されたリストが文書数と一致しない場合は、文書をトークン化し直します。
+
+        Args:
+            docs (List[str]): 文書のリスト。
+            tokenized_docs (Optional[List[Sequence[str]]]): トークン化済みの文書のリスト。
+
+        Returns:
+            List[Sequence[str]]: docsと同じ順序のトークン化済みの文書のリスト。
+        """
+        if tokenized_docs is not None and len(tokenized_docs) == len(docs):
+            return list(tokenized_docs)
+        return self.__tokenize_documents(docs)
+
+    def __tokenize_documents(self, documents: List[str]) -> List[Tuple[str, ...]]:
+        """
+        文書をまとめてトークン化する内部メソッド。
+        JanomeはPythonで実装されておりスレッドでは並列化されないため、文書が多い場合はプロセスプールで分担します。
+        Azure Functionsのホストはマルチスレッドで動作しており、forkで起動した子プロセスはロックを保持したまま停止することがあるため、ワーカーはspawnで起動します。
+
+        Args:
+            documents (List[str]): トークン化する文書のリスト。
+
+        Returns:
+            List[Tuple[str, ...]]: 文書ごとのトークンのタプル。
+        """
+        num_workers = min(os.cpu_count() or 1, -(-len(documents) // self.TOKENIZE_BATCH_SIZE))
+        if len(documents) < self.PARALLEL_TOKENIZE_THRESHOLD or num_workers <= 1:
+            return _tokenize_many(documents)
+
+        batches = [documents[i:i + self.TOKENIZE_BATCH_SIZE] for i in range(0, len(documents), self.TOKENIZE_BATCH_SIZE)]
+        with ProcessPoolExecutor(max_workers=num_workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+            return list(chain.from_iterable(executor.map(_tokenize_many, batches)))
+
+    def __tokenize(self, text: str) -> Tuple[str, ...]:
         """
         テキストをトークン化する内部メソッド。
 
@@ -101,9 +500,9 @@ class BM25IndexManager:
             text (str): トークン化するテキスト。
 
         Returns:
-            List[str]: トークン化されたテキスト。
+            Tuple[str, ...]: トークン化されたテキスト。
         """
-        return [token.surface for token in self.__tokenizer.tokenize(text)]
+        return _tokenize(text)
 
     def add(self, documents: Union[str, List[str]]) -> List[int]:
         """
@@ -123,15 +522,26 @@ class BM25IndexManager:
         elif not isinstance(documents, list) or not all(isinstance(doc, str) for doc in documents):
             raise ValueError('documents must be a string or a list of strings')
 
+        # インデックスが空の場合でも新しいドキュメントを追加できるようにする
+        rebuild = self.__index is None or self.__num_active == 0
+        if rebuild:
+            self.__deleted_mask[:] = False  # 削除フラグをリセット
+
+        # 文書は追加時に1度だけトークン化し、インデックスの再構築ではトークン化済みの結果を使う
+        tokenized = self.__tokenize_documents(documents)
         start_id = len(self.__docs)
         self.__docs.extend(documents)
+        self.__tokenized_docs.extend(tokenized)
         new_ids = list(range(start_id, len(self.__docs)))
+        self.__deleted_mask = np.concatenate([self.__deleted_mask, np.zeros(len(new_ids), dtype=bool)])
 
-        # インデックスが空の場合でも新しいドキュメントを追加できるようにする
-        if self.__index is None or len(self.__active_indices) == 0:
-            self.__deleted_flags = set()  # 削除フラグをリセット
-        
-        self.__update_index()
+        if rebuild:
+            self.__update_index()
+        else:
+            # 既存の文書は数え直さず、追加した文書だけを転置インデックスの末尾に加える
+            self.__index.extend(tokenized)
+            self.__indexed_ids = np.concatenate([self.__indexed_ids, np.arange(start_id, len(self.__docs), dtype=np.int64)])
+        self.__search_cache.clear()
 
         self.logger.info(f"{len(new_ids)} documents have been added.")
         return new_ids
@@ -139,6 +549,8 @@ class BM25IndexManager:
     def remove(self, ids: Union[int, List[int]]):
         """
         インデックスから文書を削除する。
+        文書には削除フラグを付けるだけで、検索時に結果から除外します。
+        削除された文書が一定の割合を超えた場合は、インデックスを再構築します。
 
         Args:
             ids (Union[int, List[int]]): 削除する文書のIDまたはIDのリスト。
@@ -153,11 +565,10 @@ class BM25IndexManager:
             ids = [ids]
         
         try:
-            for id in ids:
-                if 0 <= id < len(self.__docs):
-                    self.__deleted_flags.add(id)
+            self.__deleted_mask[self.__valid_ids(ids)] = True
+            self.__search_cache.clear()
 
-            self.__update_index()
+            self.compact()
 
             self.logger.info(f"{len(ids)} documents have been removed.")
         except Exception as e:
@@ -167,6 +578,7 @@ class BM25IndexManager:
     def unmark_deleted(self, ids: Union[int, List[int]]):
         """
         指定されたIDの文書の削除フラグを解除します。
+        再構築によってインデックスから取り除かれていた文書が含まれる場合のみ、インデックスを再構築します。
 
         Args:
             ids (Union[int, List[int]]): 削除フラグを解除する文書のIDまたはIDのリスト。
@@ -181,51 +593,111 @@ class BM25IndexManager:
             ids = [ids]
         
         try:
-            for id in ids:
-                if id in self.__deleted_flags:
-                    self.__deleted_flags.remove(id)
+            self.__deleted_mask[self.__valid_ids(ids)] = False
+            self.__search_cache.clear()
 
-            self.__update_index()
+            if self.__num_indexed_active < self.__num_active:
+                self.__update_index()
 
             self.logger.info(f"Deletion flags for {len(ids)} documents have been removed.")
         except Exception as e:
             self.logger.error(f"An error occurred while unmarking deleted documents: {str(e)}")
             raise
 
+    def __valid_ids(self, ids: List[int]) -> np.ndarray:
+        """IDのリストから、文書の範囲内のIDだけを配列として取り出す。"""
+        ids = np.asarray(ids, dtype=np.int64)
+        return ids[(ids >= 0) & (ids < len(self.__docs))]
+
+    @property
+    def __num_active(self) -> int:
+        """削除されていない文書の数。"""
+        return len(self.__docs) - int(np.count_nonzero(self.__deleted_mask))
+
+    @property
+    def __num_indexed_active(self) -> int:
+        """インデックスに含まれる文書のうち、削除されていない文書の数。"""
+        return len(self.__indexed_ids) - int(np.count_nonzero(self.__deleted_mask[self.__indexed_ids]))
+
+    def compact(self, threshold: Optional[float] = None) -> bool:
+        """
+        インデックスに残っている削除済みの文書の割合がしきい値を超えている場合、インデックスを再構築して取り除く。
+
+        Args:
+            threshold (Optional[float]): 再構築するしきい値（インデックス内の文書数に対する削除済み文書の割合）。
+                省略した場合はCOMPACT_THRESHOLDを使用します。
+
+        Returns:
+            bool: インデックスを再構築した場合はTrue
+        """
+        if self.__index is None or self.__num_active == 0:
+            # 有効な文書がない場合は再構築できないため、検索時の除外に任せる
+            return False
+
+        threshold = self.COMPACT_THRESHOLD if threshold is None else threshold
+        num_deleted = len(self.__indexed_ids) - self.__num_indexed_active
+        if num_deleted == 0 or num_deleted <= threshold * len(self.__indexed_ids):
+            return False
+
+        self.__update_index()
+        self.logger.info(f"Index has been compacted. {num_deleted} deleted documents were dropped.")
+        return True
+
     def __update_index(self):
         """
         インデックスを更新する内部メソッド。
         削除されていないドキュメントのみを使用してインデックスを再構築します。
         """
-        # 削除されていないドキュメントのみを抽出
-        active_docs = [doc for i, doc in enumerate(self.__docs) if i not in self.__deleted_flags]
-        
-        # 各ドキュメントをトークン化
-        tokenized_corpus = [self.__tokenize(doc) for doc in active_docs]
-        
-        # BM25Okapiインデックスを再構築
-        self.__index = BM25Okapi(tokenized_corpus, k1=self.__k1, b=self.__b)
-        
-        # アクティブなドキュメントのインデックスを保持
-        self.__active_indices = [i for i in range(len(self.__docs)) if i not in self.__deleted_flags]
+        # インデックスに含めるドキュメントのIDを保持
+        self.__indexed_ids = np.flatnonzero(~self.__deleted_mask)
+
+        # トークン化済みの文書から転置インデックスを再構築
+        tokenized_corpus = [self.__tokenized_docs[i] for i in self.__indexed_ids.tolist()]
+        self.__index = _BM25Postings(tokenized_corpus, k1=self.__k1, b=self.__b)
+        self.__search_cache.clear()
 
     def search(self, query: str, k: int = 5) -> Tuple[List[int], List[float]]:
-        if self.__index is None or len(self.__active_indices) == 0:
+        """
+        クエリに対するスコアの上位k件の文書を検索する。
+        同じクエリとkの検索結果は、インデックスが変更されるまでキャッシュから返します。
+
+        Args:
+            query (str): 検索クエリ。
+            k (int): 返す結果の数。デフォルトは5。
+
+        Returns:
+            Tuple[List[int], List[float]]: (文書IDのリスト, スコアのリスト)
+        """
+        if self.__index is None or self.__num_active == 0:
             self.logger.warning("Index is empty. No search results.")
             return [], []
 
+        cache_key = (query, k)
+        cached = self.__search_cache.get(cache_key)
+        if cached is not None:
+            self.__search_cache.move_to_end(cache_key)
+            return list(cached[0]), list(cached[1])
+
         try:
             tokenized_query = self.__tokenize(query)
-            doc_scores = self.__index.get_scores(tokenized_query)
-            
-            # スコアでソートし、上位k件を取得
-            top_n = sorted(enumerate(doc_scores), key=lambda x: x[1], reverse=True)[:k]
-            
-            ids = [self.__active_indices[i] for i, _ in top_n]
-            scores = [score for _, score in top_n]
+
+            # インデックスに残っている削除済みの文書は結果から除外する
+            deleted_mask = self.__deleted_mask[self.__indexed_ids]
+            if not deleted_mask.any():
+                deleted_mask = None
+
+            # 上位k件は枝刈りしながら選び、そのk件だけをスコア順に並べる
+            top_n, top_scores = self.__index.top_k(tokenized_query, k, excluded=deleted_mask)
+
+            ids = self.__indexed_ids[top_n].tolist()
+            scores = top_scores.tolist()
+
+            self.__search_cache[cache_key] = (ids, scores)
+            if len(self.__search_cache) > self.SEARCH_CACHE_SIZE:
+                self.__search_cache.popitem(last=False)
             
             self.logger.info(f"Search results: {ids}, {scores}")
-            return ids, scores
+            return list(ids), list(scores)
         except Exception as e:
             self.logger.error(f"An error occurred while executing the search query: {str(e)}")
             raise
@@ -244,15 +716,8 @@ class BM25IndexManager:
             raise ValueError("Index is not initialized. Please add documents first.")
 
         try:
-            data = {
-                'index': self.__index,
-                'docs': self.__docs,
-                'deleted_flags': self.__deleted_flags,
-                'k1': self.__k1,
-                'b': self.__b
-            }
             with open(file_path, 'wb') as f:
-                pickle.dump(data, f)
+                f.write(self.export())
             self.logger.info(f"Index has been saved to {file_path}")
         except Exception as e:
             self.logger.error(f"Failed to save index to file: {str(e)}")
@@ -260,12 +725,30 @@ class BM25IndexManager:
 
     @classmethod
     def load_from_file(cls, file_path: str) -> 'BM25IndexManager':
+        """
+        ファイルからインデックスを読み込む。
+        圧縮された配列部分は一時ファイルに展開しながら読み込むため、圧縮前と圧縮後のデータを同時にメモリに保持しません。
+
+        Args:
+            file_path (str): 読み込むファイルのパス。
+
+        Returns:
+            BM25IndexManager: 読み込まれたインデックスを持つBM25IndexManagerのインスタンス。
+
+        Raises:
+            Exception: ファイルの読み込み中にエラーが発生した場合。
+        """
         logger = logging.getLogger(__name__)
         try:
             with open(file_path, 'rb') as f:
-                data = pickle.load(f)
-            instance = cls(index=data['index'], docs=data['docs'], deleted_flags=data['deleted_flags'], k1=data['k1'], b=data['b'])
-            return instance
+                if f.read(len(cls.FORMAT_MAGIC)) != cls.FORMAT_MAGIC:
+                    # 以前の形式（pickle）
+                    f.seek(0)
+                    return cls.__from_bytes(f.read())
+                with tempfile.TemporaryFile() as payload:
+                    decompress_stream(f, payload)
+                    payload.seek(0)
+                    return cls.__from_npz(payload)
         except Exception as e:
             logger.error(f"Failed to load index from file: {str(e)}")
             raise
@@ -274,6 +757,7 @@ class BM25IndexManager:
     def load_from_byte(cls, byte_data: Union[bytes, io.BytesIO]) -> 'BM25IndexManager':
         """
         バイトデータからインデックスを読み込む。
+        以前の形式（pickle）でエクスポートされたデータも読み込めます。
 
         Args:
             byte_data (Union[bytes, io.BytesIO]): 読み込むバイトデータ。
@@ -288,18 +772,74 @@ class BM25IndexManager:
         try:
             if isinstance(byte_data, io.BytesIO):
                 byte_data = byte_data.getvalue()
-            
-            data = pickle.loads(byte_data)
-        
-            instance = cls(index=data['index'], docs=data['docs'], deleted_flags=data['deleted_flags'], k1=data['k1'], b=data['b'])
-            return instance
+            return cls.__from_bytes(byte_data)
         except Exception as e:
             logger.error(f"Failed to load index from byte data: {str(e)}")
             raise
-            
+
+    @classmethod
+    def __from_bytes(cls, byte_data: bytes) -> 'BM25IndexManager':
+        """
+        エクスポートされたバイトデータからインスタンスを作成する内部メソッド。
+
+        Args:
+            byte_data (bytes): export()の出力、または以前の形式（pickle）のデータ。
+
+        Returns:
+            BM25IndexManager: 読み込まれたインデックスを持つBM25IndexManagerのインスタンス。
+        """
+        if not byte_data.startswith(cls.FORMAT_MAGIC):
+            # 以前の形式（pickle）
+            data = pickle.loads(byte_data)
+            return cls(index=data['index'], docs=data['docs'], deleted_flags=data['deleted_flags'], k1=data['k1'], b=data['b'],
+                       tokenized_docs=data.get('tokenized_docs'), indexed_ids=data.get('indexed_ids'))
+
+        # 配列部分はzstdで圧縮されている（圧縮前の形式で保存されたデータはそのまま読み込む）
+        payload = decompress(memoryview(byte_data)[len(cls.FORMAT_MAGIC):])
+        return cls.__from_npz(io.BytesIO(payload))
+
+    @classmethod
+    def __from_npz(cls, payload: BinaryIO) -> 'BM25IndexManager':
+        """
+        export()の出力のうち、FORMAT_MAGICに続くnpz形式の配列部分からインスタンスを作成する内部メソッド。
+
+        Args:
+            payload (BinaryIO): 展開済みのnpz形式のデータを読み込むストリーム。
+
+        Returns:
+            BM25IndexManager: 読み込まれたインデックスを持つBM25IndexManagerのインスタンス。
+        """
+        with np.load(payload) as arrays:
+            k1, b = (float(value) for value in arrays['params'])
+            docs = _unpack_strings(arrays['docs_data'], arrays['docs_offsets'])
+            num_docs = len(docs)
+            deleted_flags = np.unpackbits(arrays['deleted_bits'], count=num_docs).astype(bool)
+
+            token_vocab = _unpack_strings(arrays['token_vocab_data'], arrays['token_vocab_offsets'])
+            # トークンIDを1度にまとめて文字列に置き換えてから、文書ごとのスライスに分ける
+            tokens = [token_vocab[j] for j in arrays['token_ids'].tolist()]
+            token_ptr = arrays['token_ptr'].tolist()
+            tokenized_docs = [tuple(tokens[start:end]) for start, end in zip(token_ptr[:-1], token_ptr[1:])]
+
+            index = _BM25Postings.from_arrays(
+                terms=_unpack_strings(arrays['vocab_data'], arrays['vocab_offsets']),
+                term_ptr=arrays['term_ptr'],
+                post_docs=arrays['post_docs'],
+                post_tf=arrays['post_tf'],
+                idf=arrays['idf'],
+                doc_norm=arrays['doc_norm'],
+                k1=k1,
+                b=b
+            )
+            indexed_ids = arrays['indexed_ids']
+
+        return cls(index=index, docs=docs, deleted_flags=deleted_flags, k1=k1, b=b,
+                   tokenized_docs=tokenized_docs, indexed_ids=indexed_ids)
+
     def export(self) -> bytes:
         """
         インデックスをバイトデータとしてエクスポートする。
+        文書、トークン、転置インデックスをNumPy配列にまとめたnpz形式をzstdで圧縮し、先頭にFORMAT_MAGICを付けて出力します。
 
         Returns:
             bytes: シリアライズされたインデックスデータ。
@@ -311,14 +851,41 @@ class BM25IndexManager:
             raise ValueError("Index is not initialized. Please add documents first.")
 
         try:
-            data = {
-                'index': self.__index,
-                'docs': self.__docs,
-                'deleted_flags': self.__deleted_flags,
-                'k1': self.__k1,
-                'b': self.__b
-            }
-            return pickle.dumps(data)
+            docs_data, docs_offsets = _pack_strings(self.__docs)
+
+            # トークンは語彙とトークンIDの配列に分けて保持する
+            token_vocab: Dict[str, int] = {}
+            token_ids = np.fromiter(
+                (token_vocab.setdefault(token, len(token_vocab)) for doc in self.__tokenized_docs for token in doc),
+                dtype=np.int32
+            )
+            token_ptr = np.zeros(len(self.__tokenized_docs) + 1, dtype=np.int64)
+            np.cumsum(np.fromiter((len(doc) for doc in self.__tokenized_docs), dtype=np.int64, count=len(self.__tokenized_docs)), out=token_ptr[1:])
+            token_vocab_data, token_vocab_offsets = _pack_strings(list(token_vocab))
+
+            vocab_data, vocab_offsets = _pack_strings(list(self.__index.vocab))
+
+            buffer = io.BytesIO()
+            np.savez(
+                buffer,
+                params=np.array([self.__k1, self.__b], dtype=np.float64),
+                docs_data=docs_data,
+                docs_offsets=docs_offsets,
+                deleted_bits=np.packbits(self.__deleted_mask),
+                token_vocab_data=token_vocab_data,
+                token_vocab_offsets=token_vocab_offsets,
+                token_ids=token_ids,
+                token_ptr=token_ptr,
+                indexed_ids=self.__indexed_ids.astype(np.int32),
+                vocab_data=vocab_data,
+                vocab_offsets=vocab_offsets,
+                term_ptr=self.__index.term_ptr,
+                post_docs=self.__index.post_docs,
+                post_tf=self.__index.post_tf,
+                idf=self.__index.idf,
+                doc_norm=self.__index.doc_norm
+            )
+            return self.FORMAT_MAGIC + compress(buffer.getbuffer())
         except Exception as e:
             self.logger.error(f"An error occurred while exporting the index: {str(e)}")
             raise
@@ -339,6 +906,6 @@ class BM25IndexManager:
             }
         return {
             "num_documents": len(self.__docs),
-            "active_documents": len(self.__docs) - len(self.__deleted_flags),
+            "active_documents": self.__num_active,
             "vocabulary_size": len(self.__index.idf)
         }
\ No newline at end of file
@@ -1,9 +1,14 @@
 import io
 import logging
-from typing import Dict, List, Literal, Optional, Tuple, Union
+import os
+import tempfile
+from typing import BinaryIO, Dict, List, Literal, Optional, Tuple, Union
 
+import numpy as np
 from numpy import ndarray
-from voyager import Index, Space
+from voyager import Index, Space, StorageDataType
+
+from ..compression import ZSTD_MAGIC, decompress_stream
 
 class VoyagerIndexManager:
     """
@@ -14,6 +19,9 @@ class VoyagerIndexManager:
     使用例:
     vim = VoyagerIndexManager(ndims=128, space_type='cosine')
 
+    # ベクトルを8ビットで保持する場合（メモリと帯域を1/4にする代わりに、検索の再現率がわずかに下がる）
+    vim_float8 = VoyagerIndexManager(ndims=128, space_type='cosine', storage_data_type='float8')
+
     # ベクトルの追加
     vectors = np.array([np.random.rand(128) for _ in range(10)])
     ids = vim.add(vectors)
@@ -46,8 +54,15 @@ class VoyagerIndexManager:
         'innerproduct': Space.InnerProduct,
         'cosine': Space.Cosine
     }
+
+    __storage_data_type_map = {
+        'float32': StorageDataType.Float32,
+        'float8': StorageDataType.Float8,
+        'e4m3': StorageDataType.E4M3
+    }
     
-    def __init__(self, index: Optional[Index] = None, ndims: int = 3072, space_type: Literal['euclidean', 'innerproduct', 'cosine'] = 'cosine'):
+    def __init__(self, index: Optional[Index] = None, ndims: int = 3072, space_type: Literal['euclidean', 'innerproduct', 'cosine'] = 'cosine',
+                 storage_data_type: Literal['float32', 'float8', 'e4m3'] = 'float32'):
         """
         VectorIndexManagerを初期化します。
 
@@ -55,9 +70,14 @@ class VoyagerIndexManager:
             index (Optional[Index]): 既存のIndexオブジェクト。Noneの場合は新しいインデックスを作成します。
             ndims (int): ベクトルの次元数。デフォルトは3072。
             space_type (Literal['euclidean', 'innerproduct', 'cosine']): 使用する空間タイプ。デフォルトは'cosine'。
+            storage_data_type (Literal['float32', 'float8', 'e4m3']): ベクトルの保持形式。デフォルトは'float32'。
+                'float8'は各要素を[-1, 1]の範囲の8ビット固定小数点で、'e4m3'は8ビット浮動小数点で保持します。
+                メモリ使用量と距離計算時のメモリ帯域はfloat32の1/4になりますが、量子化誤差により検索の再現率がわずかに下がります。
+                'float8'は要素が[-1, 1]に収まるベクトル（正規化済みの埋め込みなど）にのみ使用してください。
+                既存のインデックスを読み込む場合は、保存時の形式が使われます。
 
         Raises:
-            ValueError: 無効なspace_typeが指定された場合。
+            ValueError: 無効なspace_typeまたはstorage_data_typeが指定された場合。
             TypeError: indexが指定されたが、Indexオブジェクトでない場合。
         """
         self.logger = logging.getLogger(__name__) 
@@ -70,8 +90,11 @@ class VoyagerIndexManager:
                 raise TypeError("index must be an Index object")
             self.__index = index
         else:
+            storage = self.__storage_data_type_map.get(storage_data_type)
+            if storage is None:
+                raise ValueError('storage_data_type must be one of: float32, float8, or e4m3')
             self.__ndims = ndims
-            self.__index = Index(self.__space, num_dimensions=self.__ndims)
+            self.__index = Index(self.__space, num_dimensions=self.__ndims, storage_data_type=storage)
 
         
     def add(self, vectors: Union[ndarray, List[ndarray]]) -> List[int]:
@@ -96,12 +119,16 @@ class VoyagerIndexManager:
             elif vectors.ndim != 2:
                 raise ValueError("Input array must be 1D or 2D")
         elif isinstance(vectors, list):
-            vectors = [v.reshape(1, -1) if v.ndim == 1 else v for v in vectors]
-            if not all(isinstance(v, ndarray) and v.ndim == 2 for v in vectors):
+            if not all(isinstance(v, ndarray) and v.ndim in (1, 2) for v in vectors):
                 raise ValueError('vectors must be a 1D or 2D numpy array, or a list of such arrays')
+            # 1次元のベクトルは1行として扱い、1つの配列にまとめる
+            vectors = np.vstack(vectors)
         else:
             raise ValueError('vectors must be a numpy array or a list of numpy arrays')
 
+        # Voyagerにはfloat32の連続した1つのバッファとして渡す
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+
         try:
             ids = self.__index.add_items(vectors=vectors)
             self.logger.info(f"Added {len(ids)} records to the index.")
@@ -123,12 +150,15 @@ class VoyagerIndexManager:
         if isinstance(ids, int):
             ids = [ids]
         
-        for id in ids:
-            try:
-                self.__index.mark_deleted(id)
-            except Exception as e:
-                self.logger.error(f"Failed to delete vector with ID {id}: {str(e)}")
-                raise
+        # Voyagerには一括で削除フラグを付けるAPIがないため、メソッドの参照をループの外で1度だけ取得する
+        mark_deleted = self.__index.mark_deleted
+        id = None
+        try:
+            for id in ids:
+                mark_deleted(id)
+        except Exception as e:
+            self.logger.error(f"Failed to delete vector with ID {id}: {str(e)}")
+            raise
 
         self.logger.info(f"Removed {len(ids)} vectors from the index.")
         
@@ -145,12 +175,14 @@ class VoyagerIndexManager:
         if isinstance(ids, int):
             ids = [ids]
         
-        for id in ids:
-            try:
-                self.__index.unmark_deleted(id)
-            except Exception as e:
-                self.logger.error(f"Failed to unmark deleted for vector with ID {id}: {str(e)}")
-                raise
+        unmark_deleted = self.__index.unmark_deleted
+        id = None
+        try:
+            for id in ids:
+                unmark_deleted(id)
+        except Exception as e:
+            self.logger.error(f"Failed to unmark deleted for vector with ID {id}: {str(e)}")
+            raise
 
         self.logger.info(f"Unmarked {len(ids)} vectors as deleted in the index.")
         
@@ -169,6 +201,8 @@ class VoyagerIndexManager:
             Exception: 検索中にエラーが発生した場合。
         """
         try:
+            # クエリは呼び出し元のdtype（float64など）に関わらず、float32の連続した配列に1度だけ変換する
+            query_vector = np.ascontiguousarray(query_vector, dtype=np.float32)
             ids, distances = self.__index.query(query_vector, k=k)
             self.logger.info(f"Search results: IDs={ids}, distances={distances}")
             return ids, distances
@@ -180,6 +214,9 @@ class VoyagerIndexManager:
     def load_from_file(cls, file_path: str) -> 'VoyagerIndexManager':
         """
         ファイルからインデックスを読み込み、新しいVectorIndexManagerインスタンスを作成します。
+        VoyagerはHNSWグラフをメモリ上に展開して保持するため、メモリマップでの読み込みには対応していません。
+        ファイルはVoyager側で直接読み込むため、Python側でファイル全体をバイトデータとして保持することはありません。
+        zstdで圧縮されたファイルは、一時ファイルに展開しながら書き出してから読み込みます。
 
         Args:
             file_path (str): 読み込むファイルのパス。
@@ -191,19 +228,30 @@ class VoyagerIndexManager:
             Exception: ファイルの読み込み中にエラーが発生した場合。
         """
         try:
-            loaded_index = Index.load(file_path)
+            with open(file_path, 'rb') as f:
+                compressed = f.read(len(ZSTD_MAGIC)) == ZSTD_MAGIC
+
+            if not compressed:
+                loaded_index = Index.load(file_path)
+            else:
+                with tempfile.TemporaryDirectory() as temp_dir:
+                    index_path = os.path.join(temp_dir, 'index.voy')
+                    with open(file_path, 'rb') as src, open(index_path, 'wb') as dst:
+                        decompress_stream(src, dst)
+                    loaded_index = Index.load(index_path)
             return cls(index=loaded_index)
         except Exception as e:
             logging.error(f"Failed to load index from file: {str(e)}")
             raise
         
     @classmethod
-    def load_from_byte(cls, byte_data: Union[bytes, io.BytesIO]) -> 'VoyagerIndexManager':
+    def load_from_byte(cls, byte_data: Union[bytes, BinaryIO]) -> 'VoyagerIndexManager':
         """
         バイトデータからインデックスを読み込み、新しいVectorIndexManagerインスタンスを作成します。
+        読み込み可能なバイナリストリーム（io.BytesIO、開いたファイル、mmap.mmapなど）はコピーせずにそのまま読み込みます。
 
         Args:
-            byte_data (Union[bytes, io.BytesIO]): 読み込むバイトデータ。
+            byte_data (Union[bytes, BinaryIO]): 読み込むバイトデータ、またはバイナリストリーム。
 
         Returns:
             VectorIndexManager: 読み込んだインデックスを持つ新しいインスタンス。
@@ -213,7 +261,7 @@ class VoyagerIndexManager:
         """
         try:
             # バイトデータをBytesIOオブジェクトに変換（必要な場合）
-            if isinstance(byte_data, bytes):
+            if isinstance(byte_data, (bytes, bytearray)):
                 byte_data = io.BytesIO(byte_data)
             loaded_index = Index.load(byte_data)
             return cls(index=loaded_index)
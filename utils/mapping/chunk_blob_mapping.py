@@ -1,16 +1,23 @@
-import json
 import logging
-from typing import Dict, Optional, List
-from azure.core.exceptions import ResourceNotFoundError
+import time
+from contextlib import contextmanager
+from types import MappingProxyType
+from typing import Any, Callable, Dict, Iterator, Mapping, Optional, List, Tuple, TypeVar
+import orjson
+from azure.core.exceptions import ResourceModifiedError, ResourceNotFoundError
 
-from utils.blobs.blob_manager import BlobManager
+from utils.blobs.blob_manager import AppendBlobSealedError, BlobManager
+from utils.blobs.blob_container_manager import backoff_delay
+from .mapping_log import MappingLog
+
+T = TypeVar("T")
 
 class ChunkBlobMapping:
     """
     チャンクIDとBlobの対応関係を管理するクラス。
     
     このクラスは、チャンクIDと対応するBlobの情報（コンテナ名、Blob名）をマッピングします。
-    マッピング情報はAzure Blob StorageのJSONファイルに保存され、永続化されます。
+    マッピング情報はAzure Blob StorageのJSONファイル（スナップショット）と、変更を追記するログ（MappingLog）に保存され、永続化されます。
 
     使用方法:
     ```
@@ -36,9 +43,29 @@ class ChunkBlobMapping:
 
     # マッピングを削除
     mapping_manager.remove_mapping("1")
+
+    # 複数のマッピングをまとめて追加する（保存は1回だけ行われる）
+    # ChunkStoreに保存したチャンクは、レコードの位置も合わせて保存する
+    mapping_manager.add_mappings([("3", "doc_container", "test.pdf", 1, None), ("4", "doc_container", "test.pdf", 2, [0, 4, 120])])
+
+    # 複数の変更をまとめて保存する
+    with mapping_manager.batch():
+        mapping_manager.add_mapping("5", "doc_container", "test.pdf")
+        mapping_manager.remove_mapping("2")
+
+    # 他のインスタンスと競合した場合は読み込み直して再試行する
+    mapping_manager.update(lambda m: m.remove_mapping("3"))
+
+    # 多数のチャンクを引く場合は、最新のマッピングを1回だけ読み込んだスナップショットを使う
+    blob_infos = mapping_manager.snapshot()
+    print(blob_infos.get("4"))
     ```
 
     マッピング情報は自動的にBlobストレージに保存され、インスタンス作成時に読み込まれます。
+    変更のたびにJSONファイル全体を書き直さず、変更内容だけをログに追記します。ログが大きくなるとスナップショットに書き戻します。
+    他のインスタンスによる更新を反映するには、refresh()を呼び出してください。
+    追記は読み込んだ時のログのサイズを条件に行うため、他のインスタンスが先に保存していた場合はResourceModifiedErrorになります。
+    複数のインスタンスから同時に更新する場合は、update()を使用してください。
     """
 
     def __init__(self, blob_manager: BlobManager, container_name: str, blob_name: str = "mapping/chunk_blob_mapping.json"):
@@ -48,33 +75,68 @@ class ChunkBlobMapping:
         self.__blob_name = blob_name
         self.__mapping = {}
         self.__reverse_mapping = {}
+        self.__batch_depth = 0
+        self.__dirty = False
+        self.__etag: Optional[str] = None  # 最後に読み込んだ（または保存した）スナップショットのETag
+        self.__log = MappingLog(blob_manager, container_name, blob_name)
+        self.__pending: List[Dict[str, Any]] = []  # ログに追記していない変更
+        self.__sealed_generation: Optional[int] = None  # 追記しようとしてシールされていたログの世代
         self.__load_from_storage()
 
     def __load_from_storage(self):
-        """Blobストレージからチャンクblobマッピング情報を読み込む"""
+        """
+        Blobストレージからチャンクblobマッピング情報を読み込む。
+        スナップショットに変更がない場合は、前回の読み込み以降にログに追記された変更だけを反映する。
+        """
         try:
-            data = self.__blob_manager.read(self.__container_name, self.__blob_name)
-            if data:
-                json_data = json.loads(data) if isinstance(data, str) else json.loads(data.decode('utf-8'))
-                self.__mapping = json_data
-                self.__update_reverse_mapping()
-            else:
-                self.__mapping = {}
-                self.__reverse_mapping = {}
-        except (ResourceNotFoundError, json.JSONDecodeError):
-            self.__mapping = {}
-            self.__reverse_mapping = {}
+            data, etag = self.__blob_manager.read_if_modified(self.__container_name, self.__blob_name, self.__etag)
+            if data is not None:
+                self.__etag = etag
+                json_data = orjson.loads(data) if data else {}  # bytesのままデコードする
+                if "log_generation" in json_data:
+                    self.__reset(json_data.get("mapping", {}), json_data["log_generation"])
+                else:
+                    # ログを導入する前の形式（マッピングのみを保存したJSON）
+                    self.__reset(json_data, 0)
+                self.logger.info(f"Loaded chunk-blob mapping from {self.__blob_name}")
+        except (ResourceNotFoundError, orjson.JSONDecodeError) as e:
+            if isinstance(e, ResourceNotFoundError):
+                self.__etag = None
+            self.__reset({}, 0)
             self.__save_to_storage()
-        self.logger.info(f"Loaded chunk-blob mapping from {self.__blob_name}")
+
+        for entry in self.__log.read_new():
+            self.__apply(entry)
+
+        if self.__sealed_generation == self.__log.generation:
+            # ログをシールしたインスタンスがスナップショットへの書き戻しを終えていないため、代わりに書き戻す
+            self.__rotate_log()
+
+    def __reset(self, mapping: Dict[str, Dict[str, Any]], log_generation: int):
+        """メモリ上のマッピングをスナップショットの内容で置き換える（保存していない変更は破棄する）"""
+        self.__mapping = mapping
+        self.__update_reverse_mapping()
+        self.__log.reset(log_generation)
+        self.__pending = []
+        self.__dirty = False
+
+    def __apply(self, entry: Dict[str, Any]):
+        """ログに記録された変更をメモリ上のマッピングに反映する"""
+        op = entry.get("op")
+        if op == "set":
+            info = entry["info"]
+            self.__set_blob_info(entry["chunk_id"], info["container"], info["blob"], info.get("page_number"), info.get("chunk"))
+        elif op == "remove":
+            self.__discard_blob_info(entry["chunk_id"])
 
     def __save_to_storage(self):
-        """チャンクblobマッピング情報をBlobストレージに保存する"""
-        json_data = json.dumps(self.__mapping).encode('utf-8')
-        self.__blob_manager.upload(self.__container_name, self.__blob_name, json_data)
+        """チャンクblobマッピング情報のスナップショットを、読み込んだ時からBlobが更新されていない場合のみBlobストレージに保存する"""
+        json_data = orjson.dumps({"mapping": self.__mapping, "log_generation": self.__log.generation})
+        self.__etag = self.__blob_manager.upload(self.__container_name, self.__blob_name, json_data, etag=self.__etag)
         self.logger.debug(f"Saved chunk-blob mapping to {self.__blob_name}")
 
     def __update_reverse_mapping(self):
-        """逆マッピング（Blob名からチャンクID）を更新する"""
+        """逆マッピング（Blob名からチャンクID）を作り直す（読み込み時のみ使用し、追加と削除では差分だけを反映する）"""
         self.__reverse_mapping = {}
         for chunk_id, blob_info in self.__mapping.items():
             key = f"{blob_info['container']}:{blob_info['blob']}"
@@ -82,21 +144,155 @@ class ChunkBlobMapping:
                 self.__reverse_mapping[key] = []
             self.__reverse_mapping[key].append(chunk_id)
 
-    def add_mapping(self, chunk_id: str, blob_container: str, blob_name: str):
-        """チャンクIDとBlobのマッピングを追加する"""
+    def __set_blob_info(self, chunk_id: str, blob_container: str, blob_name: str, page_number: Optional[int],
+                        chunk_location: Optional[List[int]] = None):
+        """チャンクIDのBlob情報を設定し、逆マッピングも合わせて更新する"""
+        self.__discard_blob_info(chunk_id)
         self.__mapping[chunk_id] = {"container": blob_container, "blob": blob_name}
-        self.__update_reverse_mapping()
-        self.__save_to_storage()
+        if page_number is not None:
+            self.__mapping[chunk_id]["page_number"] = page_number
+        if chunk_location is not None:
+            self.__mapping[chunk_id]["chunk"] = chunk_location
+        self.__reverse_mapping.setdefault(f"{blob_container}:{blob_name}", []).append(chunk_id)
+
+    def __discard_blob_info(self, chunk_id: str) -> bool:
+        """チャンクIDのBlob情報を削除し、逆マッピングからも取り除く（削除した場合はTrue）"""
+        blob_info = self.__mapping.pop(chunk_id, None)
+        if blob_info is None:
+            return False
+        key = f"{blob_info['container']}:{blob_info['blob']}"
+        chunk_ids = self.__reverse_mapping.get(key)
+        if chunk_ids is not None:
+            try:
+                chunk_ids.remove(chunk_id)
+            except ValueError:
+                pass
+            if not chunk_ids:
+                del self.__reverse_mapping[key]
+        return True
+
+    def refresh(self):
+        """Blobストレージから最新のマッピング情報を読み込む（ETagで変更を確認し、変更がある場合のみ転送する）"""
+        self.__load_from_storage()
+
+    def flush(self):
+        """未保存の変更があれば、1回の追記でログに保存する（ログが大きくなった場合はスナップショットに書き戻す）"""
+        if not self.__dirty:
+            return
+        try:
+            self.__log.append(self.__pending)
+        except Exception as e:
+            if isinstance(e, AppendBlobSealedError):
+                self.__sealed_generation = self.__log.generation
+            # 追記できたかどうか分からないため、次の読み込みでスナップショットから読み込み直す
+            self.__etag = None
+            raise
+        self.__pending = []
+        self.__dirty = False
+        if self.__log.needs_compaction:
+            self.__compact()
+
+    def __compact(self):
+        """ログをシールしてからスナップショットに書き戻し、次の世代のログに切り替える"""
+        try:
+            self.__log.seal()
+        except ResourceModifiedError:
+            return  # 他のインスタンスが追記していたため、次の保存時に改めて行う
+        self.__rotate_log()
+
+    def __rotate_log(self):
+        """
+        シールされたログまでの内容をスナップショットに書き戻し、次の世代のログに切り替える。
+        他のインスタンスが先に書き戻していた場合は、次の読み込みでスナップショットから読み込み直す。
+        シールされたログは、古いスナップショットを読み込んだインスタンスの追記を拒否するために残しておく。
+        """
+        self.__log.reset(self.__log.generation + 1)
+        try:
+            self.__save_to_storage()
+        except ResourceModifiedError:
+            self.logger.info(f"{self.__blob_name} was compacted by another writer.")
+            self.__etag = None
+            return
+        self.__sealed_generation = None
+        self.logger.info(f"Compacted chunk-blob mapping log into {self.__blob_name} (log generation {self.__log.generation})")
+
+    @contextmanager
+    def batch(self) -> Iterator["ChunkBlobMapping"]:
+        """
+        複数の変更をまとめて保存するコンテキストマネージャー。
+        開始時に最新のマッピング情報を読み込み、ブロック内では変更ごとに保存せず、終了時に1回だけ保存します。
+        他のインスタンスが先に保存していた場合は終了時にResourceModifiedErrorが発生するため、再試行が必要な場合はupdate()を使用してください。
+        """
+        if self.__batch_depth == 0:
+            self.__load_from_storage()
+        self.__batch_depth += 1
+        try:
+            yield self
+        finally:
+            self.__batch_depth -= 1
+            if self.__batch_depth == 0:
+                self.flush()
+
+    def update(self, func: Callable[["ChunkBlobMapping"], T], max_retries: int = 5) -> T:
+        """
+        最新のマッピング情報を読み込んでfuncで変更し、読み込んだ時からログに追記されていない場合のみ保存する（楽観的同時実行制御）。
+        他のインスタンスが先に保存していた場合は、最新のマッピング情報を読み込み直してfuncを再実行する。
+        リースを取得しないため、同時に更新するインスタンスがいない場合の通信は読み込みと追記の数回で済む。
+
+        :param func: このインスタンスを受け取ってマッピングを変更する関数。再試行時に再度呼び出されるため、マッピング以外の副作用を持たないこと
+        :param max_retries: 最大試行回数
+        :return: funcの戻り値
+        """
+        for attempt in range(max_retries):
+            try:
+                with self.batch():
+                    return func(self)
+            except ResourceModifiedError:
+                if attempt == max_retries - 1:
+                    self.logger.error(f"Failed to update {self.__blob_name} after {max_retries} attempts due to concurrent updates")
+                    raise
+                self.logger.info(f"{self.__blob_name} was updated by another writer. Attempt {attempt + 1}/{max_retries}. Retrying.")
+                time.sleep(backoff_delay(0.1, attempt))
+
+    def __mark_dirty(self):
+        """変更を保存する（バッチ中は終了時にまとめて保存する）"""
+        self.__dirty = True
+        if self.__batch_depth == 0:
+            self.flush()
+
+    def add_mapping(self, chunk_id: str, blob_container: str, blob_name: str, page_number: Optional[int] = None,
+                    chunk_location: Optional[List[int]] = None):
+        """チャンクIDとBlobのマッピングを追加する（ページ番号とChunkStoreでのレコードの位置が指定された場合は合わせて保存する）"""
+        self.__set_blob_info(chunk_id, blob_container, blob_name, page_number, chunk_location)
+        self.__pending.append({"op": "set", "chunk_id": chunk_id, "info": self.__mapping[chunk_id]})
+        self.__mark_dirty()
         self.logger.debug(f"Added mapping for chunk ID: {chunk_id}")
 
+    def add_mappings(self, items: List[Tuple[str, str, str, Optional[int], Optional[List[int]]]]):
+        """複数のマッピングをまとめて追加し、1回だけ保存する（各要素はチャンクID、コンテナ名、Blob名、ページ番号、レコードの位置のタプル）"""
+        with self.batch():
+            for chunk_id, blob_container, blob_name, page_number, chunk_location in items:
+                self.__set_blob_info(chunk_id, blob_container, blob_name, page_number, chunk_location)
+                self.__pending.append({"op": "set", "chunk_id": chunk_id, "info": self.__mapping[chunk_id]})
+            self.__dirty = True
+        self.logger.debug(f"Added mappings for {len(items)} chunk IDs")
+
     def remove_mapping(self, chunk_id: str):
         """指定されたチャンクIDのマッピングを削除する"""
-        if chunk_id in self.__mapping:
-            del self.__mapping[chunk_id]
-            self.__update_reverse_mapping()
-            self.__save_to_storage()
+        if self.__discard_blob_info(chunk_id):
+            self.__pending.append({"op": "remove", "chunk_id": chunk_id})
+            self.__mark_dirty()
             self.logger.debug(f"Removed mapping for chunk ID: {chunk_id}")
 
+    def snapshot(self) -> Mapping[str, Dict[str, Any]]:
+        """
+        最新のマッピング情報を読み込み、チャンクIDからBlob情報への読み取り専用の対応表を返す。
+        検索結果ごとにget_blob_info()を呼び出す代わりに、1回の検索の間はこの対応表を参照する。
+        対応表はコピーせずにメモリ上のマッピングを参照するため、このインスタンスで変更した内容は反映される。
+        """
+        self.refresh()
+        return MappingProxyType(self.__mapping)
+
     def get_blob_info(self, chunk_id: str) -> Optional[Dict[str, str]]:
         """チャンクIDに対応するBlob情報を取得する"""
         return self.__mapping.get(chunk_id)
@@ -104,4 +300,9 @@ class ChunkBlobMapping:
     def get_chunk_ids_by_blob(self, container_name: str, blob_name: str) -> List[str]:
         """指定されたコンテナ名とBlob名に対応するチャンクIDのリストを取得する"""
         key = f"{container_name}:{blob_name}"
-        return self.__reverse_mapping.get(key, [])
\ No newline at end of file
+        return self.__reverse_mapping.get(key, [])
+
+    def get_chunks_by_blob(self, container_name: str, blob_name: str) -> List[Tuple[str, Optional[int]]]:
+        """指定されたコンテナ名とBlob名に対応するチャンクIDとページ番号のリストを取得する（ページ番号が未保存の場合はNone）"""
+        return [(chunk_id, self.__mapping[chunk_id].get("page_number"))
+                for chunk_id in self.get_chunk_ids_by_blob(container_name, blob_name)]
\ No newline at end of file
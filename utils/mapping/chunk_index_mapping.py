@@ -1,16 +1,50 @@
-import json
 import logging
-from typing import Dict, Any, Optional
-from azure.core.exceptions import ResourceNotFoundError
+import time
+from contextlib import contextmanager
+from types import MappingProxyType
+from typing import Callable, Dict, Any, Iterator, List, Mapping, Optional, Tuple, TypeVar
+import orjson
+from azure.core.exceptions import ResourceModifiedError, ResourceNotFoundError
 
-from utils.blobs.blob_manager import BlobManager
+from utils.blobs.blob_manager import AppendBlobSealedError, BlobManager
+from utils.blobs.blob_container_manager import backoff_delay
+from .mapping_log import MappingLog
+
+T = TypeVar("T")
 
 class ChunkIndexMapping:
     """
     チャンクIDと各インデックスのIDをマッピングするクラス。
     
     このクラスは、異なるインデックス間でチャンクIDを関連付けるために使用されます。
-    マッピング情報はAzure Blob StorageのJSONファイルに保存され、永続化されます。
+    マッピング情報はAzure Blob StorageのJSONファイル（スナップショット）と、変更を追記するログ（MappingLog）に保存され、永続化されます。
+    変更のたびにJSONファイル全体を書き直さず、変更内容だけをログに追記します。ログが大きくなるとスナップショットに書き戻します。
+
+    参照系のメソッドはメモリ上のマッピングを返します。他のインスタンスによる更新を反映するには、refresh()を呼び出してください。
+    batch()の中で行った変更はまとめて1回の追記で保存されます。
+    追記は読み込んだ時のログのサイズを条件に行うため、他のインスタンスが先に保存していた場合はResourceModifiedErrorになります。
+    複数のインスタンスから同時に更新する場合は、競合時に読み込み直して再試行するupdate()を使用してください。
+
+    使用方法:
+    ```
+    mapping = ChunkIndexMapping(blob_manager, "db_container")
+
+    # 複数の変更をまとめて保存する
+    with mapping.batch():
+        chunk_id = mapping.get_new_id()
+        mapping.add_mapping(chunk_id, {"keyword": 0, "vector": 0})
+
+    # 他のインスタンスと競合した場合は読み込み直して再試行する
+    new_id = mapping.update(lambda m: m.get_new_id())
+
+    # 最新のマッピングを読み込んでから参照する
+    mapping.refresh()
+    index_ids = mapping.get_index_ids(chunk_id)
+
+    # 多数のIDを引く場合は、最新のマッピングを1回だけ読み込んだスナップショットを使う
+    keyword_ids = mapping.snapshot("keyword")
+    chunk_ids = [keyword_ids.get(index_id) for index_id in [0, 1, 2]]
+    ```
     """
 
     def __init__(self, blob_manager: BlobManager, container_name: str, blob_name: str = "mapping/chunk_index_mapping.json"):
@@ -18,47 +52,211 @@ class ChunkIndexMapping:
         self.__blob_manager = blob_manager
         self.__container_name = container_name
         self.__blob_name = blob_name
+        self.__batch_depth = 0
+        self.__dirty = False
+        self.__reverse_id_map: Dict[str, Dict[Any, str]] = {}  # インデックス名ごとの、インデックスIDからチャンクIDへの逆引き
+        self.__etag: Optional[str] = None  # 最後に読み込んだ（または保存した）スナップショットのETag
+        self.__log = MappingLog(blob_manager, container_name, blob_name)
+        self.__pending: List[Dict[str, Any]] = []  # ログに追記していない変更
+        self.__counter_changed = False  # ログに追記していないカウンターの変更があるかどうか
+        self.__sealed_generation: Optional[int] = None  # 追記しようとしてシールされていたログの世代
         self.__load_from_storage()
 
     def __load_from_storage(self):
-        """BlobストレージからチャンクIDマッピング情報を読み込む"""
+        """
+        BlobストレージからチャンクIDマッピング情報を読み込む。
+        スナップショットに変更がない場合は、前回の読み込み以降にログに追記された変更だけを反映する。
+        """
         try:
-            data = self.__blob_manager.read(self.__container_name, self.__blob_name)
-            if data:
-                json_data = json.loads(data.decode('utf-8'))
-                self.__id_counter = json_data.get('id_counter', 0)
-                self.__id_map = json_data.get('id_map', {})
-            else:
-                self.__id_counter = 0
-                self.__id_map = {}
-                self.__save_to_storage()
+            data, etag = self.__blob_manager.read_if_modified(self.__container_name, self.__blob_name, self.__etag)
+            if data is not None:
+                self.__etag = etag
+                if data:
+                    json_data = orjson.loads(data)  # bytesのままデコードする
+                    self.__reset(json_data.get('id_counter', 0), json_data.get('id_map', {}), json_data.get('log_generation', 0))
+                else:
+                    self.__reset(0, {}, 0)
+                    self.__save_to_storage()
+                self.logger.info(f"Loaded chunk ID mapping from {self.__blob_name}")
         except ResourceNotFoundError:
-            self.__id_counter = 0
-            self.__id_map = {}
+            self.__etag = None
+            self.__reset(0, {}, 0)
             self.__save_to_storage()
-        except json.JSONDecodeError:
+        except orjson.JSONDecodeError:
             self.logger.error("JSONデコードエラーが発生しました。新しいマッピングを初期化します。")
-            self.__id_counter = 0
-            self.__id_map = {}
+            self.__reset(0, {}, 0)
             self.__save_to_storage()
-        self.logger.info(f"Loaded chunk ID mapping from {self.__blob_name}")
+
+        for entry in self.__log.read_new():
+            self.__apply(entry)
+
+        if self.__sealed_generation == self.__log.generation:
+            # ログをシールしたインスタンスがスナップショットへの書き戻しを終えていないため、代わりに書き戻す
+            self.__rotate_log()
+
+    def __reset(self, id_counter: int, id_map: Dict[str, Dict[str, Any]], log_generation: int):
+        """メモリ上のマッピングをスナップショットの内容で置き換える（保存していない変更は破棄する）"""
+        self.__id_counter = id_counter
+        self.__id_map = id_map
+        self.__rebuild_reverse_id_map()
+        self.__log.reset(log_generation)
+        self.__pending = []
+        self.__counter_changed = False
+        self.__dirty = False
+
+    def __apply(self, entry: Dict[str, Any]):
+        """ログに記録された変更をメモリ上のマッピングに反映する"""
+        op = entry.get('op')
+        if op == 'counter':
+            self.__id_counter = max(self.__id_counter, entry['value'])
+        elif op == 'set':
+            self.__set_index_ids(entry['chunk_id'], entry['index_ids'])
+        elif op == 'remove':
+            self.__discard_index_ids(entry['chunk_id'])
+
+    def __rebuild_reverse_id_map(self):
+        """逆引き（インデックスIDからチャンクID）を作り直す"""
+        self.__reverse_id_map = {}
+        for chunk_id, index_ids in self.__id_map.items():
+            for index_name, index_id in index_ids.items():
+                self.__reverse_id_map.setdefault(index_name, {}).setdefault(index_id, chunk_id)
+
+    def __set_index_ids(self, chunk_id: str, index_ids: Dict[str, Any]):
+        """チャンクIDのインデックスIDを設定し、逆引きも合わせて更新する"""
+        self.__discard_index_ids(chunk_id)
+        self.__id_map[chunk_id] = index_ids
+        for index_name, index_id in index_ids.items():
+            self.__reverse_id_map.setdefault(index_name, {})[index_id] = chunk_id
+
+    def __discard_index_ids(self, chunk_id: str):
+        """チャンクIDのインデックスIDを削除し、逆引きからも取り除く"""
+        index_ids = self.__id_map.pop(chunk_id, None)
+        if not index_ids:
+            return
+        for index_name, index_id in index_ids.items():
+            reverse = self.__reverse_id_map.get(index_name)
+            if reverse is not None and reverse.get(index_id) == chunk_id:
+                del reverse[index_id]
 
     def __save_to_storage(self):
-        """チャンクIDマッピング情報をBlobストレージに保存する"""
+        """チャンクIDマッピング情報のスナップショットを、読み込んだ時からBlobが更新されていない場合のみBlobストレージに保存する"""
         data = {
             'id_counter': self.__id_counter,
-            'id_map': self.__id_map
+            'id_map': self.__id_map,
+            'log_generation': self.__log.generation
         }
-        json_data = json.dumps(data).encode('utf-8')
-        self.__blob_manager.upload(self.__container_name, self.__blob_name, json_data)
+        json_data = orjson.dumps(data)
+        self.__etag = self.__blob_manager.upload(self.__container_name, self.__blob_name, json_data, etag=self.__etag)
         self.logger.debug(f"Saved chunk ID mapping to {self.__blob_name}")
 
+    def refresh(self):
+        """Blobストレージから最新のマッピング情報を読み込む（ETagで変更を確認し、変更がある場合のみ転送する）"""
+        self.__load_from_storage()
+
+    def flush(self):
+        """
+        未保存の変更があれば、1回の追記でログに保存する（ログが大きくなった場合はスナップショットに書き戻す）
+        カウンターはIDごとではなく、最終的な値を1件だけ記録する
+        """
+        if not self.__dirty:
+            return
+        entries = self.__pending
+        if self.__counter_changed:
+            entries = entries + [{'op': 'counter', 'value': self.__id_counter}]
+        try:
+            self.__log.append(entries)
+        except Exception as e:
+            if isinstance(e, AppendBlobSealedError):
+                self.__sealed_generation = self.__log.generation
+            # 追記できたかどうか分からないため、次の読み込みでスナップショットから読み込み直す
+            self.__etag = None
+            raise
+        self.__pending = []
+        self.__counter_changed = False
+        self.__dirty = False
+        if self.__log.needs_compaction:
+            self.__compact()
+
+    def __compact(self):
+        """ログをシールしてからスナップショットに書き戻し、次の世代のログに切り替える"""
+        try:
+            self.__log.seal()
+        except ResourceModifiedError:
+            return  # 他のインスタンスが追記していたため、次の保存時に改めて行う
+        self.__rotate_log()
+
+    def __rotate_log(self):
+        """
+        シールされたログまでの内容をスナップショットに書き戻し、次の世代のログに切り替える。
+        他のインスタンスが先に書き戻していた場合は、次の読み込みでスナップショットから読み込み直す。
+        シールされたログは、古いスナップショットを読み込んだインスタンスの追記を拒否するために残しておく。
+        """
+        self.__log.reset(self.__log.generation + 1)
+        try:
+            self.__save_to_storage()
+        except ResourceModifiedError:
+            self.logger.info(f"{self.__blob_name} was compacted by another writer.")
+            self.__etag = None
+            return
+        self.__sealed_generation = None
+        self.logger.info(f"Compacted chunk ID mapping log into {self.__blob_name} (log generation {self.__log.generation})")
+
+    @contextmanager
+    def batch(self) -> Iterator["ChunkIndexMapping"]:
+        """
+        複数の変更をまとめて保存するコンテキストマネージャー。
+        開始時に最新のマッピング情報を読み込み、ブロック内では変更ごとの読み込みと保存を行わず、終了時に1回だけ保存します。
+        他のインスタンスが先に保存していた場合は終了時にResourceModifiedErrorが発生するため、再試行が必要な場合はupdate()を使用してください。
+        """
+        if self.__batch_depth == 0:
+            self.__load_from_storage()  # 最新の値を読み込む
+        self.__batch_depth += 1
+        try:
+            yield self
+        finally:
+            self.__batch_depth -= 1
+            if self.__batch_depth == 0:
+                self.flush()
+
+    def update(self, func: Callable[["ChunkIndexMapping"], T], max_retries: int = 5) -> T:
+        """
+        最新のマッピング情報を読み込んでfuncで変更し、読み込んだ時からログに追記されていない場合のみ保存する（楽観的同時実行制御）。
+        他のインスタンスが先に保存していた場合は、最新のマッピング情報を読み込み直してfuncを再実行する。
+        リースを取得しないため、同時に更新するインスタンスがいない場合の通信は読み込みと追記の数回で済む。
+
+        :param func: このインスタンスを受け取ってマッピングを変更する関数。再試行時に再度呼び出されるため、マッピング以外の副作用を持たないこと
+        :param max_retries: 最大試行回数
+        :return: funcの戻り値
+        """
+        for attempt in range(max_retries):
+            try:
+                with self.batch():
+                    return func(self)
+            except ResourceModifiedError:
+                if attempt == max_retries - 1:
+                    self.logger.error(f"Failed to update {self.__blob_name} after {max_retries} attempts due to concurrent updates")
+                    raise
+                self.logger.info(f"{self.__blob_name} was updated by another writer. Attempt {attempt + 1}/{max_retries}. Retrying.")
+                time.sleep(backoff_delay(0.1, attempt))
+
+    def __begin_update(self):
+        """変更の前に最新の値を読み込む（バッチ中は読み込み済みのため省略する）"""
+        if self.__batch_depth == 0:
+            self.__load_from_storage()
+
+    def __end_update(self):
+        """変更を保存する（バッチ中は終了時にまとめて保存する）"""
+        self.__dirty = True
+        if self.__batch_depth == 0:
+            self.flush()
+
     def get_new_id(self) -> str:
         """新しいチャンクIDを生成し、カウンターをインクリメントします。"""
-        self.__load_from_storage()  # 最新の値を読み込む
+        self.__begin_update()  # 最新の値を読み込む
         new_id = str(self.__id_counter)
         self.__id_counter += 1  # カウンターをインクリメント
-        self.__save_to_storage()  # 更新された値を保存
+        self.__counter_changed = True  # ログにはflush()で最終的な値を1件だけ記録する
+        self.__end_update()  # 更新された値を保存
         return new_id
 
     def add_mapping(self, chunk_id: str, index_ids: Dict[str, Any]):
@@ -68,28 +266,47 @@ class ChunkIndexMapping:
         :param chunk_id: 追加するチャンクID
         :param index_ids: インデックスIDのディクショナリ
         """
-        self.__load_from_storage()  # 最新の値を読み込む
-        self.__id_map[chunk_id] = index_ids
-        self.__save_to_storage()  # 更新された値を保存
+        self.__begin_update()  # 最新の値を読み込む
+        self.__set_index_ids(chunk_id, index_ids)
+        self.__pending.append({'op': 'set', 'chunk_id': chunk_id, 'index_ids': index_ids})
+        self.__end_update()  # 更新された値を保存
         self.logger.debug(f"Added mapping for chunk ID: {chunk_id}")
 
+    def add_mappings(self, items: List[Tuple[str, Dict[str, Any]]]):
+        """
+        複数のチャンクIDとインデックスIDのマッピングをまとめて追加し、1回だけ保存します。
+
+        :param items: チャンクIDとインデックスIDのディクショナリのタプルのリスト
+        """
+        with self.batch():
+            for chunk_id, index_ids in items:
+                self.__set_index_ids(chunk_id, index_ids)
+                self.__pending.append({'op': 'set', 'chunk_id': chunk_id, 'index_ids': index_ids})
+            self.__dirty = True
+        self.logger.debug(f"Added mappings for {len(items)} chunk IDs")
+
     def remove_mapping(self, chunk_id: str):
         """指定されたチャンクIDのマッピングを削除する"""
-        self.__load_from_storage()  # 最新の値を読み込む
+        self.__begin_update()  # 最新の値を読み込む
         if chunk_id in self.__id_map:
-            del self.__id_map[chunk_id]
-            self.__save_to_storage()  # 更新された値を保存
+            self.__discard_index_ids(chunk_id)
+            self.__pending.append({'op': 'remove', 'chunk_id': chunk_id})
+            self.__end_update()  # 更新された値を保存
             self.logger.debug(f"Removed mapping for chunk ID: {chunk_id}")
             
+    def snapshot(self, index_name: str) -> Mapping[Any, str]:
+        """
+        最新のマッピング情報を読み込み、特定のインデックスのIDからチャンクIDへの読み取り専用の対応表を返す。
+        検索結果ごとにget_chunk_id()を呼び出す代わりに、1回の検索の間はこの対応表を参照する。
+        対応表はコピーせずにメモリ上のマッピングを参照するため、このインスタンスで変更した内容は反映される。
+        """
+        self.refresh()
+        return MappingProxyType(self.__reverse_id_map.setdefault(index_name, {}))
+
     def get_chunk_id(self, index_name: str, index_id: Any) -> Optional[str]:
         """特定のインデックスのIDに対応するチャンクIDを取得する"""
-        self.__load_from_storage()  # 最新の値を読み込む
-        for chunk_id, index_ids in self.__id_map.items():
-            if index_ids.get(index_name) == index_id:
-                return chunk_id
-        return None
+        return self.__reverse_id_map.get(index_name, {}).get(index_id)
     
     def get_index_ids(self, chunk_id: str) -> Optional[Dict[str, Any]]:
         """指定されたチャンクIDに対応するインデックスIDのマッピングを取得する"""
-        self.__load_from_storage()  # 最新の値を読み込む
         return self.__id_map.get(chunk_id)
\ No newline at end of file
@@ -1,10 +1,13 @@
 import logging
-from typing import Dict, Any, List, Tuple, Optional
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Any, List, Tuple, Optional, Union
 
 from .chunk_index_mapping import ChunkIndexMapping
 from .chunk_blob_mapping import ChunkBlobMapping
 from utils.blobs.blob_manager import BlobManager
 from utils.blobs.blob_container_manager import BlobContainerManager
+from utils.embedding_cache import EmbeddingCache
 from utils.searchers.keyword_search import KeywordSearch
 from utils.searchers.vector_search import VectorSearch
 
@@ -44,7 +47,13 @@ class ChunkMappingManager:
                  chunk_blob_mapping_file: str = "mapping/chunk_blob_mapping.json"):
         self.logger = logging.getLogger(__name__)
         self.__blob_manager = blob_manager
-        self.__searchers = searchers
+        # 追加と削除のたびにディクショナリのビューを作らないよう、インデックス名とマネージャーの組は順序を固定したタプルで保持する
+        self.__searcher_items: Tuple[Tuple[str, Any], ...] = tuple(searchers.items())
+        # 各インデックスへの追加と保存（Blobへのアップロード）は互いに独立しているため、インデックスごとに並列に実行する
+        self.__executor = ThreadPoolExecutor(max_workers=max(len(searchers), 1), thread_name_prefix="searcher")
+        # インデックスはメモリ上で共有されるため、同じプロセス内での追加と削除は直列に行う
+        # マッピングファイルはリースを取得せず、ETagによる楽観的同時実行制御で他のプロセスとの競合を検出する
+        self.__lock = threading.RLock()
         self.chunk_id_mapping_manager = ChunkIndexMapping(blob_manager, db_container, chunk_index_mapping_file)
         self.chunk_blob_mapping_manager = ChunkBlobMapping(blob_manager, db_container, chunk_blob_mapping_file)
         self.chunk_index_mapping_file = chunk_index_mapping_file
@@ -53,72 +62,113 @@ class ChunkMappingManager:
         self.container_manager = self.__blob_manager.container_manager
         self.logger.info("ChunkManager initialized")
 
-    def add(self, blob_container: str, blob_name: str, texts: List[str]) -> List[Tuple[str, str]]:
+    def __map_searchers(self, func: Callable[[Any], Any]) -> Dict[str, Any]:
+        """
+        全てのインデックスマネージャーに対して関数を並列に実行し、インデックス名ごとの結果を返す
+        いずれかの実行で例外が発生した場合は、全ての実行の完了を待ってから送出する
+
+        :param func: インデックスマネージャーを受け取る関数
+        :return: インデックス名と関数の戻り値のディクショナリ
+        """
+        futures = {index_name: self.__executor.submit(func, index_manager) for index_name, index_manager in self.__searcher_items}
+        errors = [future.exception() for future in futures.values()]
+        for error in errors:
+            if error is not None:
+                raise error
+        return {index_name: future.result() for index_name, future in futures.items()}
+
+    def add(self, blob_container: str, blob_name: str, texts: List[str],
+            page_numbers: Optional[List[int]] = None,
+            chunk_locations: Optional[List[List[int]]] = None,
+            lookup_embedding_cache: bool = True) -> List[Tuple[str, str]]:
         """
         複数のチャンクを全てのインデックスに追加し、Blobとの対応関係を保存する
+        各インデックスにはチャンクを1件ずつではなくまとめて追加するため、インデックスの保存と埋め込みの呼び出しはインデックスごとに1回になる
+        マッピングファイルはETagを条件に保存し、他のプロセスと競合した場合は読み込み直して再試行する
         
         :param texts: 追加するチャンクのテキストのリスト
         :param blob_container: チャンクが属するBlobのコンテナ名
         :param blob_name: チャンクが属するBlobの名前
+        :param page_numbers: 各チャンクのページ番号のリスト（省略可能）。削除時にチャンクを読み込まずにページを特定するために保存する
+        :param chunk_locations: 各チャンクのJSONのChunkStoreでの位置のリスト（省略可能）。検索時にパックから範囲を指定して読み込むために保存する
+        :param lookup_embedding_cache: ドキュメントの埋め込みのキャッシュを読み込むかどうか。一度もインデックスしていないドキュメントではFalseを指定する
         :return: 生成されたチャンクIDとテキストのタプルのリスト
         """
-        index_lease_id = None
-        blob_lease_id = None
-        try:
-            _, index_lease_id = self.container_manager.acquire_lease(self.db_container, self.chunk_index_mapping_file)
-            _, blob_lease_id = self.container_manager.acquire_lease(self.db_container, self.chunk_blob_mapping_file)
-
-            added_chunks = []
-            for text in texts:
-                chunk_id = self.chunk_id_mapping_manager.get_new_id()
-                index_ids = {}
-                for index_name, index_manager in self.__searchers.items():
-                    index_id = index_manager.add(text)[0]
-                    index_ids[index_name] = index_id
-                self.chunk_id_mapping_manager.add_mapping(chunk_id, index_ids)
-                self.chunk_blob_mapping_manager.add_mapping(chunk_id, blob_container, blob_name)
-                self.logger.info(f"Chunk added. Chunk ID: {chunk_id}")
-                added_chunks.append((chunk_id, text))
-            
-            return added_chunks
-
-        finally:
-            if index_lease_id:
-                self.container_manager.release_lease(self.db_container, self.chunk_index_mapping_file)
-            if blob_lease_id:
-                self.container_manager.release_lease(self.db_container, self.chunk_blob_mapping_file)
-
-    def remove(self, chunk_id: str):
+        if not texts:
+            return []
+        if page_numbers is None:
+            page_numbers = [None] * len(texts)
+        if chunk_locations is None:
+            chunk_locations = [None] * len(texts)
+
+        with self.__lock:
+            # 各インデックスには全てのテキストを1回で追加し、保存は最後に1回だけ行う
+            # インデックスへの追加は再試行しないよう、マッピングの更新の前に済ませる
+            # ベクトル検索には、埋め込みのキャッシュをドキュメント単位で読み書きするためのキーを渡す
+            document_key = EmbeddingCache.make_document_key(blob_container, blob_name)
+
+            def add_to_index(index_manager: Any) -> List[Any]:
+                if isinstance(index_manager, VectorSearch):
+                    return index_manager.add(texts, autosave=False, document_key=document_key, lookup_cache=lookup_embedding_cache)
+                return index_manager.add(texts, autosave=False)
+
+            searcher_ids = self.__map_searchers(add_to_index)
+            self.__map_searchers(lambda index_manager: index_manager.flush())
+
+            searcher_id_items = tuple(searcher_ids.items())
+
+            def add_index_mappings(mapping: ChunkIndexMapping) -> List[str]:
+                chunk_ids = [mapping.get_new_id() for _ in texts]
+                mapping.add_mappings([
+                    (chunk_id, {index_name: ids[i] for index_name, ids in searcher_id_items})
+                    for i, chunk_id in enumerate(chunk_ids)
+                ])
+                return chunk_ids
+
+            chunk_ids = self.chunk_id_mapping_manager.update(add_index_mappings)
+            self.chunk_blob_mapping_manager.update(lambda mapping: mapping.add_mappings([
+                (chunk_id, blob_container, blob_name, page_number, chunk_location)
+                for chunk_id, page_number, chunk_location in zip(chunk_ids, page_numbers, chunk_locations)
+            ]))
+            self.logger.info(f"{len(chunk_ids)} chunks added. Chunk IDs: {chunk_ids}")
+
+        return list(zip(chunk_ids, texts))
+
+    def remove(self, chunk_ids: Union[str, List[str]]):
         """
         指定されたチャンクIDのチャンクを全てのインデックスから削除し、Blob対応も削除する
         インデックスが初期化されていない場合や削除に失敗した場合でも、マッピング情報は削除する
+        複数のチャンクIDを渡した場合、各インデックスとマッピングの保存は最後に1回ずつ行う
         
-        :param chunk_id: 削除するチャンクのチャンクID
+        :param chunk_ids: 削除するチャンクのチャンクID、またはチャンクIDのリスト
         """
-        index_lease_id = None
-        blob_lease_id = None
-        try:
-            _, index_lease_id = self.container_manager.acquire_lease(self.db_container, self.chunk_index_mapping_file)
-            _, blob_lease_id = self.container_manager.acquire_lease(self.db_container, self.chunk_blob_mapping_file)
-
-            index_ids = self.chunk_id_mapping_manager.get_index_ids(chunk_id)
-            if index_ids:
-                for index_name, index_manager in self.__searchers.items():
+        if isinstance(chunk_ids, str):
+            chunk_ids = [chunk_ids]
+
+        with self.__lock:
+            self.chunk_id_mapping_manager.refresh()  # 最新の値を読み込む
+            get_index_ids = self.chunk_id_mapping_manager.get_index_ids
+            searcher_items = self.__searcher_items
+            for chunk_id in chunk_ids:
+                index_ids = get_index_ids(chunk_id)
+                if not index_ids:
+                    self.logger.warning(f"Chunk with ID: {chunk_id} not found")
+                    continue
+                for index_name, index_manager in searcher_items:
                     if index_name in index_ids:
                         try:
-                            index_manager.remove(index_ids[index_name])
+                            index_manager.remove(index_ids[index_name], autosave=False)
                         except Exception as e:
                             self.logger.warning(f"Error occurred while removing chunk ID {chunk_id} from index {index_name}: {e}")
-            else:
-                self.logger.warning(f"Chunk with ID: {chunk_id} not found")
+
+            # インデックスは全てのチャンクを削除してから1回だけ保存する
+            self.__map_searchers(lambda index_manager: index_manager.flush())
 
             # マッピング情報は常に削除する
-            self.chunk_id_mapping_manager.remove_mapping(chunk_id)
-            self.chunk_blob_mapping_manager.remove_mapping(chunk_id)
-            self.logger.info(f"Chunk with ID: {chunk_id} has been removed")
-
-        finally:
-            if index_lease_id:
-                self.container_manager.release_lease(self.db_container, self.chunk_index_mapping_file)
-            if blob_lease_id:
-                self.container_manager.release_lease(self.db_container, self.chunk_blob_mapping_file)
\ No newline at end of file
+            def remove_mappings(mapping: Union[ChunkIndexMapping, ChunkBlobMapping]):
+                for chunk_id in chunk_ids:
+                    mapping.remove_mapping(chunk_id)
+
+            self.chunk_id_mapping_manager.update(remove_mappings)
+            self.chunk_blob_mapping_manager.update(remove_mappings)
+            self.logger.info(f"Chunks with IDs: {chunk_ids} have been removed")
\ No newline at end of file
@@ -0,0 +1,83 @@
+import logging
+from typing import Any, Dict, List
+
+import orjson
+from azure.core.exceptions import ResourceNotFoundError
+
+from utils.blobs.blob_manager import BlobManager
+
+class MappingLog:
+    """
+    マッピングファイルへの変更をJSON Lines形式で追記するログ。
+
+    マッピングファイル（スナップショット）を変更のたびに書き直す代わりに、変更内容だけをAppend Blobに1回のリクエストで追記します。
+    ログは世代ごとに "<スナップショットのBlob名>.log.<世代>" というBlobに保存され、スナップショットには対応するログの世代が記録されます。
+    ログが大きくなったら、ログをシールしてからスナップショットに書き戻し、次の世代のログに切り替えます（compact）。
+    シールされたログへの追記はAppendBlobSealedErrorになるため、古いスナップショットを読み込んだインスタンスの変更が失われることはありません。
+
+    Attributes:
+        generation (int): 現在のログの世代
+        position (int): 読み込み済み（または追記済み）のログのサイズ（バイト）
+        num_entries (int): 読み込み済み（または追記済み）のログの行数
+    """
+
+    # ログがこのサイズを超えたら、スナップショットに書き戻して次の世代に切り替える
+    COMPACT_THRESHOLD_BYTES = 4 * 1024 * 1024
+    # Append Blobのブロック数の上限（50,000）に達しないよう、ログがこの行数を超えた場合も切り替える
+    COMPACT_THRESHOLD_ENTRIES = 10000
+
+    def __init__(self, blob_manager: BlobManager, container_name: str, snapshot_blob_name: str):
+        self.logger = logging.getLogger(__name__)
+        self.__blob_manager = blob_manager
+        self.__container_name = container_name
+        self.__snapshot_blob_name = snapshot_blob_name
+        self.generation = 0
+        self.position = 0
+        self.num_entries = 0
+
+    def blob_name(self, generation: int) -> str:
+        """指定された世代のログのBlob名を返す"""
+        return f"{self.__snapshot_blob_name}.log.{generation}"
+
+    def reset(self, generation: int):
+        """指定された世代のログを先頭から読み込むように状態を戻す"""
+        self.generation = generation
+        self.position = 0
+        self.num_entries = 0
+
+    def read_new(self) -> List[Dict[str, Any]]:
+        """前回の読み込み以降に追記された変更を読み込む"""
+        try:
+            data = self.__blob_manager.read_from(self.__container_name, self.blob_name(self.generation), self.position)
+        except ResourceNotFoundError:
+            return []  # まだ追記されていない
+        self.position += len(data)
+        entries = [orjson.loads(line) for line in data.splitlines() if line]
+        self.num_entries += len(entries)
+        return entries
+
+    def append(self, entries: List[Dict[str, Any]]):
+        """
+        変更を1回のリクエストで追記する。
+        読み込んでから他のインスタンスが追記していた場合はResourceModifiedErrorが、
+        ログが次の世代に切り替えられていた場合はAppendBlobSealedErrorが発生する。
+        """
+        if not entries:
+            return
+        data = b"".join(orjson.dumps(entry) + b"\n" for entry in entries)
+        self.position = self.__blob_manager.append(self.__container_name, self.blob_name(self.generation), data,
+                                                   append_position=self.position)
+        self.num_entries += len(entries)
+
+    @property
+    def needs_compaction(self) -> bool:
+        """ログをスナップショットに書き戻すべき大きさになっているかどうか"""
+        return self.position >= self.COMPACT_THRESHOLD_BYTES or self.num_entries >= self.COMPACT_THRESHOLD_ENTRIES
+
+    def seal(self):
+        """
+        現在の世代のログをシールし、以降の追記を禁止する。
+        読み込んでから他のインスタンスが追記していた場合はResourceModifiedErrorが発生する。
+        """
+        self.__blob_manager.seal(self.__container_name, self.blob_name(self.generation), append_position=self.position)
+        self.logger.info(f"Sealed mapping log {self.blob_name(self.generation)} at {self.position} bytes")
\ No newline at end of file
@@ -1,10 +1,14 @@
+import asyncio
 import logging
-import json
-from typing import Any, List, Dict, Optional, Union
+import os
+import tempfile
+from typing import Any, List, Dict, Optional, Tuple, Union
 
 from azure.core.exceptions import ResourceNotFoundError
 
+from ..blobs.async_blob_manager import AsyncBlobManager
 from ..blobs.blob_manager import BlobManager
+from ..chunk_store import ChunkStore
 from ..indexes.bm25_index_manager import BM25IndexManager
 from ..mapping.chunk_blob_mapping import ChunkBlobMapping
 from ..mapping.chunk_index_mapping import ChunkIndexMapping
@@ -39,37 +43,46 @@ class KeywordSearch:
         keyword_search (BM25IndexManager): キーワードインデックスを管理するオブジェクト
     """
 
+    # インデックスのアップロード時にブロックを並列に送る数（大きいインデックスほど効果があり、並列数分のブロックのバッファを使用する）
+    UPLOAD_MAX_CONCURRENCY = 8
+
     def __init__(self, blob_manager: BlobManager, container_name: str, blob_name: str, 
                  chunk_blob_mapping_name: str = "mapping/chunk_blob_mapping.json", 
                  chunk_index_mapping_name: str = "mapping/chunk_index_mapping.json", 
+                 chunk_cache_dir: Optional[str] = None,
                  **kwargs):
         self.logger = logging.getLogger(__name__)
         self.blob_manager = blob_manager
         self.container_name = container_name
         self.blob_name = blob_name
         self.keyword_index = self.__load_or_create_index(self.blob_manager, self.container_name, self.blob_name, **kwargs)
+        self.__dirty = False  # 保存していない変更があるかどうか
         self.chunk_blob_mapping = ChunkBlobMapping(blob_manager, container_name, chunk_blob_mapping_name)
         self.chunk_index_mapping = ChunkIndexMapping(blob_manager, container_name, chunk_index_mapping_name)
+        # チャンクのJSONは書き込み後に変更されないため、読み込んだ内容をキャッシュする（chunk_cache_dirを指定した場合はディスクにも保存する）
+        self.chunk_store = ChunkStore(blob_manager, container_name, cache_dir=chunk_cache_dir)
 
     def __load_or_create_index(self, blob_manager: BlobManager, container_name: str, blob_name: str, **kwargs):
         try:
-            index_data = blob_manager.read(container_name, blob_name, as_byte=True)
-            if index_data:
-                return BM25IndexManager.load_from_byte(index_data)
-            else:
-                self.logger.warning(f"Blob '{blob_name}' in container '{container_name}' is empty. Creating new index.")
-                return BM25IndexManager(**kwargs)
+            # インデックスはバイトデータとしてメモリに読み込まず、一時ファイルにダウンロードしてから読み込む
+            with tempfile.TemporaryDirectory() as temp_dir:
+                index_path = os.path.join(temp_dir, 'keyword_index')
+                if blob_manager.download_to_file(container_name, blob_name, index_path):
+                    return BM25IndexManager.load_from_file(index_path)
+            self.logger.warning(f"Blob '{blob_name}' in container '{container_name}' is empty. Creating new index.")
+            return BM25IndexManager(**kwargs)
         except ResourceNotFoundError:
             self.logger.warning(f"Blob '{blob_name}' not found in container '{container_name}'. Creating new index.")
             return BM25IndexManager(**kwargs)
 
-    def add(self, texts: List[str], ids: Optional[List[Any]] = None) -> List[Any]:
+    def add(self, texts: List[str], ids: Optional[List[Any]] = None, autosave: bool = True) -> List[Any]:
         """
-        キーワードインデックスに新しい文書を追加します。追加後、自動的に保存します。
+        キーワードインデックスに新しい文書を追加します。autosaveがTrueの場合は、追加後に自動的に保存します。
 
         引数:
             texts (List[str]): 追加する文書のリスト
             ids (Optional[List[Any]]): テキストに対応するIDのリスト（省略可能）
+            autosave (bool): 追加後に保存するかどうか。Falseの場合はflush()を呼び出すまで保存しません。
 
         戻り値:
             List[Any]: 追加された文書のID
@@ -79,34 +92,36 @@ class KeywordSearch:
         else:
             added_ids = self.keyword_index.add(texts, ids)
         
-        self.__save()
+        self.__mark_dirty(autosave)
         return added_ids
 
-    def remove(self, ids: Union[int, List[int]]):
+    def remove(self, ids: Union[int, List[int]], autosave: bool = True):
         """
         指定されたIDの文書をインデックスから削除します。
 
         引数:
             ids (Union[int, List[int]]): 削除する文書のIDまたはIDのリスト
+            autosave (bool): 削除後に保存するかどうか。Falseの場合はflush()を呼び出すまで保存しません。
 
         戻り値:
             None
         """
         self.keyword_index.remove(ids)
-        self.__save()
+        self.__mark_dirty(autosave)
         
-    def restore(self, ids: Union[int, List[int]]):
+    def restore(self, ids: Union[int, List[int]], autosave: bool = True):
         """
         指定されたIDの文書を復元します。
 
         引数:
             ids (Union[int, List[int]]): 復元する文書のIDまたはIDのリスト
+            autosave (bool): 復元後に保存するかどうか。Falseの場合はflush()を呼び出すまで保存しません。
 
         戻り値:
             None
         """
         self.keyword_index.unmark_deleted(ids)
-        self.__save()
+        self.__mark_dirty(autosave)
         self.logger.info(f"Documents {ids} have been restored.")
 
     def search(self, query: str, k: int = 5) -> List[Dict[str, Any]]:
@@ -126,35 +141,83 @@ class KeywordSearch:
                 'full_text': str  # 全文のテキスト
             }
         """
+        hits = self.__find_hits(query, k)
+
+        # チャンクは結果ごとに順番に読み込まず、キャッシュにないものだけをパックの範囲を指定してまとめて並列に読み込む
+        chunk_contents = self.chunk_store.read_many([(chunk_id, blob_info.get('chunk')) for _, _, chunk_id, blob_info in hits])
+        return self.__build_results(hits, chunk_contents)
+
+    async def asearch(self, query: str, k: int = 5, async_blob_manager: Optional[AsyncBlobManager] = None) -> List[Dict[str, Any]]:
+        """
+        searchの非同期版です。キャッシュにないチャンクを、async_blob_managerを指定した場合はスレッドを使わずに
+        asyncio.gatherで並行に読み込みます。キーワードインデックスの検索とマッピングの読み込みはスレッドで実行します。
+
+        引数:
+            query (str): 検索クエリ
+            k (int): 返す結果の数
+            async_blob_manager (Optional[AsyncBlobManager]): チャンクの読み込みに使用するオープン済みのAsyncBlobManager。
+                Noneの場合はBlobManagerでの読み込みをスレッドで実行します。
+
+        戻り値:
+            List[Dict[str, Any]]: 検索結果のリスト。形式はsearchと同じです。
+        """
+        hits = await asyncio.to_thread(self.__find_hits, query, k)
+        chunk_contents = await self.chunk_store.aread_many([(chunk_id, blob_info.get('chunk')) for _, _, chunk_id, blob_info in hits],
+                                                           async_blob_manager)
+        return self.__build_results(hits, chunk_contents)
+
+    def __find_hits(self, query: str, k: int) -> List[Tuple[Any, Any, str, Dict[str, Any]]]:
+        """
+        キーワードインデックスを検索し、(ドキュメントID, スコア, チャンクID, Blob情報)のリストを返します。
+        """
         keyword_ids, keyword_scores = self.keyword_index.search(query, k=k)
-        
-        results = []
-        for doc_id, score in zip(keyword_ids, keyword_scores):
-            chunk_id = self.chunk_index_mapping.get_chunk_id('keyword', doc_id)
-            if chunk_id:
-                chunk_data = json.loads(self.blob_manager.read(self.container_name, f'chunks/chunk_{chunk_id}.json'))
-                chunk_text = chunk_data.get('text', '')
-                blob_info = self.chunk_blob_mapping.get_blob_info(chunk_id)
-                document_name = blob_info.get('blob', 'ファイルが見つかりません') if blob_info else 'ファイルが見つかりません'
-                page_number = chunk_data.get('page_number', '')
-                
-                results.append({
-                    'id': int(doc_id), 
-                    'score': float(score),  
-                    'chunk': chunk_text,
-                    'document_name': document_name,
-                    'page_number': int(page_number) if page_number else '',  
-                })
-        
-        return results
+
+        # 他のインスタンスによる追加や削除を反映するため、マッピングは結果ごとではなく検索ごとに1回だけ読み込む
+        index_ids = self.chunk_index_mapping.snapshot('keyword')
+        blob_infos = self.chunk_blob_mapping.snapshot()
+
+        return [(doc_id, score, chunk_id, blob_infos.get(chunk_id) or {}) for doc_id, score in zip(keyword_ids, keyword_scores)
+                if (chunk_id := index_ids.get(doc_id))]
+
+    @staticmethod
+    def __build_results(hits: List[Tuple[Any, Any, str, Dict[str, Any]]], chunk_contents: Dict[str, bytes]) -> List[Dict[str, Any]]:
+        """
+        検索結果とチャンクのレコードから、searchの戻り値の形式の結果を作成します。
+        """
+        decode = ChunkStore.decode_chunk
+        chunks = [(doc_id, score, *decode(chunk_contents[chunk_id]), blob_info) for doc_id, score, chunk_id, blob_info in hits]
+
+        return [{
+            'id': int(doc_id),
+            'score': float(score),
+            'chunk': text,
+            'document_name': blob_info.get('blob', 'ファイルが見つかりません'),
+            'page_number': int(page_number) if page_number else '',
+        } for doc_id, score, text, page_number, blob_info in chunks]
     
+    def flush(self):
+        """
+        保存していない変更がある場合、キーワードインデックスをBlobストレージに保存します。
+        """
+        if self.__dirty:
+            self.__save()
+
+    def __mark_dirty(self, autosave: bool):
+        """
+        変更があったことを記録し、autosaveがTrueの場合はすぐに保存します。
+        """
+        self.__dirty = True
+        if autosave:
+            self.__save()
+
     def __save(self):
         """
         キーワードインデックスをBlobストレージに保存します。
         """
         try:
             index_data = self.keyword_index.export()
-            self.blob_manager.upload(self.container_name, self.blob_name, index_data)
+            self.blob_manager.upload(self.container_name, self.blob_name, index_data, max_concurrency=self.UPLOAD_MAX_CONCURRENCY)
+            self.__dirty = False
             self.logger.info(f"Index saved to '{self.container_name}/{self.blob_name}'.")
         except Exception as e:
             self.logger.error(f"Error occurred while saving index: {str(e)}")
@@ -1,10 +1,16 @@
+import asyncio
 import logging
-import json
-from typing import Any, List, Dict, Optional, Union
+import os
+import tempfile
+from typing import Any, List, Dict, Optional, Tuple, Union
 
+import numpy as np
 from azure.core.exceptions import ResourceNotFoundError
 
 from ..azure_embedder import AzureEmbedder
+from ..chunk_store import ChunkStore
+from ..compression import compress
+from ..blobs.async_blob_manager import AsyncBlobManager
 from ..blobs.blob_manager import BlobManager
 from ..indexes.voyager_index_manager import VoyagerIndexManager
 from ..mapping.chunk_blob_mapping import ChunkBlobMapping
@@ -42,72 +48,96 @@ class VectorSearch:
         print(f"全文: {result['full_text'][:100]}...")  # 全文の最初の100文字を表示
     """
 
+    # インデックスのアップロード時にブロックを並列に送る数（大きいインデックスほど効果があり、並列数分のブロックのバッファを使用する）
+    UPLOAD_MAX_CONCURRENCY = 8
+
     def __init__(self, blob_manager: BlobManager, embedding: AzureEmbedder, container_name: str, blob_name: str, 
                  chunk_blob_mapping_name: str = "mapping/chunk_blob_mapping.json", 
                  chunk_index_mapping_name: str = "mapping/chunk_index_mapping.json", 
+                 chunk_cache_dir: Optional[str] = None,
+                 storage_data_type: str = 'float32',
                  **kwargs):
         self.logger = logging.getLogger(__name__)
         self.blob_manager = blob_manager
         self.container_name = container_name
         self.blob_name = blob_name
-        self.vector_index = self.__load_or_create_index(self.blob_manager, self.container_name, self.blob_name, **kwargs)
+        # 埋め込みは正規化して追加するため、storage_data_typeに'float8'や'e4m3'を指定すると新しく作成するインデックスを8ビット形式で保持できる
+        # （量子化によりスコアと順位が変わるため、デフォルトは'float32'。既存のインデックスを読み込む場合は、保存時の形式が使われる）
+        self.vector_index = self.__load_or_create_index(self.blob_manager, self.container_name, self.blob_name,
+                                                        storage_data_type=storage_data_type, **kwargs)
         self.embedding = embedding
+        self.__dirty = False  # 保存していない変更があるかどうか
         self.chunk_blob_mapping = ChunkBlobMapping(blob_manager, container_name, chunk_blob_mapping_name)
         self.chunk_index_mapping = ChunkIndexMapping(blob_manager, container_name, chunk_index_mapping_name)
+        # チャンクのJSONは書き込み後に変更されないため、読み込んだ内容をキャッシュする（chunk_cache_dirを指定した場合はディスクにも保存する）
+        self.chunk_store = ChunkStore(blob_manager, container_name, cache_dir=chunk_cache_dir)
 
     def __load_or_create_index(self, blob_manager: BlobManager, container_name: str, blob_name: str, **kwargs):
         try:
-            index_data = blob_manager.read(container_name, blob_name, as_byte=True)
-            return VoyagerIndexManager.load_from_byte(index_data)
+            # インデックスはバイトデータとしてメモリに読み込まず、一時ファイルにダウンロードしてから読み込む
+            # zstdで圧縮して保存されている（圧縮前の形式で保存されたインデックスはそのまま読み込む）
+            with tempfile.TemporaryDirectory() as temp_dir:
+                index_path = os.path.join(temp_dir, 'vector_index')
+                blob_manager.download_to_file(container_name, blob_name, index_path)
+                return VoyagerIndexManager.load_from_file(index_path)
         except ResourceNotFoundError:
             self.logger.warning(f"Blob '{blob_name}' not found in container '{container_name}'. Creating new index.")
             return VoyagerIndexManager(**kwargs)
 
-    def add(self, texts: List[str], ids: Optional[List[Any]] = None) -> List[Any]:
+    def add(self, texts: List[str], ids: Optional[List[Any]] = None, autosave: bool = True,
+            document_key: Optional[str] = None, lookup_cache: bool = True) -> List[Any]:
         """
-        テキストをベクトル化し、インデックスに追加します。追加後、自動的に保存します。
+        テキストをまとめてベクトル化し、インデックスに追加します。autosaveがTrueの場合は、追加後に自動的に保存します。
 
         引数:
             texts (List[str]): 追加するテキストのリスト
             ids (Optional[List[Any]]): テキストに対応するIDのリスト（省略可能）
+            autosave (bool): 追加後に保存するかどうか。Falseの場合はflush()を呼び出すまで保存しません。
+            document_key (Optional[str]): 埋め込みのキャッシュに使用するドキュメントのキー（省略可能）。AzureEmbedder.embed_batchに渡します。
+            lookup_cache (bool): 埋め込みのキャッシュを読み込むかどうか。AzureEmbedder.embed_batchに渡します。
 
         戻り値:
             List[Any]: 追加されたテキストのID
         """
-        embeddings = self.embedding.embed_single(texts)
+        if isinstance(texts, str):
+            texts = [texts]
+        # 埋め込みはテキストごとではなく、バッチ単位でまとめて取得する
+        embeddings = self.__normalize(self.embedding.embed_batch(texts, document_key=document_key, lookup_cache=lookup_cache))
         if ids is None:
             added_ids = self.vector_index.add(embeddings)
         else:
             added_ids = self.vector_index.add(embeddings, ids)
         
-        self.__save()
+        self.__mark_dirty(autosave)
         return added_ids
 
-    def remove(self, ids: Union[int, List[int]]):
+    def remove(self, ids: Union[int, List[int]], autosave: bool = True):
         """
         指定されたIDのベクトルをインデックスから削除します。
 
         引数:
             ids (Union[int, List[int]]): 削除するベクトルのIDまたはIDのリスト
+            autosave (bool): 削除後に保存するかどうか。Falseの場合はflush()を呼び出すまで保存しません。
 
         戻り値:
             None
         """
         self.vector_index.remove(ids)
-        self.__save()
+        self.__mark_dirty(autosave)
         
-    def restore(self, ids: Union[int, List[int]]):
+    def restore(self, ids: Union[int, List[int]], autosave: bool = True):
         """
         指定されたIDのベクトルを復元します。
 
         引数:
             ids (Union[int, List[int]]): 復元するベクトルのIDまたはIDのリスト
+            autosave (bool): 復元後に保存するかどうか。Falseの場合はflush()を呼び出すまで保存しません。
 
         戻り値:
             None
         """
         self.vector_index.unmark_deleted(ids)
-        self.__save()
+        self.__mark_dirty(autosave)
         self.logger.info(f"Vectors {ids} have been restored.")
 
     def search(self, query: str, k: int = 5) -> List[Dict[str, Any]]:
@@ -127,36 +157,101 @@ class VectorSearch:
                 'full_text': str  # 全文のテキスト
             }
         """
-        query_embedding = self.embedding.embed_single(query)
+        hits = self.__find_hits(query, k)
+
+        # チャンクは結果ごとに順番に読み込まず、キャッシュにないものだけをパックの範囲を指定してまとめて並列に読み込む
+        chunk_contents = self.chunk_store.read_many([(chunk_id, blob_info.get('chunk')) for _, _, chunk_id, blob_info in hits])
+        return self.__build_results(hits, chunk_contents)
+
+    async def asearch(self, query: str, k: int = 5, async_blob_manager: Optional[AsyncBlobManager] = None) -> List[Dict[str, Any]]:
+        """
+        searchの非同期版です。キャッシュにないチャンクを、async_blob_managerを指定した場合はスレッドを使わずに
+        asyncio.gatherで並行に読み込みます。ベクトルインデックスの検索とマッピングの読み込みはスレッドで実行します。
+
+        引数:
+            query (str): 検索クエリ
+            k (int): 返す結果の数
+            async_blob_manager (Optional[AsyncBlobManager]): チャンクの読み込みに使用するオープン済みのAsyncBlobManager。
+                Noneの場合はBlobManagerでの読み込みをスレッドで実行します。
+
+        戻り値:
+            List[Dict[str, Any]]: 検索結果のリスト。形式はsearchと同じです。
+        """
+        hits = await asyncio.to_thread(self.__find_hits, query, k)
+        chunk_contents = await self.chunk_store.aread_many([(chunk_id, blob_info.get('chunk')) for _, _, chunk_id, blob_info in hits],
+                                                           async_blob_manager)
+        return self.__build_results(hits, chunk_contents)
+
+    def __find_hits(self, query: str, k: int) -> List[Tuple[Any, Any, str, Dict[str, Any]]]:
+        """
+        ベクトルインデックスを検索し、(ドキュメントID, スコア, チャンクID, Blob情報)のリストを返します。
+        """
+        query_embedding = self.__normalize(self.embedding.embed_single(query))
         vector_ids, vector_distances = self.vector_index.search(query_embedding, k=k)
-        
-        results = []
-        for doc_id, score in zip(vector_ids, vector_distances):
-            chunk_id = self.chunk_index_mapping.get_chunk_id('vector', doc_id)
-            if chunk_id:
-                chunk_data = json.loads(self.blob_manager.read(self.container_name, f'chunks/chunk_{chunk_id}.json'))
-                chunk_text = chunk_data.get('text', '')
-                blob_info = self.chunk_blob_mapping.get_blob_info(chunk_id)
-                document_name = blob_info.get('blob', 'ファイルが見つかりません') if blob_info else 'ファイルが見つかりません'
-                page_number = chunk_data.get('page_number', '')
-                
-                results.append({
-                    'id': int(doc_id), 
-                    'score': float(score),  
-                    'chunk': chunk_text,
-                    'document_name': document_name,
-                    'page_number': int(page_number) if page_number else '',  
-                })
-        
-        return results
+
+        # 他のインスタンスによる追加や削除を反映するため、マッピングは結果ごとではなく検索ごとに1回だけ読み込む
+        index_ids = self.chunk_index_mapping.snapshot('vector')
+        blob_infos = self.chunk_blob_mapping.snapshot()
+
+        return [(doc_id, score, chunk_id, blob_infos.get(chunk_id) or {}) for doc_id, score in zip(vector_ids, vector_distances)
+                if (chunk_id := index_ids.get(doc_id))]
+
+    @staticmethod
+    def __build_results(hits: List[Tuple[Any, Any, str, Dict[str, Any]]], chunk_contents: Dict[str, bytes]) -> List[Dict[str, Any]]:
+        """
+        検索結果とチャンクのレコードから、searchの戻り値の形式の結果を作成します。
+        """
+        decode = ChunkStore.decode_chunk
+        chunks = [(doc_id, score, *decode(chunk_contents[chunk_id]), blob_info) for doc_id, score, chunk_id, blob_info in hits]
+
+        return [{
+            'id': int(doc_id),
+            'score': float(score),
+            'chunk': text,
+            'document_name': blob_info.get('blob', 'ファイルが見つかりません'),
+            'page_number': int(page_number) if page_number else '',
+        } for doc_id, score, text, page_number, blob_info in chunks]
     
+    def flush(self):
+        """
+        保存していない変更がある場合、ベクトルインデックスをBlobストレージに保存します。
+        """
+        if self.__dirty:
+            self.__save()
+
+    def __mark_dirty(self, autosave: bool):
+        """
+        変更があったことを記録し、autosaveがTrueの場合はすぐに保存します。
+        """
+        self.__dirty = True
+        if autosave:
+            self.__save()
+
+    @staticmethod
+    def __normalize(embeddings: np.ndarray) -> np.ndarray:
+        """
+        埋め込みベクトルをL2ノルムが1になるようにその場で正規化します。
+        各要素が[-1, 1]に収まるため、'float8'形式のインデックスにも追加できます（ただし量子化によりスコアと順位は変わります）。
+
+        引数:
+            embeddings (np.ndarray): 1次元または2次元の埋め込みベクトル（float32型）
+
+        戻り値:
+            np.ndarray: 正規化した埋め込みベクトル
+        """
+        norms = np.linalg.norm(embeddings, axis=-1, keepdims=True)
+        np.divide(embeddings, norms, out=embeddings, where=norms > 0)
+        return embeddings
+
     def __save(self):
         """
         ベクトルインデックスをBlobストレージに保存します。
+        アップロードするデータ量を減らすため、インデックスはzstdで圧縮して保存します。
         """
         try:
-            index_data = self.vector_index.export()
-            self.blob_manager.upload(self.container_name, self.blob_name, index_data)
+            index_data = compress(self.vector_index.export().getbuffer())
+            self.blob_manager.upload(self.container_name, self.blob_name, index_data, max_concurrency=self.UPLOAD_MAX_CONCURRENCY)
+            self.__dirty = False
             self.logger.info(f"Index saved to '{self.container_name}/{self.blob_name}'.")
         except Exception as e:
             self.logger.error(f"Error occurred while saving index: {str(e)}")